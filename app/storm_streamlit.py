@@ -52,16 +52,50 @@ class DisplayLogs:
             self.update_log()
             time.sleep(0.1)
 
-def log_ui(disp_log, storm_agent):
+class DisplaySections:
+    """Collect the text streamed by the writers, keyed by the outline path of
+    the part being written, e.g. (section title, subsection title)."""
+    def __init__(self):
+        self.sections = {}
+        self._lock = threading.Lock()
+
+    def on_delta(self, key, delta):
+        # called from the section writer threads, only the ui loop reads sections
+        with self._lock:
+            self.sections[key] = self.sections.get(key, '') + delta
+
+    def to_markdown(self):
+        with self._lock:
+            sections = list(self.sections.items())
+        # a subsection is rendered a level below its section
+        return '\n\n'.join(f"{'#' * (3 + len(key))} {' / '.join(key)}\n{text}" for key, text in sections)
+
+def run_storm(storm_agent, errors):
+    """Target of the storm thread, the ui loop waits while the state is
+    RUNNING so it is reset even if the pipeline raises."""
+    try:
+        storm_agent.run_pipeline()
+    except Exception as e:
+        logger.exception(f"STORM pipeline failed: {e}")
+        errors.append(e)
+    finally:
+        storm_agent.state = STORMStatus.STOP
+
+def log_ui(disp_log, storm_agent, disp_sections=None):
     with st.expander("LOGGING"):
         placeholder = st.empty()
-        while storm_agent.state == STORMStatus.RUNNING:
-            log = disp_log.displayed_logs
-            if log != '':
-                placeholder.code(log)
-            time.sleep(0.1)
-
-        disp_log.close_log()
+    # sections are rendered while they are written, replaced by the final article
+    sections_placeholder = st.empty()
+    while storm_agent.state == STORMStatus.RUNNING:
+        log = disp_log.displayed_logs
+        if log != '':
+            placeholder.code(log)
+        if disp_sections is not None and disp_sections.sections:
+            sections_placeholder.markdown(disp_sections.to_markdown())
+        time.sleep(0.1)
+    sections_placeholder.empty()
+
+    disp_log.close_log()
 
 def article_ui(topic_of_interest, article_md_str):
     with st.expander(f"{topic_of_interest}"):
@@ -153,8 +187,12 @@ def main():
                           outline_llm="moonshot-v1-32k",
                           article_llm="moonshot-v1-32k",)
         storm_agent = STORM(cfg)
-        storm_agent.init()
-        storm_thread = threading.Thread(target=storm_agent.run_pipeline)
+        disp_sections = DisplaySections()
+        storm_agent.init(on_delta=disp_sections.on_delta)
+        # running before the thread starts, or the ui loop may exit at once
+        storm_agent.state = STORMStatus.RUNNING
+        storm_errors = []
+        storm_thread = threading.Thread(target=run_storm, args=(storm_agent, storm_errors))
 
         # init log thread
         disp_log = DisplayLogs()
@@ -167,10 +205,13 @@ def main():
         log_thread.start()
 
         # display log using a while loop
-        log_ui(disp_log, storm_agent)
+        log_ui(disp_log, storm_agent, disp_sections)
 
-        # display the final article
-        article_ui(topic_of_interest, storm_agent.final_article)
+        # display the final article, or why there is none
+        if storm_errors:
+            st.exception(storm_errors[0])
+        else:
+            article_ui(topic_of_interest, storm_agent.final_article)
 
     # display_featured_article()
 
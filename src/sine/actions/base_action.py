@@ -1,13 +1,15 @@
 from abc import ABC
 from sine.common.schema import ActionReturn, ActionStatusCode
+import asyncio
 import inspect
 import logging
 import re
 from abc import ABCMeta
-from copy import deepcopy
+from copy import copy, deepcopy
 from functools import wraps
 from typing import Callable, Optional, Type, get_args, get_origin
 from sine.actions.parser import BaseParser, ParseError, JsonParser
+from sine.common.single_flight import TOOL_FLIGHTS, flight_key
 
 try:
     from typing import Annotated
@@ -329,9 +331,63 @@ class BaseAction(metaclass=AutoRegister(TOOL_REGISTRY, ToolMeta)):
         self._enable = enable
 
     def __call__(self, inputs: str, name='run') -> ActionReturn:
+        """Call the API ``name`` with ``inputs``.
+
+        Identical calls of actions of the same class and configuration (see
+        :meth:`_flight_config`) which are in flight at the same time are made
+        once, the others wait for its result.
+        """
+        inputs, error_return = self._parse_inputs(inputs, name)
+        if error_return is not None:
+            return error_return
+        try:
+            outputs = TOOL_FLIGHTS.do(self._flight_key(name, inputs),
+                                      lambda: getattr(self, name)(**inputs))
+        except Exception as exc:
+            return ActionReturn(
+                inputs,
+                type=self.name,
+                errmsg=str(exc),
+                state=ActionStatusCode.API_ERROR)
+        return self._to_action_return(inputs, outputs)
+
+    async def acall(self, inputs: str, name='run') -> ActionReturn:
+        """Asynchronous version of :meth:`__call__`.
+
+        The coroutine API ``a{name}`` (e.g. ``arun``) is awaited if the action
+        implements it, otherwise the sync API runs in a worker thread.
+        """
+        inputs, error_return = self._parse_inputs(inputs, name)
+        if error_return is not None:
+            return error_return
+        async_api = getattr(self, f'a{name}', None)
+        if async_api is not None and inspect.iscoroutinefunction(async_api):
+            acall = lambda: async_api(**inputs)
+        else:
+            acall = lambda: asyncio.to_thread(getattr(self, name), **inputs)
+        try:
+            outputs = await TOOL_FLIGHTS.ado(self._flight_key(name, inputs), acall)
+        except Exception as exc:
+            return ActionReturn(
+                inputs,
+                type=self.name,
+                errmsg=str(exc),
+                state=ActionStatusCode.API_ERROR)
+        return self._to_action_return(inputs, outputs)
+
+    def _flight_key(self, name, inputs):
+        return flight_key(type(self).__qualname__, self.name, self._flight_config(), name, inputs)
+
+    def _flight_config(self):
+        """Configuration of the instance its results depend on, the calls of
+        instances with the same configuration are coalesced. Defaults to the
+        instance itself, actions override it to share their calls."""
+        return id(self)
+
+    def _parse_inputs(self, inputs, name):
         fallback_args = {'inputs': inputs, 'name': name}
         if not hasattr(self, name):
-            return ActionReturn(
+            return None, ActionReturn(
                 fallback_args,
                 type=self.name,
                 errmsg=f'invalid API: {name}',
@@ -339,21 +395,17 @@ class BaseAction(metaclass=AutoRegister(TOOL_REGISTRY, ToolMeta)):
         try:
             inputs = self._parser.parse_inputs(inputs, name)
         except ParseError as exc:
-            return ActionReturn(
+            return None, ActionReturn(
                 fallback_args,
                 type=self.name,
                 errmsg=exc.err_msg,
                 state=ActionStatusCode.ARGS_ERROR)
-        try:
-            outputs = getattr(self, name)(**inputs)
-        except Exception as exc:
-            return ActionReturn(
-                inputs,
-                type=self.name,
-                errmsg=str(exc),
-                state=ActionStatusCode.API_ERROR)
+        return inputs, None
+
+    def _to_action_return(self, inputs, outputs):
         if isinstance(outputs, ActionReturn):
-            action_return = outputs
+            # the outputs could be shared with the calls which waited for it
+            action_return = copy(outputs)
             if not action_return.args:
                 action_return.args = inputs
             if not action_return.type:
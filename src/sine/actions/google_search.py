@@ -1,13 +1,101 @@
+import asyncio
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Optional, Tuple, Type, Union
 
-import requests
-
 from sine.actions.base_action import BaseAction, tool_api
 from sine.actions.parser import BaseParser, JsonParser
 from sine.agents.storm.retriever import SearchEngineResult
+from sine.common.cache import CACHE_DIR, DiskCache
+from sine.common.cassette import acassette_call, cassette_call, is_replaying
+from sine.common.http import arequest, request
+from sine.common.logger import logger
 from sine.common.schema import ActionReturn, ActionStatusCode
 
+# refreshes of stale responses of all the search caches, a burst of stale
+# hits queues its refreshes instead of starting a thread each
+REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sine-search-refresh')
+
+
+class SearchCache(DiskCache):
+    """On disk cache of Serper responses.
+
+    Keyed by the normalized query, search type and number of results. A
+    response older than `ttl` is stale, it is still served for `max_stale`
+    seconds while a fresh one is fetched in the background by `executor`, at
+    most one refresh of a key at a time and none while a cassette is replayed.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(CACHE_DIR, 'search.sqlite'),
+                 max_entries: int = 20000,
+                 ttl: float = 7 * 24 * 3600,
+                 max_stale: float = 30 * 24 * 3600,
+                 executor: ThreadPoolExecutor = REFRESH_EXECUTOR) -> None:
+        super().__init__(path, max_entries=max_entries, ttl=ttl, max_stale=max_stale)
+        self.stale_hits = 0
+        self.executor = executor
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+
+    @staticmethod
+    def key(query, search_type, k) -> str:
+        normalized = ' '.join(query.lower().split())
+        key_str = json.dumps(dict(query=normalized, search_type=search_type, k=k),
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+    def lookup(self, key) -> Tuple[Optional[dict], bool]:
+        """Return (response, fresh), or (None, False) if there is no response
+        or it is too old to be served."""
+        entry = self.get_entry(key)
+        if entry is None or (self.ttl is not None and entry[1] > self.ttl + self.max_stale):
+            self.count('misses')
+            return None, False
+        if self.ttl is None or entry[1] <= self.ttl:
+            self.count('hits')
+            return entry[0], True
+
+        self.count('stale_hits')
+        return entry[0], False
+
+    def refresh(self, key, search) -> Optional[Future]:
+        """Cache the response of `search()` in the background, return the
+        future of the refresh or None if none is started."""
+        if is_replaying():
+            return None
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return None
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                status_code, response = search()
+                if status_code == 200:
+                    self.set(key, response)
+                else:
+                    logger.warning(f"Failed to refresh a stale search result: {status_code} {response}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        try:
+            return self.executor.submit(_refresh)
+        except RuntimeError:
+            # the executor is shut down, e.g. at interpreter exit
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+            return None
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['stale_hits'] = self.stale_hits
+        return stats
+
 
 class GoogleSearch(BaseAction):
     """Wrapper around the Serper.dev Google Search API.
@@ -29,6 +117,8 @@ class GoogleSearch(BaseAction):
         parser (Type[BaseParser]): The parser class to process the
             action's inputs and outputs. Defaults to :class:`JsonParser`.
         enable (bool): Whether the action is enabled. Defaults to ``True``.
+        cache (SearchCache): cache of the search responses, None means no
+            cache. Share one between the instances.
     """
 
     result_key_for_type = {
@@ -46,10 +136,11 @@ class GoogleSearch(BaseAction):
         description: Optional[dict] = None,
         parser: Type[BaseParser] = JsonParser,
         enable: bool = True,
+        cache: Optional[SearchCache] = None,
     ):
         super().__init__(description, parser, enable)
         api_key = os.environ.get("SERPER_API_KEY", api_key)
-        if api_key is None:
+        if api_key is None and not is_replaying():
             raise ValueError(
                 "Please set Serper API key either in the environment "
                 "as SERPER_API_KEY or pass it as `api_key` parameter."
@@ -57,6 +148,12 @@ class GoogleSearch(BaseAction):
         self.api_key = api_key
         self.timeout = timeout
         self.search_type = search_type
+        self.cache = cache
+
+    def _flight_config(self):
+        return dict(api_key=self.api_key,
+                    search_type=self.search_type,
+                    cache=self.cache.path if self.cache is not None else None)
 
     @tool_api
     def run(self, query: str, k: int = 10) -> ActionReturn:
@@ -68,9 +165,16 @@ class GoogleSearch(BaseAction):
             query (str): the search content
             k (int): select first k results in the search results as response
         """
-        tool_return = ActionReturn(type=self.name)
         status_code, response = self.search(query, k=k)
+        return self._to_tool_return(status_code, response, k)
+
+    async def arun(self, query: str, k: int = 10) -> ActionReturn:
+        """Asynchronous version of :meth:`run`."""
+        status_code, response = await self.asearch(query, k=k)
+        return self._to_tool_return(status_code, response, k)
 
+    def _to_tool_return(self, status_code, response, k) -> ActionReturn:
+        tool_return = ActionReturn(type=self.name)
         # convert search results to ToolReturn format
         if status_code == -1:
             tool_return.errmsg = response
@@ -147,6 +251,74 @@ class GoogleSearch(BaseAction):
                 - status_code (int): HTTP status code from Serper API.
                 - response (dict): response context with json format.
         """
+        url, headers, params = self._build_request(search_term, search_type, **kwargs)
+        key = self._cache_key(search_term, search_type, kwargs)
+
+        def _search():
+            cached = self._get_cached(key, url, headers, params)
+            if cached is not None:
+                return cached
+            return self._set_cached(key, self._post(url, headers, params))
+
+        # the api key header is left out of the recorded request
+        return cassette_call('serper', dict(url=url, params=params), _search)
+
+    async def asearch(
+        self, search_term: str, search_type: Optional[str] = None, **kwargs
+    ) -> Tuple[int, Union[dict, str]]:
+        """Asynchronous version of :meth:`search`."""
+        url, headers, params = self._build_request(search_term, search_type, **kwargs)
+        key = self._cache_key(search_term, search_type, kwargs)
+
+        async def _asearch():
+            if key is None:
+                return await self._apost(url, headers, params)
+            # sqlite is not read and written on the event loop
+            cached = await asyncio.to_thread(self._get_cached, key, url, headers, params)
+            if cached is not None:
+                return cached
+            return await asyncio.to_thread(self._set_cached, key, await self._apost(url, headers, params))
+
+        return await acassette_call('serper', dict(url=url, params=params), _asearch)
+
+    def _post(self, url, headers, params):
+        try:
+            response = request('POST', url, headers=headers, params=params, timeout=self.timeout)
+        except Exception as e:
+            return -1, str(e)
+        return response.status_code, response.json()
+
+    async def _apost(self, url, headers, params):
+        try:
+            response = await arequest('POST', url, headers=headers, params=params, timeout=self.timeout)
+        except Exception as e:
+            return -1, str(e)
+        return response.status_code, response.json()
+
+    def _cache_key(self, search_term, search_type, kwargs):
+        if self.cache is None:
+            return None
+        return self.cache.key(search_term, search_type or self.search_type, kwargs.get('k'))
+
+    def _get_cached(self, key, url, headers, params):
+        """Cached (200, response) or None, a stale response is refreshed in
+        the background."""
+        if key is None:
+            return None
+        response, fresh = self.cache.lookup(key)
+        if response is None:
+            return None
+        if not fresh:
+            self.cache.refresh(key, lambda: self._post(url, headers, params))
+        return 200, response
+
+    def _set_cached(self, key, result):
+        status_code, response = result
+        if key is not None and status_code == 200:
+            self.cache.set(key, response)
+        return result
+
+    def _build_request(self, search_term, search_type=None, **kwargs):
         headers = {
             "X-API-KEY": self.api_key or "",
             "Content-Type": "application/json",
@@ -155,13 +327,6 @@ class GoogleSearch(BaseAction):
             "q": search_term,
             **{key: value for key, value in kwargs.items() if value is not None},
         }
-        try:
-            response = requests.post(
-                f"https://google.serper.dev/{search_type or self.search_type}",
-                headers=headers,
-                params=params,
-                timeout=self.timeout,
-            )
-        except Exception as e:
-            return -1, str(e)
-        return response.status_code, response.json()
+        url = f"https://google.serper.dev/{search_type or self.search_type}"
+
+        return url, headers, params
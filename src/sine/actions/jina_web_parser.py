@@ -1,8 +1,16 @@
+import asyncio
+import codecs
+import mimetypes
+import os
 import re
-
-import requests
+from typing import Optional, Tuple, Type
+from urllib.parse import urlparse
 
 from sine.actions.base_action import BaseAction, tool_api
+from sine.actions.parser import BaseParser, JsonParser
+from sine.common.cache import CACHE_DIR, DiskCache
+from sine.common.cassette import acassette_call, cassette_call
+from sine.common.http import astream, request
 from sine.common.logger import logger
 from sine.common.utils import is_valid_url
 
@@ -19,10 +27,141 @@ def is_blocked(text):
 
     return False
 
+# block pages are short, only their head is checked
+BLOCK_CHECK_BYTES = 4096
+READ_CHUNK_BYTES = 16384
+# only the builtin types of python, not the ones of the system mime.types
+MIME_TYPES = mimetypes.MimeTypes()
+
+def _charset(content_type, default='utf-8'):
+    match = re.search(r'charset=([\w-]+)', content_type or '', re.IGNORECASE)
+    return match.group(1) if match else default
+
+
+class CappedReader:
+    """Decode a streamed body up to `max_bytes`, stop early at a block page.
+
+    `feed` returns False when the reading should stop.
+    """
+
+    def __init__(self, encoding='utf-8', max_bytes=None, block_check_bytes=BLOCK_CHECK_BYTES) -> None:
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.max_bytes = max_bytes
+        self.block_check_bytes = block_check_bytes
+        self.num_bytes = 0
+        self.truncated = False
+        self.blocked = False
+        self._parts = []
+        self._checked = False
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.max_bytes is not None and self.num_bytes + len(chunk) > self.max_bytes:
+            chunk = chunk[:self.max_bytes - self.num_bytes]
+            self.truncated = True
+        self.num_bytes += len(chunk)
+        self._parts.append(self.decoder.decode(chunk))
+
+        if not self._checked and (self.num_bytes >= self.block_check_bytes or self.truncated):
+            self._checked = True
+            self.blocked = is_blocked(''.join(self._parts)[:self.block_check_bytes])
+        return not (self.truncated or self.blocked)
+
+    def text(self) -> str:
+        return ''.join(self._parts) + self.decoder.decode(b'', final=True)
+
+
+class PageCache(DiskCache):
+    """On disk cache of the markdown of webpages, shared by the runs of all
+    topics and by processes.
+
+    A page is fresh for `ttl` seconds, then it is revalidated with a
+    conditional request on its ETag and Last-Modified validators, if the
+    reader returned them, for up to `max_stale` seconds. Blocked pages,
+    pages of rejected content types and 4xx responses are negative entries,
+    they are not fetched again for `negative_ttl` seconds. Timeouts,
+    connection errors and 5xx responses are transient, they are not cached.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(CACHE_DIR, 'pages.sqlite'),
+                 max_entries: int = 5000,
+                 ttl: float = 7 * 24 * 3600,
+                 max_stale: float = 90 * 24 * 3600,
+                 negative_ttl: float = 24 * 3600) -> None:
+        super().__init__(path, max_entries=max_entries, ttl=ttl, max_stale=max_stale)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+        self.revalidations = 0
+        self.not_modified = 0
+
+    def lookup(self, url) -> Tuple[Optional[dict], bool]:
+        """Return (entry, fresh), the entry of a stale page is returned to be
+        revalidated, (None, False) if there is no usable entry."""
+        entry = self.get_entry(url)
+        if entry is None:
+            self.count('misses')
+            return None, False
+
+        value, age = entry
+        negative = value['status'] != 200
+        if age <= (self.negative_ttl if negative else self.ttl):
+            self.count('hits')
+            self.count('negative_hits', int(negative))
+            return value, True
+        if negative:
+            self.count('misses')
+            return None, False
+
+        self.count('revalidations')
+        return value, False
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(negative_hits=self.negative_hits,
+                     revalidations=self.revalidations,
+                     not_modified=self.not_modified)
+        return stats
+
+
 class JinaWebParser(BaseAction):
-    '''JinaWebParser parse given web url content into markdown format.'''
+    '''JinaWebParser parse given web url content into markdown format.
+
+    Args:
+        description (dict): The description of the action. Defaults to ``None``.
+        parser (Type[BaseParser]): The parser class to process the
+            action's inputs and outputs. Defaults to :class:`JsonParser`.
+        enable (bool): Whether the action is enabled. Defaults to ``True``.
+        cache (PageCache): cache of the parsed pages, None means no cache.
+        max_bytes (int): pages are streamed and truncated at this size, None
+            reads them whole. The truncated pages are kept in `oversized`.
+        content_types (tuple): prefixes of the accepted content types, pages
+            of other types (e.g. pdf, zip) are not read. The reader answers
+            `text/plain` for almost every page, so the type is guessed from
+            the extension of the url, a url of a rejected type is not
+            requested at all. The type of the response is checked too.
+    '''
     jina_reader_prefix = 'https://r.jina.ai/'
 
+    def __init__(self,
+                 description: Optional[dict] = None,
+                 parser: Type[BaseParser] = JsonParser,
+                 enable: bool = True,
+                 cache: Optional[PageCache] = None,
+                 max_bytes: Optional[int] = 2 * 1024 * 1024,
+                 content_types: Tuple[str, ...] = ('text/', 'application/json', 'application/xml',
+                                                   'application/xhtml+xml', 'application/markdown')):
+        super().__init__(description, parser, enable)
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.content_types = content_types
+        # calls are coalesced per instance (the default `_flight_config`), so
+        # the pages read for a waiting call are recorded here too
+        self.oversized = [] # url and bytes read of the truncated pages
+        self.rejected = [] # url and content type of the pages not read
+
     @tool_api
     def run(self, url: str):
         '''
@@ -37,16 +176,185 @@ class JinaWebParser(BaseAction):
         else:
             logger.error(f"Invalid URL {url}")
             return -1, ''
+        if (mime_type := self._rejected_url_type(url)) is not None:
+            return -1, f"Unsupported content type {mime_type}"
 
-        try:
-            response = requests.get(jina_url, timeout=5)
-        except Exception as e:
-            return -1, str(e)
+        def _fetch():
+            entry = self._get_cached(url)
+            if entry is not None and entry.get('fresh'):
+                return entry['status'], entry['content']
+            try:
+                with request('GET', jina_url, timeout=5, headers=_conditional_headers(entry),
+                             stream=True) as response:
+                    reader = self._reader(url, response.status_code, response.headers)
+                    if reader is not None:
+                        for chunk in response.iter_content(READ_CHUNK_BYTES):
+                            if not reader.feed(chunk):
+                                break
+                    status_code, text, truncated = self._read_result(url, response.status_code,
+                                                                     response.headers, reader)
+                    return self._set_cached(url, entry, status_code, text, response.headers, truncated)
+            except Exception as e:
+                return self._failed(url, entry, e)
+
+        status_code, content = cassette_call('jina', dict(url=jina_url), _fetch)
+        return status_code, content
+
+    async def arun(self, url: str):
+        '''Asynchronous version of :meth:`run`.'''
+        if is_valid_url(url):
+            jina_url = self.jina_reader_prefix + url
+        else:
+            logger.error(f"Invalid URL {url}")
+            return -1, ''
+        if (mime_type := self._rejected_url_type(url)) is not None:
+            return -1, f"Unsupported content type {mime_type}"
+
+        async def _afetch():
+            # sqlite is not read and written on the event loop
+            entry = await asyncio.to_thread(self._get_cached, url) if self.cache is not None else None
+            if entry is not None and entry.get('fresh'):
+                return entry['status'], entry['content']
+            try:
+                async with astream('GET', jina_url, timeout=5, headers=_conditional_headers(entry)) as response:
+                    reader = self._reader(url, response.status_code, response.headers)
+                    if reader is not None:
+                        async for chunk in response.aiter_bytes(READ_CHUNK_BYTES):
+                            if not reader.feed(chunk):
+                                break
+                    status_code, text, truncated = self._read_result(url, response.status_code,
+                                                                     response.headers, reader)
+                    return await asyncio.to_thread(self._set_cached, url, entry, status_code, text,
+                                                   response.headers, truncated)
+            except Exception as e:
+                return self._failed(url, entry, e)
+
+        status_code, content = await acassette_call('jina', dict(url=jina_url), _afetch)
+        return status_code, content
+
+    def _rejected_url_type(self, url) -> Optional[str]:
+        """Content type guessed from the extension of the target url if it is
+        not accepted, else None."""
+        mime_type, _ = MIME_TYPES.guess_type(urlparse(url).path)
+        if mime_type is None or self._accepts(mime_type):
+            return None
+        self._reject(url, mime_type)
+        return mime_type
+
+    def _accepts(self, mime_type) -> bool:
+        return not mime_type or mime_type.startswith(self.content_types)
+
+    def _reject(self, url, mime_type):
+        logger.info(f"Skip {url} of content type {mime_type}")
+        self.rejected.append(dict(url=url, content_type=mime_type))
+
+    def _reader(self, url, status_code, headers) -> Optional[CappedReader]:
+        """Reader of the body, None if the body is not read."""
+        content_type = headers.get('Content-Type', '')
+        mime_type = content_type.split(';')[0].strip().lower()
+        if status_code == 304:
+            return None
+        if not self._accepts(mime_type):
+            self._reject(url, mime_type)
+            return None
+        return CappedReader(_charset(content_type), self.max_bytes)
+
+    def _read_result(self, url, status_code, headers, reader):
+        """Return (status code, text, bytes read of a truncated page or None)."""
+        if status_code == 304:
+            return status_code, '', None
+        if reader is None:
+            return -1, f"Unsupported content type {headers.get('Content-Type')}", None
+        if reader.blocked:
+            return -1, 'Blocked by the website', None
+        if reader.truncated:
+            logger.info(f"Truncated {url} at {reader.num_bytes} bytes")
+            self._report_truncated(url, reader.num_bytes)
+            return status_code, reader.text(), reader.num_bytes
+        return status_code, reader.text(), None
+
+    def _report_truncated(self, url, num_bytes):
+        if num_bytes is not None:
+            self.oversized.append(dict(url=url, bytes=num_bytes))
+
+    def _failed(self, url, entry, error):
+        """Result of a failed request (e.g. a timeout) or of a local error. It
+        says nothing lasting about the page, so no negative entry is cached,
+        the stale `entry` is returned if any."""
+        logger.warning(f"Failed to read {url}: {type(error).__name__}: {error}")
+        if entry is not None:
+            return entry['status'], entry['content']
+        return -1, str(error)
+
+    def _get_cached(self, url):
+        """Cache entry of the page with `fresh` set, or None."""
+        if self.cache is None:
+            return None
+        entry, fresh = self.cache.lookup(url)
+        if entry is None:
+            return None
+        truncated = entry.get('truncated')
+        if truncated is not None and (self.max_bytes is None or self.max_bytes > truncated):
+            # truncated at a smaller cap, the page is read again
+            return None
+        if fresh:
+            self._report_truncated(url, truncated)
+        return dict(entry, fresh=fresh)
+
+    def _set_cached(self, url, entry, status_code, text, headers=None, truncated=None):
+        """Process the response, cache it and return (status code, content).
+
+        A 304 response to the revalidation of `entry` makes it fresh again, a
+        failed revalidation returns the stale `entry`. `truncated` is the
+        bytes read of a page truncated at `max_bytes`, it is kept in the entry.
+        """
+        if status_code == 304 and entry is not None:
+            self.cache.count('not_modified')
+            entry = {name: value for name, value in entry.items() if name != 'fresh'}
+            self.cache.set(url, entry)
+            self._report_truncated(url, entry.get('truncated'))
+            return entry['status'], entry['content']
+
+        if status_code != -1:
+            status_code, text = _process_response(status_code, text)
+        if status_code != 200 and entry is not None:
+            # the revalidation failed, the stale page is better than none
+            logger.debug(f"Failed to revalidate {url} ({status_code}), use the cached page.")
+            return entry['status'], entry['content']
+        if self.cache is not None:
+            if status_code == 200:
+                headers = headers or {}
+                self.cache.set(url, dict(status=status_code,
+                                         content=text,
+                                         etag=headers.get('ETag'),
+                                         last_modified=headers.get('Last-Modified'),
+                                         truncated=truncated))
+            elif _is_negative(status_code):
+                logger.debug(f"Negative cache entry of {url}: {status_code} {text[:100]}")
+                self.cache.set(url, dict(status=status_code, content=text))
+
+        return status_code, text
+
+def _is_negative(status_code):
+    """Whether a failed page is cached: blocked pages and rejected content
+    types (-1) and client errors, but not throttling nor server errors."""
+    return status_code == -1 or (400 <= status_code < 500 and status_code not in (408, 429))
+
+def _conditional_headers(entry):
+    if entry is None:
+        return None
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers or None
 
-        if is_blocked(response.text):
-            return -1, 'Blocked by the website'
+def _process_response(status_code, text):
+    if is_blocked(text[:BLOCK_CHECK_BYTES]):
+        return -1, 'Blocked by the website'
 
-        return response.status_code, _process_markdown_content(response.text)
+    return status_code, _process_markdown_content(text)
 
 def _process_markdown_content(text):
     parts = text.split("Markdown Content:", 1)
@@ -0,0 +1,65 @@
+"""Stage artifacts of STORM pipeline addressed by their inputs."""
+
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+from sine.common.logger import LOGGER_DIR, logger
+from sine.common.utils import make_dir_if_not_exist
+
+
+def content_hash(data: Any) -> str:
+    """Stable hash of json serializable data."""
+    data_str = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data_str.encode('utf-8')).hexdigest()
+
+
+class ArtifactStore:
+    """ArtifactStore saves the output of each pipeline stage under the hash of
+    the stage inputs, i.e. config fields, prompts and the hashes of upstream
+    artifacts. A stage is only rerun when any of its inputs changes.
+
+    Artifacts are saved as `<root_dir>/<stage>/<key>.json` and shared by all
+    topics and runs.
+    """
+
+    def __init__(self, root_dir: str = None) -> None:
+        self.root_dir = root_dir or os.path.join(LOGGER_DIR, 'artifacts')
+
+    def key(self, stage: str, inputs: dict) -> str:
+        return content_hash(dict(stage=stage, inputs=inputs))
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root_dir, stage, f"{key}.json")
+
+    def exists(self, stage: str, key: str) -> bool:
+        return os.path.exists(self._path(stage, key))
+
+    def load(self, stage: str, key: str) -> Optional[Any]:
+        path = self._path(stage, key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path) as f:
+                artifact = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to load {stage} artifact {key}: {e}")
+            return None
+
+        logger.info(f"Reuse {stage} artifact {key[:12]}")
+        return artifact['data']
+
+    def save(self, stage: str, key: str, data: Any, inputs: dict = None) -> str:
+        """Save the artifact and return its content hash."""
+        path = self._path(stage, key)
+        make_dir_if_not_exist(os.path.dirname(path))
+
+        # write then rename, concurrent runs never read a partial artifact
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(stage=stage, inputs=inputs, data=data), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        return content_hash(data)
@@ -0,0 +1,136 @@
+"""Run STORM pipeline for a list of topics.
+
+Usage:
+    python -m sine.agents.storm.batch topics.txt --max-concurrent-topics 2
+
+Each line of the topics file is a topic, optionally followed by a tab and the
+reader's preference. Empty lines and lines starting with `#` are skipped.
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+from sine.agents.storm.retriever import load_sentence_transformer
+from sine.agents.storm.storm_agent import STORM, STORMConfig, STORMStatus
+from sine.agents.storm.utils import save_json, save_txt
+from sine.common.logger import LOGGER_DIR, logger
+from sine.common.utils import make_dir_if_not_exist, run_sync
+
+
+def load_topics(file_path) -> List[Tuple[str, str]]:
+    topics = []
+    with open(file_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            topic, _, preference = line.partition('\t')
+            topics.append((topic.strip(), preference.strip() or None))
+
+    return topics
+
+
+class STORMBatchRunner:
+    """STORMBatchRunner runs STORM pipeline of many topics in one event loop.
+
+    All runs share the api clients and the sentence transformer encoder, and at
+    most `max_concurrent_topics` topics run at the same time. The article and
+    stats of a topic are written to `output_dir` as soon as it finishes.
+
+    Args:
+        base_cfg (dict): STORMConfig fields shared by all topics.
+        max_concurrent_topics (int): topics running at the same time.
+        output_dir (str): where articles and stats are written.
+    """
+
+    def __init__(self,
+                 base_cfg: Dict = None,
+                 max_concurrent_topics: int = 2,
+                 output_dir: str = None) -> None:
+        self.base_cfg = base_cfg or {}
+        self.max_concurrent_topics = max_concurrent_topics
+        self.output_dir = output_dir or os.path.join(LOGGER_DIR, 'batch')
+        self.llms = {}
+        self.encoder = None
+
+    def _write_outputs(self, topic, storm, stats):
+        make_dir_if_not_exist(self.output_dir)
+        # storm is None if it failed to be created
+        topic_str = storm.topic_str if storm is not None else topic.lower().strip().replace(' ', '_')
+        if storm is not None and storm.state == STORMStatus.STOP:
+            save_txt(os.path.join(self.output_dir, f"{topic_str}.md"), storm.final_article)
+        save_json(os.path.join(self.output_dir, f"{topic_str}.stats.json"), stats)
+        with open(os.path.join(self.output_dir, 'stats.jsonl'), 'a') as f:
+            f.write(json.dumps(stats, ensure_ascii=False) + '\n')
+
+    async def _arun_topic(self, topic, preference, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            stats = dict(topic=topic, status='success')
+            storm = None
+            try:
+                # a bad config or a missing key fails this topic only
+                cfg = STORMConfig(**{**self.base_cfg, 'topic': topic, 'user_preference': preference})
+                storm = STORM(cfg)
+                storm.init(llms=self.llms, encoder=self.encoder)
+                await storm.arun_pipeline()
+            except Exception as e:
+                logger.error(f"STORM failed on topic '{topic}': {e}")
+                stats.update(status='failed', error=repr(e))
+            stats.update(seconds=round(time.perf_counter() - start, 3),
+                         pipeline=storm.stats if storm is not None else {})
+
+            self._write_outputs(topic, storm, stats)
+            logger.info(f"Finished topic '{topic}' ({stats['status']}) in {stats['seconds']}s")
+
+        return stats
+
+    async def arun(self, topics: List[Tuple[str, str]]) -> List[Dict]:
+        """Run all topics, return the stats of each topic in the given order."""
+        if self.encoder is None:
+            self.encoder = await asyncio.to_thread(load_sentence_transformer)
+
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrent_topics))
+        return await asyncio.gather(
+            *[self._arun_topic(topic, preference, semaphore) for topic, preference in topics])
+
+    def run(self, topics: List[Tuple[str, str]]) -> List[Dict]:
+        return run_sync(self.arun(topics))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run STORM pipeline for topics in a file.")
+    parser.add_argument('topics_file', help="one topic per line, optionally followed by a tab and the preference")
+    parser.add_argument('--max-concurrent-topics', type=int, default=2)
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--config', default=None, help="json file of STORMConfig fields shared by all topics")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    base_cfg = {}
+    if args.config:
+        with open(args.config) as f:
+            base_cfg = json.load(f)
+        cfg_fields = {field.name for field in dataclasses.fields(STORMConfig)}
+        unknown = set(base_cfg) - cfg_fields
+        if unknown:
+            parser.error(f"unknown STORMConfig fields: {unknown}")
+
+    runner = STORMBatchRunner(base_cfg,
+                              max_concurrent_topics=args.max_concurrent_topics,
+                              output_dir=args.output_dir)
+    all_stats = runner.run(load_topics(args.topics_file))
+
+    failed = [stats['topic'] for stats in all_stats if stats['status'] != 'success']
+    logger.info(f"Finished {len(all_stats)} topics, {len(failed)} failed: {failed}")
+
+
+if __name__ == '__main__':
+    main()
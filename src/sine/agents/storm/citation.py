@@ -4,6 +4,7 @@ from typing import Dict, List, Type
 
 from sine.agents.storm.retriever import SearchEngineResult, Source
 from sine.common.logger import logger
+from sine.models.prompt_budget import PromptBudget
 
 
 @dataclass
@@ -47,13 +48,23 @@ class CitationTable:
 class CitationManager:
     '''CitationManger manage CitationTable.'''
 
-    def __init__(self) -> None:
+    def __init__(self, prompt_budget: PromptBudget = None) -> None:
         self.article_references = CitationTable()
+        self.prompt_budget = prompt_budget
+
+    def get_citation_string(self, retrievals: List[Source], max_tokens: int = None):
+        """Numbered retrievals, if `max_tokens` is given the retrievals ranked
+        first are kept and the rest truncated or left out, the numbers still
+        follow `retrievals`."""
+        contents = [r.to_string() for r in retrievals]
+        if max_tokens is not None and self.prompt_budget is not None:
+            contents = self.prompt_budget.pack(contents, max_tokens)
 
-    def get_citation_string(self, retrievals: List[Source]):
         citation_string = ''
-        for n, r in enumerate(retrievals):
-            citation_string += f'[{n + 1}] ' + '\n'.join([r.to_string()])
+        for n, content in enumerate(contents):
+            if not content:
+                continue
+            citation_string += f'[{n + 1}] ' + content
             citation_string += '\n'
 
         return citation_string
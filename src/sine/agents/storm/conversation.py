@@ -11,6 +11,8 @@ class Conversation:
         self.max_turn = max_turn
         self.chat_history = []
         self.search_results = []
+        # turns without a question or an answer, the roles log and swallow their errors
+        self.failed_turns = 0
 
     def start_conversation(
         self, perspectivist: Type[Perspectivist], expert: Type[Expert]
@@ -22,16 +24,44 @@ class Conversation:
             writer_question, question_msg = perspectivist.chat(
                 self.topic, self.chat_history
             )
-            if writer_question and not self.is_qa_ending(writer_question):
+            if not writer_question:
+                self.failed_turns += 1
+            elif not self.is_qa_ending(writer_question):
                 expert_answer, answer_msg = expert.chat(self.topic, writer_question)
                 if expert_answer:
                     self.chat_history.append(question_msg)
                     self.chat_history.append(answer_msg)
+                else:
+                    self.failed_turns += 1
 
         # collect expert search engine results after conversation
         self.search_results.extend(expert.collected_results)
 
         return self.chat_history[1:]
+
+    async def astart_conversation(
+        self, perspectivist: Type[Perspectivist], expert: Type[Expert]
+    ):
+        # turns depend on the chat history, only the calls inside are awaited
+        for i in range(self.max_turn):
+            logger.info(f"Start the {i+1} conversation between perspectivist and expert.")
+
+            writer_question, question_msg = await perspectivist.achat(
+                self.topic, self.chat_history
+            )
+            if not writer_question:
+                self.failed_turns += 1
+            elif not self.is_qa_ending(writer_question):
+                expert_answer, answer_msg = await expert.achat(self.topic, writer_question)
+                if expert_answer:
+                    self.chat_history.append(question_msg)
+                    self.chat_history.append(answer_msg)
+                else:
+                    self.failed_turns += 1
+
+        self.search_results.extend(expert.collected_results)
+
+        return self.chat_history[1:]
     
     def export(self):
         '''export chat history to string'''
@@ -1,6 +1,13 @@
+import asyncio
+import contextvars
 import re
+from concurrent.futures import ThreadPoolExecutor
 
+from sine.agents.storm.result_store import SearchResultStore, normalize_url
+from sine.agents.storm.retriever import BM25Index
 from sine.common.logger import logger
+from sine.common.schema import ActionStatusCode
+from sine.common.trace import traced_stage
 
 
 class Expert:
@@ -9,69 +16,185 @@ class Expert:
                  search_engine,
                  gen_query_protocol,
                  answer_question_protocol,
-                 mode="T->S->A"):
+                 mode="T->S->A",
+                 on_results=None,
+                 prompt_budget=None,
+                 max_search_workers=4,
+                 max_evidence=10):
         self.llm = expert_engine
         self.search_engine = search_engine
         self.gen_query_protocol = gen_query_protocol
         self.answer_question_protocol = answer_question_protocol
         self.mode = mode
-        self.collected_results = []
-
+        # unique results by url, snippets of repeated urls are merged
+        self.result_store = SearchResultStore()
+        # called with the new search results as soon as they are found
+        self.on_results = on_results
+        # PromptBudget of the answer prompt, None means no limit
+        self.prompt_budget = prompt_budget
+        # queries of a turn are searched concurrently by at most this many workers
+        self.max_search_workers = max_search_workers
+        self.failed_queries = []
+        # snippets of the results ranked against the question of each answer,
+        # at most `max_evidence` of them go into the answer prompt
+        self.max_evidence = max_evidence
+        self.evidence_index = BM25Index()
+        self._indexed_snippets = set()
+
+    @traced_stage('expert_query')
     def chat_Q(self, question_str):
         message = [dict(role="user",
                         content=self.gen_query_protocol.format(question=question_str))]
 
         response = self.llm.chat(message)
-        matches = re.findall(r'- "(.*)"', response)
-        queries = [match.strip() for match in matches]
+        queries = self._parse_queries(response)
 
         logger.info(f"Expert generated search queries based on '{question_str}':\n{queries}")
 
         return queries
 
+    @traced_stage('expert_query')
+    async def achat_Q(self, question_str):
+        message = [dict(role="user",
+                        content=self.gen_query_protocol.format(question=question_str))]
+
+        response = await self.llm.achat(message)
+        queries = self._parse_queries(response)
+
+        logger.info(f"Expert generated search queries based on '{question_str}':\n{queries}")
+
+        return queries
+
+    @traced_stage('expert_query')
     def chat_T(self, topic):
         # generate search queries base on topic
         message = [dict(role="user", content=self.gen_query_protocol.format(context=topic))]
         try:
             response = self.llm.chat(message)
             logger.info(f"Expert generated search queries based on {topic}:\n{response}")
-        except BaseException:
-            logger.warning("Failed to generate search queries.")
+        except Exception as e:
+            logger.warning(f"Failed to generate search queries: {e}")
             response = ""
 
-        matches = re.findall(r'- "(.*)"', response)
-        queries = [match.strip() for match in matches]
+        return self._parse_queries(response)
 
-        return queries
+    @traced_stage('expert_query')
+    async def achat_T(self, topic):
+        message = [dict(role="user", content=self.gen_query_protocol.format(context=topic))]
+        try:
+            response = await self.llm.achat(message)
+            logger.info(f"Expert generated search queries based on {topic}:\n{response}")
+        except Exception as e:
+            logger.warning(f"Failed to generate search queries: {e}")
+            response = ""
+
+        return self._parse_queries(response)
+
+    def _parse_queries(self, response):
+        matches = re.findall(r'- "(.*)"', response)
+        return [match.strip() for match in matches]
 
     def search(self, queries, top_k: int = 5):
-        # search the internet
-        for q in queries:
-            tool_return = self.search_engine.run(q, top_k)
-            self.collected_results.extend(tool_return.result)
+        # search the internet, the queries are searched concurrently and their
+        # results merged in the query order
+        if queries:
+            # tool calls, identical searches of concurrent experts are made once
+            def _search(context, q):
+                return context.run(self.search_engine, dict(query=q, k=top_k))
+
+            contexts = [contextvars.copy_context() for _ in queries]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_search_workers, len(queries)))) as executor:
+                tool_returns = list(executor.map(_search, contexts, queries))
+            self._collect(queries, tool_returns)
         logger.debug(f"Expert search results of '[{queries}]': {self.collected_results}")
         return self.collected_results
 
+    async def asearch(self, queries, top_k: int = 5):
+        semaphore = asyncio.Semaphore(max(1, self.max_search_workers))
+
+        async def _search(q):
+            async with semaphore:
+                return await self.search_engine.acall(dict(query=q, k=top_k))
+
+        tool_returns = await asyncio.gather(*[_search(q) for q in queries])
+        self._collect(queries, tool_returns)
+        logger.debug(f"Expert search results of '[{queries}]': {self.collected_results}")
+        return self.collected_results
+
+    @property
+    def collected_results(self):
+        return self.result_store.results()
+
+    def _collect(self, queries, tool_returns):
+        """Add the results to the store and report the failed queries."""
+        results = []
+        for q, tool_return in zip(queries, tool_returns):
+            if tool_return.state != ActionStatusCode.SUCCESS:
+                error = tool_return.errmsg or str(tool_return.state)
+                logger.warning(f"Expert search of '{q}' failed: {error}")
+                self.failed_queries.append(dict(query=q, error=error))
+                continue
+            results.extend(self.result_store.add(tool_return.result or []))
+
+        if self.on_results is not None and results:
+            self.on_results(results)
+
+    @traced_stage('expert_answer')
     def chat_A(self, question_str, search_results=None, topic=None):
         # answer based on search results snippets
+        message = self._answer_message(question_str, search_results)
+
+        response = self.llm.chat(message)
+        logger.info(f"Expert answer: \n{response}")
+
+        return response
+
+    @traced_stage('expert_answer')
+    async def achat_A(self, question_str, search_results=None, topic=None):
+        message = self._answer_message(question_str, search_results)
+
+        response = await self.llm.achat(message)
+        logger.info(f"Expert answer: \n{response}")
+
+        return response
+
+    def _answer_message(self, question_str, search_results):
+        def _format(info):
+            return [dict(
+                role="user",
+                content=self.answer_question_protocol.format(
+                    question=question_str, info=info
+                ))]
+
         collected_results_str = ''
         if search_results:
-            for result in self.collected_results:
-                collected_results_str += '\n'
-                collected_results_str += result.to_string()
+            evidence = self._select_evidence(question_str, search_results)
+            if self.prompt_budget is not None:
+                # the most relevant snippets are kept first
+                evidence = self.prompt_budget.pack(evidence, self.prompt_budget.remaining(_format('')))
+            for snippet in evidence:
+                if snippet:
+                    collected_results_str += '\n'
+                    collected_results_str += snippet
         else:
             logger.warning("No search results, directly answer question")
 
-        message= [dict(
-            role="user",
-            content=self.answer_question_protocol.format(
-                question=question_str, info=collected_results_str
-            ))]
+        return _format(collected_results_str)
 
-        response = self.llm.chat(message)
-        logger.info(f"Expert answer: \n{response}")
+    def _select_evidence(self, question_str, search_results):
+        """The `max_evidence` snippets of `search_results` most relevant to the
+        question, the snippets not indexed yet are added to the index."""
+        urls = set()
+        for result in search_results:
+            url = normalize_url(result.url)
+            urls.add(url)
+            for snippet in result.snippets:
+                if (url, snippet) not in self._indexed_snippets:
+                    self._indexed_snippets.add((url, snippet))
+                    self.evidence_index.add((url, snippet), f"{result.title}\n{snippet}")
 
-        return response
+        ranked = [snippet for (url, snippet), _ in self.evidence_index.query(question_str) if url in urls]
+        return ranked[:self.max_evidence]
 
     def chat(self, topic, message, max_search_query=2):
         if self.mode == "Q->S->A":
@@ -82,7 +205,7 @@ class Expert:
         elif self.mode == "T->S->A":
             # use Topic to generate search queries, then Search,
             # and finally Answer, search queies and seach results are done only once
-            if not self.collected_results:
+            if not self.result_store:
                 queries = self.chat_T(topic)
                 search_results = self.search(queries[:max_search_query])
             search_results = self.collected_results
@@ -93,3 +216,20 @@ class Expert:
         response_msg = dict(role="assistant", content=response)
 
         return response, response_msg
+
+    async def achat(self, topic, message, max_search_query=2):
+        if self.mode == "Q->S->A":
+            queries = await self.achat_Q(message)
+            search_results = await self.asearch(queries[:max_search_query])
+        elif self.mode == "T->S->A":
+            if not self.result_store:
+                queries = await self.achat_T(topic)
+                search_results = await self.asearch(queries[:max_search_query])
+            search_results = self.collected_results
+        else:
+            raise ValueError("Invalid mode.")
+
+        response = await self.achat_A(message, search_results)
+        response_msg = dict(role="assistant", content=response)
+
+        return response, response_msg
@@ -1,10 +1,13 @@
 """Perspectivist explore given topic."""
 
+import asyncio
 import re
 
 from sine.agents.storm.prompts import DEFAULT_WRITER_PERSPECTIVE
-from sine.agents.storm.utils import get_wiki_page_title_and_toc
+from sine.agents.storm.utils import (aget_wiki_page_title_and_toc,
+                                     get_wiki_page_title_and_toc)
 from sine.common.logger import logger
+from sine.common.trace import traced_stage
 from sine.common.utils import is_valid_url
 
 
@@ -22,20 +25,41 @@ class PerspectiveGenerator:
             dict(role="user", content=self.gen_wiki_url_protocol.format(topic=topic)),
         ]
 
+        urls = []
         try:
             # FIXME: relying on llm generate url is not robust
             resoponse = self.llm.chat(message)
-            urls = re.findall(r'https://[^\s]*', resoponse)
-            if not len(urls):
-                logger.critical("No related topics url parsed, please check the response.")
-            urls = [url for url in urls if is_valid_url(url)]
-        except BaseException:
-            logger.error("Failed to find related topics.")
+            urls = self._parse_urls(resoponse)
+        except Exception as e:
+            logger.error(f"Failed to find related topics: {e}")
 
         logger.info(f"Find related topics urls: {urls}")
 
         return urls
 
+    async def agen_wiki_url(self, topic):
+        message = [
+            dict(role="user", content=self.gen_wiki_url_protocol.format(topic=topic)),
+        ]
+
+        urls = []
+        try:
+            resoponse = await self.llm.achat(message)
+            urls = self._parse_urls(resoponse)
+        except Exception as e:
+            logger.error(f"Failed to find related topics: {e}")
+
+        logger.info(f"Find related topics urls: {urls}")
+
+        return urls
+
+    def _parse_urls(self, response):
+        urls = re.findall(r'https://[^\s]*', response)
+        if not len(urls):
+            logger.critical("No related topics url parsed, please check the response.")
+
+        return [url for url in urls if is_valid_url(url)]
+
     def extract_title_and_toc(self, urls):
         examples = []
         for url in urls:
@@ -48,6 +72,20 @@ class PerspectiveGenerator:
 
         return examples
 
+    async def aextract_title_and_toc(self, urls):
+        async def _extract(url):
+            try:
+                title, toc = await aget_wiki_page_title_and_toc(url)
+                return f"Title: {title}\nTable of Contents: {toc}"
+            except Exception as e:
+                logger.warning(f"Error occurs when processing {url}: {e}")
+                return None
+
+        examples = await asyncio.gather(*[_extract(url) for url in urls])
+
+        return [example for example in examples if example is not None]
+
+    @traced_stage('perspective_generation')
     def gen(self, topic, preference, max_perspective=5):
         # find related topics (wiki pages), return urls are wiki links
         urls = self.gen_wiki_url(topic)
@@ -64,19 +102,52 @@ class PerspectiveGenerator:
 
         return perspectives
 
+    @traced_stage('perspective_generation')
+    async def agen(self, topic, preference, max_perspective=5):
+        # related topics do not depend on perspectives, find them meanwhile
+        urls_task = asyncio.create_task(self.agen_wiki_url(topic))
+        generated = await self.agen_perspectives(topic, preference)
+
+        info = await self.aextract_title_and_toc(await urls_task)
+        info = "\n".join(info)
+
+        perspectives = [DEFAULT_WRITER_PERSPECTIVE]
+        perspectives.extend(generated[:max_perspective])
+
+        logger.info(f"Generated {len(perspectives)} perspectives: {perspectives}")
+
+        return perspectives
+
     def gen_perspectives(self, topic, preference):
-        message = [
-            dict(role="user", content=self.gen_perspectives_protocol.format(
-                topic=topic,
-                preference=preference)),
-        ]
+        message = self._gen_perspectives_message(topic, preference)
 
         try:
             response = self.llm.chat(message)
-        except BaseException:
-            logger.warning("Failed to generate perspectives.")
+        except Exception as e:
+            logger.warning(f"Failed to generate perspectives: {e}")
             return []
 
+        return self._parse_perspectives(response)
+
+    async def agen_perspectives(self, topic, preference):
+        message = self._gen_perspectives_message(topic, preference)
+
+        try:
+            response = await self.llm.achat(message)
+        except Exception as e:
+            logger.warning(f"Failed to generate perspectives: {e}")
+            return []
+
+        return self._parse_perspectives(response)
+
+    def _gen_perspectives_message(self, topic, preference):
+        return [
+            dict(role="user", content=self.gen_perspectives_protocol.format(
+                topic=topic,
+                preference=preference)),
+        ]
+
+    def _parse_perspectives(self, response):
         # process responses to obtain perspectives
         perspectives = []
         for s in response.split("\n"):
@@ -100,21 +171,40 @@ class Perspectivist:
     def perspective(self):
         return self._perspective
 
+    @traced_stage('question_asking')
     def chat(self, topic, chat_history):
-        if len(chat_history) == 0:
-            message_str = self.ask_question_protocol.format(
-                topic=topic,
-                persona=self.perspective
-            )
-            chat_history.append(dict(role="user", content=message_str))
+        self._init_chat_history(topic, chat_history)
 
         try:
             response = self.llm.chat(chat_history)
             logger.info(f"Perspectivist ({self._perspective}) ask: '{response}'")
-        except BaseException:
-            logger.warning("Perspectivist failed.")
+        except Exception as e:
+            logger.warning(f"Perspectivist failed: {e}")
             response = ""
 
         response_msg = dict(role="assistant", content=response)
 
         return response, response_msg
+
+    @traced_stage('question_asking')
+    async def achat(self, topic, chat_history):
+        self._init_chat_history(topic, chat_history)
+
+        try:
+            response = await self.llm.achat(chat_history)
+            logger.info(f"Perspectivist ({self._perspective}) ask: '{response}'")
+        except Exception as e:
+            logger.warning(f"Perspectivist failed: {e}")
+            response = ""
+
+        response_msg = dict(role="assistant", content=response)
+
+        return response, response_msg
+
+    def _init_chat_history(self, topic, chat_history):
+        if len(chat_history) == 0:
+            message_str = self.ask_question_protocol.format(
+                topic=topic,
+                persona=self.perspective
+            )
+            chat_history.append(dict(role="user", content=message_str))
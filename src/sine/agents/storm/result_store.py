@@ -0,0 +1,86 @@
+"""Unique search results of a research, indexed by url and content."""
+
+import hashlib
+from typing import Dict, Iterable, List
+from urllib.parse import urlsplit, urlunsplit
+
+from sine.agents.storm.retriever import SearchEngineResult
+
+
+def normalize_url(url: str) -> str:
+    """Url without fragment and trailing slash, scheme and host lowercased."""
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/')
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
+
+def _normalize_text(text: str) -> str:
+    return ' '.join(text.split()).lower()
+
+
+class SearchResultStore:
+    """Search results in the order they were first found, one per url.
+
+    A result whose url is stored already has its new snippets merged into the
+    stored one. A result of another url with the same snippets as a stored
+    one (e.g. a mirror) is dropped. Both checks are dict lookups.
+
+    The stored results are copies, the added ones are not modified.
+    """
+
+    def __init__(self, results: Iterable[SearchEngineResult] = ()) -> None:
+        self._results: Dict[str, SearchEngineResult] = {} # normalized url -> result
+        self._snippets: Dict[str, set] = {} # normalized url -> normalized snippets
+        self._content_hashes = set()
+        self.num_added = 0
+        self.num_merged_snippets = 0
+        self.add(results)
+
+    @staticmethod
+    def content_hash(result: SearchEngineResult) -> str:
+        content = '\n'.join(_normalize_text(snippet) for snippet in result.snippets)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def add(self, results: Iterable[SearchEngineResult]) -> List[SearchEngineResult]:
+        """Add `results`, return the stored results of the new urls."""
+        new_results = []
+        for result in results:
+            self.num_added += 1
+            url = normalize_url(result.url)
+            stored = self._results.get(url)
+            if stored is None:
+                digest = self.content_hash(result)
+                if result.snippets and digest in self._content_hashes:
+                    continue
+                self._content_hashes.add(digest)
+                stored = self._results[url] = SearchEngineResult(result.title, result.url, [])
+                self._snippets[url] = set()
+                new_results.append(stored)
+            elif result.snippets:
+                self.num_merged_snippets += sum(
+                    _normalize_text(snippet) not in self._snippets[url] for snippet in result.snippets)
+
+            for snippet in result.snippets:
+                normalized = _normalize_text(snippet)
+                if normalized not in self._snippets[url]:
+                    self._snippets[url].add(normalized)
+                    stored.snippets.append(snippet)
+
+        return new_results
+
+    def __contains__(self, result: SearchEngineResult) -> bool:
+        return normalize_url(result.url) in self._results
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __iter__(self):
+        return iter(self._results.values())
+
+    def results(self) -> List[SearchEngineResult]:
+        return list(self._results.values())
+
+    def stats(self) -> dict:
+        return dict(added=self.num_added,
+                    unique=len(self),
+                    duplicates=self.num_added - len(self),
+                    merged_snippets=self.num_merged_snippets)
@@ -1,6 +1,10 @@
+import math
+import re
 import uuid as uuid_generator
 from abc import ABC, abstractmethod
-from typing import List
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Any, List, Tuple
 
 import numpy as np
 from sentence_transformers import SentenceTransformer
@@ -71,11 +75,43 @@ class WebPageContent(Source):
     def to_string(self):
         return self.content
 
+    def to_dict(self) -> dict:
+        return {
+            "uuid" : str(self.uuid),
+            "title" : self.title,
+            "url" : self.url,
+            "content" : self.content
+        }
+
+    @classmethod
+    def create_from_dict(cls, data: dict):
+        assert "url" in data, "url is required"
+        assert "content" in data, "content is required"
+
+        return cls(
+            uuid=uuid_generator.UUID(data["uuid"]) if data.get("uuid") else
+                uuid_generator.uuid3(uuid_generator.NAMESPACE_URL, data["content"]),
+            title=data.get("title", ""),
+            url=data["url"],
+            content=data["content"]
+        )
+
     @classmethod
     def from_search(cls, search_engine_result: SearchEngineResult, web_scraper):
         '''Scrape web page content'''
 
         status_code, content = web_scraper.run(search_engine_result.url)
+        return cls._from_scraped(search_engine_result, status_code, content)
+
+    @classmethod
+    async def afrom_search(cls, search_engine_result: SearchEngineResult, web_scraper):
+        '''Asynchronous version of `from_search`, web_scraper should implement `arun`.'''
+
+        status_code, content = await web_scraper.arun(search_engine_result.url)
+        return cls._from_scraped(search_engine_result, status_code, content)
+
+    @classmethod
+    def _from_scraped(cls, search_engine_result: SearchEngineResult, status_code, content):
         if status_code == 200:
             uuid = uuid_generator.uuid3(uuid_generator.NAMESPACE_URL, content)
             return cls(
@@ -115,19 +151,52 @@ class WebPageContent(Source):
 
         return chunks_webpage
 
+@lru_cache(maxsize=None)
+def load_sentence_transformer(model_name: str = 'paraphrase-MiniLM-L6-v2'):
+    '''Load the encoder once per process, retrievers of all runs share it.'''
+    logger.info(f"Loading sentence transformer {model_name}")
+    return SentenceTransformer(model_name)
+
 class SentenceTransformerRetriever:
     '''Navie embedder and retrieval model using sentence transformer.'''
-    def __init__(self):
-        self.encoder = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+    def __init__(self, encoder=None):
+        self.encoder = encoder if encoder is not None else load_sentence_transformer()
+        self.reset()
+
+    def reset(self):
+        self.embeddings = None
+        self.data_raw = []
 
     def encoding(self, data: List[Source]):
         datastr_list = [sr.to_string() for sr in data]
         self.embeddings = self.encoder.encode(datastr_list)
         self.data_raw = data
 
+    def add(self, data: List[Source]):
+        """Encode more data incrementally, keep what has been encoded."""
+        if not data:
+            return
+        embeddings = self.encoder.encode([sr.to_string() for sr in data], show_progress_bar=False)
+        if self.embeddings is None or not len(self.data_raw):
+            self.embeddings = embeddings
+        else:
+            self.embeddings = np.vstack([self.embeddings, embeddings])
+        self.data_raw = list(self.data_raw) + list(data)
+
+    def keep(self, data: List[Source]):
+        """Keep the encoded rows of `data` only, in the order of `data`, as if
+        `encoding(data)` was called. Every item of `data` must be encoded."""
+        rows = {}
+        for i, sr in enumerate(self.data_raw):
+            rows.setdefault(sr.uuid, i)
+        index = [rows[sr.uuid] for sr in data]
+        self.embeddings = self.embeddings[index] if index else None
+        self.data_raw = list(data)
+
     def query(self, queries, top_k_per_query: int = 5):
         """Return semantic closest list of Source."""
-        assert len(self.embeddings), "Please encode the text first by calling the `self.encoding`."
+        assert self.embeddings is not None and len(self.embeddings), \
+            "Please encode the text first by calling the `self.encoding`."
 
         retrievals = []
         if isinstance(queries, str):
@@ -142,3 +211,59 @@ class SentenceTransformerRetriever:
                     retrievals.append(self.data_raw[i])
 
         return retrievals
+
+
+# CJK characters are tokens on their own, other text is split into words
+TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]|[^\W_]+')
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    '''Okapi BM25 keyword index, documents are added incrementally.
+
+    It needs no encoder, ranking a few hundred snippets takes about a
+    millisecond, which suits ranking evidence on every conversation turn.
+    '''
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self._lengths = []
+        self._total_length = 0
+        self._postings = defaultdict(dict) # term -> {doc index: term frequency}
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, doc_id: Any, text: str):
+        tokens = tokenize(text)
+        index = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self._lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        for term, tf in Counter(tokens).items():
+            self._postings[term][index] = tf
+
+    def query(self, query: str, top_k: int = None) -> List[Tuple[Any, float]]:
+        """Return (doc id, score) of the documents, best first, documents of
+        the same score in the order they were added."""
+        num_docs = len(self.doc_ids)
+        if not num_docs:
+            return []
+        avg_length = max(1e-6, self._total_length / num_docs)
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, tf in postings.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[index] / avg_length)
+                scores[index] += idf * tf * (self.k1 + 1) / norm
+
+        ranked = sorted(range(num_docs), key=lambda index: (-scores.get(index, 0.0), index))
+        if top_k is not None:
+            ranked = ranked[:top_k]
+        return [(self.doc_ids[index], scores.get(index, 0.0)) for index in ranked]
@@ -0,0 +1,145 @@
+"""Concurrent, polite scraping of the webpages of search results."""
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from sine.agents.storm.result_store import normalize_url
+from sine.agents.storm.retriever import SearchEngineResult, WebPageContent
+from sine.common.logger import logger
+
+
+class WebScraper:
+    """Scrape webpages with a global and a per domain concurrency limit.
+
+    Requests to a domain are also spaced by `domain_delay` seconds. Every url
+    is scraped once, the webpages scraped already are returned again. The
+    timing of each url is kept in `timings`.
+
+    Args:
+        web_scraper: scraper which implements `arun`, e.g. JinaWebParser
+        max_workers (int): webpages scraped at the same time.
+        max_per_domain (int): webpages of one domain scraped at the same time.
+        domain_delay (float): min seconds between the requests to a domain.
+        deadline (float): seconds `ascrape` waits, the webpages not scraped
+            by then are cancelled. None waits for all of them.
+        on_progress: callback `on_progress(num_done, num_total)`.
+    """
+
+    def __init__(self,
+                 web_scraper,
+                 max_workers: int = 8,
+                 max_per_domain: int = 2,
+                 domain_delay: float = 0.0,
+                 deadline: Optional[float] = None,
+                 on_progress: Optional[Callable[[int, int], None]] = None) -> None:
+        self.web_scraper = web_scraper
+        self.max_per_domain = max_per_domain
+        self.domain_delay = domain_delay
+        self.deadline = deadline
+        self.on_progress = on_progress
+        self.timings: List[Dict] = []
+        self._semaphore = asyncio.Semaphore(max(1, max_workers))
+        self._domain_semaphores = defaultdict(lambda: asyncio.Semaphore(max(1, self.max_per_domain)))
+        self._domain_next_start = defaultdict(float)
+        self._scraped: Dict[str, asyncio.Future] = {} # normalized url -> scrape task
+
+    @staticmethod
+    def domain(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    async def _wait_domain_turn(self, domain):
+        if not self.domain_delay:
+            return
+        now = time.monotonic()
+        start = max(now, self._domain_next_start[domain])
+        self._domain_next_start[domain] = start + self.domain_delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _scrape(self, sr: SearchEngineResult) -> Optional[WebPageContent]:
+        domain = self.domain(sr.url)
+        timing = dict(url=sr.url, domain=domain, status='cancelled', wait=None, seconds=None)
+        self.timings.append(timing)
+        queued = time.monotonic()
+        try:
+            # a worker slot is taken once the domain is ready, the webpages
+            # waiting for a busy domain do not hold the other domains back
+            async with self._domain_semaphores[domain]:
+                await self._wait_domain_turn(domain)
+                async with self._semaphore:
+                    start = time.monotonic()
+                    timing['wait'] = round(start - queued, 3)
+                    try:
+                        webpage = await WebPageContent.afrom_search(sr, self.web_scraper)
+                    except Exception as e:
+                        logger.warning(f"Failed to scrape {sr.url}: {e}")
+                        webpage = None
+                    timing['seconds'] = round(time.monotonic() - start, 3)
+                    timing['status'] = 'failed' if webpage is None else 'ok'
+        except asyncio.CancelledError:
+            logger.debug(f"Scraping {sr.url} cancelled.")
+            raise
+
+        return webpage
+
+    def ascrape_one(self, sr: SearchEngineResult) -> asyncio.Future:
+        """Scrape the webpage of `sr` once, return the task of its scraping."""
+        url = normalize_url(sr.url)
+        if url not in self._scraped:
+            self._scraped[url] = asyncio.ensure_future(self._scrape(sr))
+        return self._scraped[url]
+
+    async def ascrape(self, search_results: List[SearchEngineResult]) -> List[Optional[WebPageContent]]:
+        """Scrape the webpages of `search_results`, duplicated urls once.
+
+        Returns:
+            the webpages in the order of `search_results`, None for the ones
+            which failed or were cancelled by the deadline.
+        """
+        tasks = [self.ascrape_one(sr) for sr in search_results]
+        unique_tasks = list(dict.fromkeys(tasks))
+        total = len(unique_tasks)
+        logger.info(f"Scraping {total} webpages of {len(search_results)} search results ...")
+
+        num_done = 0
+        step = max(1, total // 10)
+
+        def _on_done(_):
+            nonlocal num_done
+            num_done += 1
+            if self.on_progress is not None:
+                self.on_progress(num_done, total)
+            elif num_done % step == 0 or num_done == total:
+                logger.info(f"Scraped {num_done}/{total} webpages")
+
+        for task in unique_tasks:
+            task.add_done_callback(_on_done)
+
+        if unique_tasks:
+            _, pending = await asyncio.wait(unique_tasks, timeout=self.deadline)
+            if pending:
+                logger.warning(f"Scraping deadline of {self.deadline}s passed, cancel {len(pending)} webpages.")
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+
+        return [None if task.cancelled() else task.result() for task in tasks]
+
+    def cancel(self):
+        for task in self._scraped.values():
+            task.cancel()
+
+    def stats(self) -> Dict:
+        statuses = defaultdict(int)
+        for timing in self.timings:
+            statuses[timing['status']] += 1
+        seconds = sorted(timing['seconds'] for timing in self.timings if timing['seconds'] is not None)
+        return dict(urls=len(self.timings),
+                    **statuses,
+                    seconds=round(sum(seconds), 3),
+                    max_seconds=seconds[-1] if seconds else None,
+                    slowest=sorted((t for t in self.timings if t['seconds'] is not None),
+                                   key=lambda t: -t['seconds'])[:5])
@@ -0,0 +1,171 @@
+"""Scrape, chunk and encode writing sources while the research is going on."""
+
+import asyncio
+from typing import List
+
+from sine.agents.storm.result_store import normalize_url
+from sine.agents.storm.retriever import (SearchEngineResult,
+                                         SentenceTransformerRetriever,
+                                         WebPageContent)
+from sine.common.logger import logger
+
+
+class WritingSourceStream:
+    """WritingSourceStream is a producer/consumer pipeline of writing sources.
+
+    Search results are `put` as soon as experts find them, scraper workers
+    scrape and chunk their webpages, and one encoder worker adds the chunks to
+    the retriever in batches. Every url is scraped once and every chunk is
+    encoded once. When the stream is closed the retriever keeps the chunks of
+    the final search results only, the same as encoding them at once.
+
+    `put` may be called from other threads, e.g. the thread pool of the sync
+    expert search, the results are then queued by the event loop of the stream.
+
+    Args:
+        retriever (SentenceTransformerRetriever): retriever to add chunks to,
+            it is reset when the stream starts.
+        web_scraper (WebScraper): scraper of the webpages with its domain
+            limits, its deadline applies to the webpages left when the
+            stream is closed.
+        max_chunk_size (int): max characters of a chunk
+        num_scrapers (int): number of scraper workers
+        encode_batch_size (int): max chunks encoded at once
+    """
+
+    def __init__(self,
+                 retriever: SentenceTransformerRetriever,
+                 web_scraper,
+                 max_chunk_size: int = 2000,
+                 num_scrapers: int = 8,
+                 encode_batch_size: int = 64) -> None:
+        self.retriever = retriever
+        self.web_scraper = web_scraper
+        self.max_chunk_size = max_chunk_size
+        self.num_scrapers = num_scrapers
+        self.encode_batch_size = encode_batch_size
+        self._seen_urls = set() # normalized urls
+        self._chunks = {} # normalized url -> chunks of the webpage
+        self._queued_uuids = set()
+        self._encoded_uuids = set()
+        self._scrape_queue = None
+        self._encode_queue = None
+        self._scrapers = []
+        self._encoder = None
+        self._encoding = None # retriever.add running in a thread
+        self._loop = None
+
+    def start(self):
+        """Start the workers, call it inside the event loop."""
+        self.retriever.reset()
+        self._loop = asyncio.get_running_loop()
+        self._scrape_queue = asyncio.Queue()
+        self._encode_queue = asyncio.Queue()
+        self._scrapers = [asyncio.create_task(self._scrape_worker()) for _ in range(self.num_scrapers)]
+        self._encoder = asyncio.create_task(self._encode_worker())
+
+    def put(self, search_results: List[SearchEngineResult]):
+        """Queue the webpages of search results which are not queued yet."""
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if not in_loop:
+            # asyncio.Queue is not thread safe
+            self._loop.call_soon_threadsafe(self._put, list(search_results))
+            return
+        self._put(search_results)
+
+    def _put(self, search_results):
+        for sr in search_results:
+            url = normalize_url(sr.url)
+            if url in self._seen_urls:
+                continue
+            self._seen_urls.add(url)
+            self._scrape_queue.put_nowait(sr)
+
+    async def _scrape_worker(self):
+        while True:
+            sr = await self._scrape_queue.get()
+            try:
+                webpage = await self.web_scraper.ascrape_one(sr)
+                if webpage is not None:
+                    chunks = await asyncio.to_thread(webpage.chunking, self.max_chunk_size)
+                    self._chunks[normalize_url(sr.url)] = chunks
+                    for chunk in chunks:
+                        if chunk.uuid not in self._queued_uuids:
+                            self._queued_uuids.add(chunk.uuid)
+                            self._encode_queue.put_nowait(chunk)
+            except Exception as e:
+                logger.warning(f"Failed to scrape {sr.url}: {e}")
+            finally:
+                self._scrape_queue.task_done()
+
+    async def _encode_worker(self):
+        while True:
+            batch = [await self._encode_queue.get()]
+            while len(batch) < self.encode_batch_size and not self._encode_queue.empty():
+                batch.append(self._encode_queue.get_nowait())
+            try:
+                # a cancelled encoder leaves the thread running, `acancel` waits for it
+                self._encoding = asyncio.ensure_future(asyncio.to_thread(self.retriever.add, batch))
+                await asyncio.shield(self._encoding)
+                self._encoded_uuids.update(chunk.uuid for chunk in batch)
+            except Exception as e:
+                logger.warning(f"Failed to encode {len(batch)} chunks: {e}")
+            finally:
+                for _ in batch:
+                    self._encode_queue.task_done()
+
+    async def aclose(self, search_results: List[SearchEngineResult]) -> List[WebPageContent]:
+        """Wait until every queued webpage is scraped and encoded.
+
+        Args:
+            search_results: all search results of the research, the ones not
+                streamed yet are queued first.
+
+        Returns:
+            chunks of all webpages in the order of `search_results`.
+        """
+        self.put(search_results)
+        try:
+            await asyncio.wait_for(self._scrape_queue.join(), timeout=self.web_scraper.deadline)
+        except asyncio.TimeoutError:
+            logger.warning(f"Scraping deadline of {self.web_scraper.deadline}s passed, cancel the webpages left.")
+            self._cancel_scrapers()
+        await self._encode_queue.join()
+        self.cancel()
+
+        chunks = []
+        for url in dict.fromkeys(normalize_url(sr.url) for sr in search_results):
+            chunks.extend(self._chunks.get(url, []))
+        logger.info(f"Streamed {len(chunks)} chunks of {len(self._chunks)}/{len(self._seen_urls)} webpages")
+
+        # chunks whose batch failed are encoded again, the chunks of results
+        # dropped from the research (e.g. mirrors) are removed
+        missing = list({chunk.uuid: chunk for chunk in chunks if chunk.uuid not in self._encoded_uuids}.values())
+        if missing:
+            await asyncio.to_thread(self.retriever.add, missing)
+        await asyncio.to_thread(self.retriever.keep, chunks)
+
+        return chunks
+
+    def _cancel_scrapers(self):
+        for worker in self._scrapers:
+            worker.cancel()
+        self._scrapers = []
+        self.web_scraper.cancel()
+
+    def cancel(self):
+        self._cancel_scrapers()
+        if self._encoder is not None:
+            self._encoder.cancel()
+            self._encoder = None
+
+    async def acancel(self):
+        """Cancel the workers and wait for the chunks being encoded, after it
+        the retriever is not modified by the stream anymore."""
+        self.cancel()
+        if self._encoding is not None:
+            await asyncio.wait([self._encoding])
+            self._encoding = None
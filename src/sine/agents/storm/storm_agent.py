@@ -1,13 +1,15 @@
 """STORM pipeline."""
+import asyncio
 import os
 import time
 from dataclasses import dataclass
 from enum import Enum, unique
 from itertools import chain
 
-from sine.actions.google_search import GoogleSearch
-from sine.actions.jina_web_parser import JinaWebParser
+from sine.actions.google_search import GoogleSearch, SearchCache
+from sine.actions.jina_web_parser import JinaWebParser, PageCache
 from sine.agents.storm.article import Article
+from sine.agents.storm.artifact_store import ArtifactStore, content_hash
 from sine.agents.storm.conversation import Conversation
 from sine.agents.storm.expert import Expert
 from sine.agents.storm.perspectivist import PerspectiveGenerator, Perspectivist
@@ -18,14 +20,22 @@ from sine.agents.storm.prompts import (ANSWER_QUESTION, ASK_QUESTION,
                                        REFINE_OUTLINE, WRITE_DRAFT_OUTLINE,
                                        WRITE_SECTION, WRITE_SUBSECTION,
                                        WRITER_STYLE_TECH)
+from sine.agents.storm.result_store import SearchResultStore
 from sine.agents.storm.retriever import (SearchEngineResult,
                                          SentenceTransformerRetriever,
                                          WebPageContent)
-from sine.agents.storm.utils import load_json, load_txt, save_json, save_txt
+from sine.agents.storm.scraper import WebScraper
+from sine.agents.storm.source_stream import WritingSourceStream
+from sine.agents.storm.utils import save_json, save_txt
 from sine.agents.storm.writer import ArticleWriter, OutlineWriter
+from sine.common.cassette import Cassette, use_cassette
 from sine.common.logger import LOGGER_DIR, logger
-from sine.common.utils import make_dir_if_not_exist
-from sine.models.api_model import APIModel
+from sine.common.single_flight import single_flight_stats
+from sine.common.trace import RunTrace, run_trace
+from sine.common.utils import make_dir_if_not_exist, run_sync
+from sine.models.api_model import LLMCache, Priority
+from sine.models.prompt_budget import PromptBudget
+from sine.models.router import get_llm
 
 
 @unique
@@ -56,6 +66,17 @@ class STORMConfig:
     max_chunk_size: int = 2000
     max_perspectivist: int = 8
     max_conversation_turn: int = 4
+    max_conversation_workers: int = 4 # 1 runs conversations one by one
+    max_scrape_workers: int = 8
+    max_scrape_per_domain: int = 2 # webpages of a domain scraped at the same time
+    scrape_domain_delay: float = 0.0 # min seconds between the requests to a domain
+    scrape_deadline: float = None # seconds to wait for the webpages left, the others are dropped
+    max_search_workers: int = 4 # concurrent search queries of an expert turn
+    max_expert_evidence: int = 10 # most relevant snippets in an expert answer prompt
+    stream_writing_sources: bool = True # scrape and encode webpages during research
+    max_section_workers: int = 4
+    # model names, or tiers of MODEL_TIERS (e.g. "fast-small", "large") which
+    # are routed to the healthiest provider
     conversation_llm: str = "llama3-8b-8192"
     question_asker_llm: str = "llama3-8b-8192"
     outline_llm: str = "llama3-70b-8192"
@@ -64,7 +85,42 @@ class STORMConfig:
     saved_outline_path: str = None
     saved_article_path: str = None
     saved_search_results_path: str = None
-    hack_sleep: int = 10
+    artifact_dir: str = None # defaults to LOGGER_DIR/artifacts
+    reuse_artifacts: bool = True # false reruns every stage, the artifacts are still saved
+    llm_cache_path: str = None # sqlite file of the llm response cache, None disables it
+    search_cache_path: str = None # sqlite file of the search result cache, None disables it
+    page_cache_path: str = None # sqlite file of the scraped page cache, None disables it
+    max_page_bytes: int = 2 * 1024 * 1024 # scraped pages are truncated at this size, None reads them whole
+    llm_timeout: float = 120.0 # seconds of each llm request
+    llm_max_retries: int = 3 # retries of timeouts, connection and server errors, rounds over the models of a tier
+    llm_hedge_percentile: float = None # e.g. 0.95 sends a duplicate of requests slower than p95
+    llm_base_url: str = None # send all llm requests to this server, e.g. the local stub server
+    max_prompt_tokens: int = None # prompt token budget, None is the context window of the model
+    # record the llm, search and fetch responses of a run into the cassette
+    # file, or replay them without any request ('record' or 'replay')
+    cassette_path: str = None
+    cassette_mode: str = 'record'
+    hack_sleep: int = None # deprecated and ignored, the rate limiter paces the llm calls
+
+    def __post_init__(self):
+        if self.hack_sleep is not None:
+            logger.warning("STORMConfig.hack_sleep is deprecated and ignored, "
+                           "the llm calls are paced by the provider rate limiter.")
+
+
+def _empty_sections(node):
+    """Names of the (sub)sections below `node` without any content, neither
+    their own nor of their subsections."""
+    def _has_content(node):
+        return bool(node.content and node.content.strip()) or any(_has_content(child) for child in node.children)
+
+    empty = []
+    for child in node.children:
+        if _has_content(child):
+            empty.extend(_empty_sections(child))
+        else:
+            empty.append(child.section_name)
+    return empty
 
 
 class STORM:
@@ -72,6 +128,10 @@ class STORM:
         self.cfg = cfg
         self.state = STORMStatus.READY
         self.final_article = Article(self.cfg.topic)
+        self.stats = {}
+        self.trace = None
+        self.cassette = None
+        self.scraper = None
         log_str = f"STORM config:\ntopic: {self.cfg.topic}\nmax_perspectivist: {self.cfg.max_perspectivist}" + \
                 f"\nmax_conversation_turn: {self.cfg.max_conversation_turn}" + \
                 f"\nconversation_llm:{self.cfg.conversation_llm}" + \
@@ -80,11 +140,37 @@ class STORM:
                 f"\narticle_llm: {self.cfg.article_llm}"
         logger.info(log_str)
 
-    def init(self):
-        self.conversation_llm = APIModel(self.cfg.conversation_llm)
-        self.question_asker_llm = APIModel(self.cfg.question_asker_llm)
-        self.article_llm = APIModel(self.cfg.article_llm)
-        self.outline_llm = APIModel(self.cfg.outline_llm)
+    def init(self, llms: dict = None, encoder=None, on_delta=None):
+        """Initialize llms, writers and retriever.
+
+        Args:
+            llms (dict): model name or tier to APIModel or ModelRouter, the
+                missing ones are created and added, pass the same dict to
+                share clients between runs.
+            encoder: sentence transformer of the retriever, loaded if None.
+            on_delta: callback `on_delta(key, delta)` of the outline and
+                article writers, they stream their completions if it is set.
+        """
+        llms = {} if llms is None else llms
+        llm_cache = LLMCache(self.cfg.llm_cache_path) if self.cfg.llm_cache_path else None
+        self.search_cache = SearchCache(self.cfg.search_cache_path) if self.cfg.search_cache_path else None
+        self.page_cache = PageCache(self.cfg.page_cache_path) if self.cfg.page_cache_path else None
+
+        def _get_llm(model_name, priority=Priority.NORMAL):
+            if model_name not in llms:
+                llms[model_name] = get_llm(model_name,
+                                           timeout=self.cfg.llm_timeout,
+                                           max_retries=self.cfg.llm_max_retries,
+                                           hedge_percentile=self.cfg.llm_hedge_percentile,
+                                           base_url=self.cfg.llm_base_url,
+                                           cache=llm_cache)
+            return llms[model_name].with_priority(priority)
+
+        self.conversation_llm = _get_llm(self.cfg.conversation_llm)
+        self.question_asker_llm = _get_llm(self.cfg.question_asker_llm)
+        # writing is the critical path when runs share the provider rate limits
+        self.article_llm = _get_llm(self.cfg.article_llm, priority=Priority.CRITICAL)
+        self.outline_llm = _get_llm(self.cfg.outline_llm, priority=Priority.CRITICAL)
         logger.info('initialized llms')
 
         self.outline_writer = OutlineWriter(
@@ -92,17 +178,24 @@ class STORM:
             topic=self.cfg.topic,
             preference=self.cfg.user_preference,
             draft_outline_protocol=self.cfg.draft_outline_protocol,
-            refine_outline_protocol=self.cfg.refine_outline_protocol)
+            refine_outline_protocol=self.cfg.refine_outline_protocol,
+            on_delta=on_delta,
+            prompt_budget=PromptBudget(self.cfg.outline_llm, self.cfg.max_prompt_tokens))
         self.article_writer = ArticleWriter(
             writer_llm=self.article_llm,
             topic=self.cfg.topic,
             preference=self.cfg.user_preference,
             write_section_protocol=self.cfg.write_section_protocol,
             write_subsection_protocol=self.cfg.write_subsection_protocol,
-            write_style_protocol=self.cfg.writer_style)
+            write_style_protocol=self.cfg.writer_style,
+            max_section_workers=self.cfg.max_section_workers,
+            on_delta=on_delta,
+            prompt_budget=PromptBudget(self.cfg.article_llm, self.cfg.max_prompt_tokens))
         logger.info('initialized writers')
 
-        self.retriever = SentenceTransformerRetriever()
+        self.retriever = SentenceTransformerRetriever(encoder)
+        self.artifacts = ArtifactStore(self.cfg.artifact_dir)
+        self.source_stream = None
         if self.cfg.perspectives_generator_protocol is not None:
             self.perspectives_generator = PerspectiveGenerator(
                 self.conversation_llm,
@@ -111,89 +204,338 @@ class STORM:
 
         self.state = STORMStatus.READY
 
-    def _init_conversation_roles(self):
+    async def _ainit_conversation_roles(self):
         if self.cfg.generate_perspectives:
-            perspectives = self.perspectives_generator.gen(topic=self.cfg.topic,
-                                                            preference=self.cfg.user_preference,
-                                                            max_perspective=self.cfg.max_perspectivist)
+            perspectives = await self.perspectives_generator.agen(topic=self.cfg.topic,
+                                                                  preference=self.cfg.user_preference,
+                                                                  max_perspective=self.cfg.max_perspectivist)
         else:
             perspectives = self.cfg.predefined_perspectives[:self.cfg.max_perspectivist]
         perspectivists = [Perspectivist(self.conversation_llm, perspective, self.cfg.perspectivist_ask_question_protocol) for perspective in perspectives]
-        expert = Expert(expert_engine=self.conversation_llm,
-                        search_engine=GoogleSearch(),
-                        gen_query_protocol=self.cfg.expert_gen_query_protocol,
-                        answer_question_protocol=self.cfg.expert_answer_question_protocol,
-                        mode=self.cfg.expert_mode)
-        logger.info(f'initialized {len(perspectivists)} editor agents and expert agent')
+        logger.info(f'initialized {len(perspectivists)} editor agents')
 
-        return perspectivists, expert
+        return perspectivists
 
-    def run_conversations(self):
-        perspectivists, expert = self._init_conversation_roles()
+    def _init_expert(self):
+        # every conversation owns its expert, collected results are not shared
+        return Expert(expert_engine=self.conversation_llm,
+                      search_engine=GoogleSearch(cache=self.search_cache),
+                      gen_query_protocol=self.cfg.expert_gen_query_protocol,
+                      answer_question_protocol=self.cfg.expert_answer_question_protocol,
+                      mode=self.cfg.expert_mode,
+                      on_results=self.source_stream.put if self.source_stream else None,
+                      prompt_budget=PromptBudget(self.cfg.conversation_llm, self.cfg.max_prompt_tokens),
+                      max_search_workers=self.cfg.max_search_workers,
+                      max_evidence=self.cfg.max_expert_evidence)
+
+    async def _arun_conversation(self, perspectivist, semaphore):
+        async with semaphore:
+            conversation = Conversation(self.cfg.topic, self.cfg.max_conversation_turn)
+            expert = self._init_expert()
+            _ = await conversation.astart_conversation(perspectivist, expert)
+        if expert.failed_queries:
+            self.stats.setdefault('failed_search_queries', []).extend(expert.failed_queries)
+        if conversation.failed_turns:
+            self.stats['failed_conversation_turns'] = \
+                self.stats.get('failed_conversation_turns', 0) + conversation.failed_turns
+
+        return conversation
+
+    async def arun_conversations(self):
+        perspectivists = await self._ainit_conversation_roles()
 
         # expert retrieve knowledge (currently from google search)
         # search_results is List[SearchResult]
-        search_results = []
+        # conversations are independent, at most `max_conversation_workers` of them
+        # run at the same time, gather keeps the perspectivists order so the merged
+        # results are deterministic
+        logger.info(f'run {len(perspectivists)} conversations with {self.cfg.max_conversation_workers} workers')
+        semaphore = asyncio.Semaphore(max(1, self.cfg.max_conversation_workers))
+        finished = await asyncio.gather(
+            *[self._arun_conversation(perspectivist, semaphore) for perspectivist in perspectivists])
+
+        # perspectivists find the same pages, they are scraped and encoded once
+        result_store = SearchResultStore()
         conversations = []
-        for perspectivist in perspectivists:
-            conversation = Conversation(self.cfg.topic, self.cfg.max_conversation_turn)
-            _ = conversation.start_conversation(perspectivist, expert)
+        for conversation in finished:
             conversations.append(conversation.export())
-            search_results.extend(conversation.search_results)
+            result_store.add(conversation.search_results)
+        logger.info(f"Search results of the conversations: {result_store.stats()}")
+        self.stats['search_results'] = result_store.stats()
 
-            time.sleep(self.cfg.hack_sleep)
+        return conversations, result_store.results()
 
-        return conversations, search_results
+    def run_conversations(self):
+        return run_sync(self.arun_conversations())
 
+    def _init_scraper(self):
+        return WebScraper(JinaWebParser(cache=self.page_cache, max_bytes=self.cfg.max_page_bytes),
+                          max_workers=self.cfg.max_scrape_workers,
+                          max_per_domain=self.cfg.max_scrape_per_domain,
+                          domain_delay=self.cfg.scrape_domain_delay,
+                          deadline=self.cfg.scrape_deadline)
 
-    def run_pipeline(self):
+    def _stage_inputs(self, stage, **upstream_hashes):
+        """Config fields and prompts the stage output depends on, plus the
+        hashes of the upstream artifacts it consumes."""
+        cfg = self.cfg
+        if stage == 'research':
+            inputs = dict(
+                topic=cfg.topic,
+                user_preference=cfg.user_preference,
+                generate_perspectives=cfg.generate_perspectives,
+                max_perspectivist=cfg.max_perspectivist,
+                max_conversation_turn=cfg.max_conversation_turn,
+                conversation_llm=cfg.conversation_llm,
+                question_asker_llm=cfg.question_asker_llm,
+                perspectivist_ask_question_protocol=cfg.perspectivist_ask_question_protocol,
+                expert_mode=cfg.expert_mode,
+                expert_gen_query_protocol=cfg.expert_gen_query_protocol,
+                expert_answer_question_protocol=cfg.expert_answer_question_protocol,
+                max_expert_evidence=cfg.max_expert_evidence,
+                max_prompt_tokens=cfg.max_prompt_tokens)
+            if cfg.generate_perspectives:
+                inputs.update(gen_wiki_url_protocol=cfg.gen_wiki_url_protocol,
+                              perspectives_generator_protocol=cfg.perspectives_generator_protocol)
+            else:
+                inputs.update(predefined_perspectives=cfg.predefined_perspectives)
+        elif stage == 'draft_outline':
+            inputs = dict(
+                topic=cfg.topic,
+                user_preference=cfg.user_preference,
+                outline_llm=cfg.outline_llm,
+                draft_outline_protocol=cfg.draft_outline_protocol)
+        elif stage == 'outline':
+            inputs = dict(
+                topic=cfg.topic,
+                user_preference=cfg.user_preference,
+                outline_llm=cfg.outline_llm,
+                refine_outline_protocol=cfg.refine_outline_protocol,
+                max_prompt_tokens=cfg.max_prompt_tokens)
+        elif stage == 'writing_sources':
+            inputs = dict(writing_sources=cfg.writing_sources)
+            if cfg.writing_sources == 'search_webpage':
+                # the scraping limits and the page cache change which pages make it
+                inputs.update(max_chunk_size=cfg.max_chunk_size,
+                              max_page_bytes=cfg.max_page_bytes,
+                              stream_writing_sources=cfg.stream_writing_sources,
+                              max_scrape_workers=cfg.max_scrape_workers,
+                              max_scrape_per_domain=cfg.max_scrape_per_domain,
+                              scrape_domain_delay=cfg.scrape_domain_delay,
+                              scrape_deadline=cfg.scrape_deadline,
+                              page_cache_path=cfg.page_cache_path)
+        elif stage == 'article':
+            inputs = dict(
+                topic=cfg.topic,
+                user_preference=cfg.user_preference,
+                article_llm=cfg.article_llm,
+                write_section_protocol=cfg.write_section_protocol,
+                write_subsection_protocol=cfg.write_subsection_protocol,
+                writer_style=cfg.writer_style,
+                max_prompt_tokens=cfg.max_prompt_tokens)
+        else:
+            raise ValueError(f"Unknown stage {stage}")
+
+        if stage != 'writing_sources':
+            # the completions of a stub server must not be reused by a real run
+            inputs.update(llm_base_url=cfg.llm_base_url)
+        inputs.update(upstream_hashes)
+        return inputs
+
+    async def _arun_stage(self, stage, inputs, run, complete=None):
+        """Load the artifact of the stage if its inputs are unchanged, else
+        await `run()` and save its output. Return the artifact and its hash.
+
+        An output for which `complete(output)` is false, e.g. research with
+        failed conversations, is used by this run but not saved.
+        """
+        start = time.perf_counter()
+        key = self.artifacts.key(stage, inputs)
+        # a recorded or replayed run runs every stage
+        reuse = self.cfg.reuse_artifacts and self.cassette is None
+        data = self.artifacts.load(stage, key) if reuse else None
+        reused = data is not None
+        if not reused:
+            data = await run()
+            if complete is None or complete(data):
+                self.artifacts.save(stage, key, data, inputs)
+            else:
+                logger.warning(f"The {stage} stage output is incomplete, it is not saved as an artifact.")
+        self.stats.setdefault('stages', {})[stage] = dict(
+            seconds=round(time.perf_counter() - start, 3), reused=reused)
+
+        return data, content_hash(data)
+
+    @property
+    def topic_str(self):
+        return self.cfg.topic.lower().strip().replace(' ', '_')
+
+    async def arun_pipeline(self):
+        # llm calls of the pipeline, including its tasks and threads, are traced
+        self.trace = RunTrace(self.cfg.topic)
+        self.cassette = Cassette(self.cfg.cassette_path, self.cfg.cassette_mode) if self.cfg.cassette_path else None
+        try:
+            with run_trace(self.trace), use_cassette(self.cassette):
+                return await self._arun_pipeline()
+        finally:
+            if self.source_stream is not None:
+                await self.source_stream.acancel()
+                self.source_stream = None
+            self._save_trace()
+            if self.cassette is not None:
+                self.stats['cassette'] = self.cassette.stats()
+                if self.cassette.recording:
+                    self.cassette.save()
+
+    def _save_trace(self):
+        """Save the trace next to the run outputs and log its summary table."""
+        storm_save_dir = os.path.join(LOGGER_DIR, self.topic_str)
+        make_dir_if_not_exist(storm_save_dir)
+        self.trace.save(os.path.join(storm_save_dir, "trace.json"))
+        self.stats['llm'] = self.trace.summary()
+        logger.info(f"LLM calls by stage:\n{self.trace.summary_table()}")
+
+    async def _arun_pipeline(self):
         self.state = STORMStatus.RUNNING
+        self.stats = {}
+        self.scraper = None
+        start = time.perf_counter()
+        flights_start = single_flight_stats()
 
-        topic_str = self.cfg.topic.lower().strip().replace(' ', '_')
+        topic_str = self.topic_str
         storm_save_dir = os.path.join(LOGGER_DIR, topic_str)
         make_dir_if_not_exist(storm_save_dir)
 
-        # step 1: let us explore the topics from different perspectives and
-        # gather the information through each perspective and expert (equiped
-        # with search tools) conversation
-        conversation_history_p = os.path.join(storm_save_dir, "convsersation_history.json")
-        search_results_p = os.path.join(storm_save_dir, "search_results.json")
-        if os.path.exists(conversation_history_p) and os.path.exists(search_results_p):
-            conversation_history = load_json(conversation_history_p)
-            search_results_raw = load_json(search_results_p)
-            search_results = [SearchEngineResult.create_from_dict(sr_dict) for sr_dict in search_results_raw]
-        else:
-            conversation_history, search_results = self.run_conversations()
-            save_json(conversation_history_p, conversation_history)
-            search_results_raw = [sr.to_dict() for sr in search_results]
-            save_json(search_results_p, search_results_raw)
-
-        # step 2: let us generate the outline based on the conversation history
-        outline_p = os.path.join(storm_save_dir, "outline.txt")
-        if os.path.exists(outline_p):
-            outline_str = load_txt(outline_p)
-            outline = Article.create_from_markdown(topic=self.cfg.topic, markdown=outline_str)
-        else:
-            outline = self.outline_writer.write(conversation_history)
-            save_txt(outline_p, outline.to_markdown())
-
-        # step 3: encode writing sources
-        if self.cfg.writing_sources == 'search_webpage':
-            logger.info("scraping webpage content ...")
-            webpages = [WebPageContent.from_search(sr, JinaWebParser()) for sr in search_results]
-            writing_sources = list(chain.from_iterable(wp.chunking(self.cfg.max_chunk_size) for wp in webpages if wp is not None))
-            # writing_sources = [* wp.chunking(max_chunk_size) for wp in webpages]
-        else:
-            writing_sources = search_results
-        # step 4: let us write the article section by section
-        self.retriever.encoding(writing_sources)
-        article = self.article_writer.write(outline, self.retriever, stick_article_outline=True)
+        # the draft outline only depends on the topic, write it while researching
+        draft_outline_task = asyncio.create_task(self._arun_stage(
+            'draft_outline', self._stage_inputs('draft_outline'),
+            self.outline_writer.awrite_draft_outline))
+
+        try:
+            # webpages found by the experts are scraped, chunked and encoded
+            # while the research is going on
+            if self.cfg.writing_sources == 'search_webpage' and self.cfg.stream_writing_sources:
+                self.scraper = self._init_scraper()
+                self.source_stream = WritingSourceStream(self.retriever,
+                                                         self.scraper,
+                                                         max_chunk_size=self.cfg.max_chunk_size,
+                                                         num_scrapers=self.cfg.max_scrape_workers)
+                self.source_stream.start()
+
+            # step 1: let us explore the topics from different perspectives and
+            # gather the information through each perspective and expert (equiped
+            # with search tools) conversation
+            async def _research():
+                conversation_history, search_results = await self.arun_conversations()
+                return dict(conversations=conversation_history,
+                            search_results=[sr.to_dict() for sr in search_results])
+
+            def _research_complete(research):
+                return (bool(research['conversations'])
+                        and all(conversation.strip() for conversation in research['conversations'])
+                        and not self.stats.get('failed_conversation_turns')
+                        and not self.stats.get('failed_search_queries'))
 
-        # step 4: post process the article
-        self.final_article = article.to_markdown()
+            research, research_hash = await self._arun_stage(
+                'research', self._stage_inputs('research'), _research, _research_complete)
+            conversation_history = research['conversations']
+            search_results = [SearchEngineResult.create_from_dict(sr_dict) for sr_dict in research['search_results']]
+            save_json(os.path.join(storm_save_dir, "convsersation_history.json"), conversation_history)
+            save_json(os.path.join(storm_save_dir, "search_results.json"), research['search_results'])
+
+            # step 2: let us generate the outline based on the conversation history
+            draft_outline, draft_outline_hash = await draft_outline_task
+        finally:
+            # research failed, do not leave the draft outline llm call behind
+            if not draft_outline_task.done():
+                draft_outline_task.cancel()
+            await asyncio.gather(draft_outline_task, return_exceptions=True)
+
+        async def _outline():
+            outline = await self.outline_writer.awrite(conversation_history, draft_outline=draft_outline)
+            return outline.to_markdown()
+
+        outline_str, outline_hash = await self._arun_stage(
+            'outline',
+            self._stage_inputs('outline', draft_outline=draft_outline_hash, research=research_hash),
+            _outline)
+        outline = Article.create_from_markdown(topic=self.cfg.topic, markdown=outline_str)
+        save_txt(os.path.join(storm_save_dir, "outline.txt"), outline_str)
+
+        # step 3: scrape and chunk writing sources
+        encoded = False
+
+        async def _writing_sources():
+            nonlocal encoded
+            if self.source_stream is not None:
+                logger.info("waiting for the streamed webpage content ...")
+                sources = await self.source_stream.aclose(search_results)
+                encoded = True
+            elif self.cfg.writing_sources == 'search_webpage':
+                logger.info("scraping webpage content ...")
+                self.scraper = self._init_scraper()
+                webpages = await self.scraper.ascrape(search_results)
+                sources = chain.from_iterable(wp.chunking(self.cfg.max_chunk_size) for wp in webpages if wp is not None)
+            else:
+                sources = search_results
+            if self.page_cache is not None:
+                self.stats['page_cache'] = self.page_cache.stats()
+            if self.scraper is not None:
+                self.stats['scrape'] = self.scraper.stats()
+                self.stats['oversized_pages'] = self.scraper.web_scraper.oversized
+                self.stats['rejected_pages'] = self.scraper.web_scraper.rejected
+                save_json(os.path.join(storm_save_dir, "scrape_timings.json"), self.scraper.timings)
+            return [source.to_dict() for source in sources]
+
+        writing_sources_raw, writing_sources_hash = await self._arun_stage(
+            'writing_sources',
+            self._stage_inputs('writing_sources', research=research_hash),
+            _writing_sources)
+        if self.source_stream is not None:
+            # the stage was reused, stop the stream before the retriever is encoded
+            await self.source_stream.acancel()
+            self.source_stream = None
+
+        # step 4: let us encode the writing sources and write the article section by section
+        async def _article():
+            source_cls = WebPageContent if self.cfg.writing_sources == 'search_webpage' else SearchEngineResult
+            writing_sources = [source_cls.create_from_dict(source_dict) for source_dict in writing_sources_raw]
+            if not encoded:
+                await asyncio.to_thread(self.retriever.encoding, writing_sources)
+            article = await self.article_writer.awrite(outline, self.retriever, stick_article_outline=True)
+            return article.to_markdown()
+
+        # step 5: post process the article
+        def _article_complete(article_str):
+            article = Article.create_from_markdown(topic=self.cfg.topic, markdown=article_str)
+            # an article without citations has no references
+            empty = [name for name in _empty_sections(article.article_title_node) if name != 'References']
+            if empty:
+                logger.warning(f"Sections without content: {empty}")
+            return not empty
+
+        self.final_article, _ = await self._arun_stage(
+            'article',
+            self._stage_inputs('article', outline=outline_hash, writing_sources=writing_sources_hash),
+            _article, _article_complete)
         self.state = STORMStatus.STOP
+        # the groups are process wide, concurrent runs count each other's calls
+        flights = {name: {k: v - flights_start[name][k] for k, v in group.items()}
+                   for name, group in single_flight_stats().items()}
+        logger.info(f"Single flight saved calls: {flights}")
+        if self.search_cache is not None:
+            self.stats['search_cache'] = self.search_cache.stats()
+        self.stats.update(
+            single_flight=flights,
+            seconds=round(time.perf_counter() - start, 3),
+            num_search_results=len(search_results),
+            num_writing_sources=len(writing_sources_raw),
+            article_chars=len(self.final_article))
 
         article_p = os.path.join(storm_save_dir, f"{topic_str}.txt")
         save_txt(article_p, self.final_article)
 
         return True
+
+    def run_pipeline(self):
+        return run_sync(self.arun_pipeline())
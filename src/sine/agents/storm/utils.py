@@ -1,10 +1,13 @@
 import json
 import re
-import requests
+
 from bs4 import BeautifulSoup
 
 from semantic_text_splitter import TextSplitter, MarkdownSplitter
 
+from sine.common.cassette import acassette_call, cassette_call
+from sine.common.http import arequest, request
+
 def chunk_text(text: str, max_characters: int = 1000):
     splitter = TextSplitter(max_characters)
     return splitter.chunks(text)
@@ -45,8 +48,21 @@ def load_txt(file_path):
 def get_wiki_page_title_and_toc(url):
     """Get the main title and table of contents from an url of a Wikipedia page."""
 
-    response = requests.get(url, timeout=5)
-    soup = BeautifulSoup(response.content, "html.parser")
+    def _get():
+        return request('GET', url, timeout=5).text
+
+    return _parse_wiki_page_title_and_toc(cassette_call('wiki', dict(url=url), _get))
+
+async def aget_wiki_page_title_and_toc(url):
+    """Asynchronous version of `get_wiki_page_title_and_toc`."""
+
+    async def _aget():
+        return (await arequest('GET', url, timeout=5)).text
+
+    return _parse_wiki_page_title_and_toc(await acassette_call('wiki', dict(url=url), _aget))
+
+def _parse_wiki_page_title_and_toc(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
 
     # Get the main title from the first h1 tag
     main_title = soup.find("h1").text.replace("[edit]", "").strip().replace("\xa0", " ")
@@ -118,37 +134,3 @@ def clean_up_outline(outline, topic=""):
     outline = re.sub(r"#[#]? Appendix.*?(?=##|$)", "", outline, flags=re.DOTALL)
 
     return outline
-
-
-def limit_word_count_preserve_newline(input_string, max_word_count):
-        """
-        Limit the word count of an input string to a specified maximum, while preserving the integrity of complete lines.
-
-        The function truncates the input string at the nearest word that does not exceed the maximum word count,
-        ensuring that no partial lines are included in the output. Words are defined as text separated by spaces,
-        and lines are defined as text separated by newline characters.
-
-        Args:
-            input_string (str): The string to be truncated. This string may contain multiple lines.
-            max_word_count (int): The maximum number of words allowed in the truncated string.
-
-        Returns:
-            str: The truncated string with word count limited to `max_word_count`, preserving complete lines.
-        """
-
-        word_count = 0
-        limited_string = ''
-
-        for word in input_string.split('\n'):
-            line_words = word.split()
-            for lw in line_words:
-                if word_count < max_word_count:
-                    limited_string += lw + ' '
-                    word_count += 1
-                else:
-                    break
-            if word_count >= max_word_count:
-                break
-            limited_string = limited_string.strip() + '\n'
-
-        return limited_string.strip()
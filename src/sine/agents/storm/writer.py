@@ -1,22 +1,57 @@
+import asyncio
+import contextvars
 import copy
-import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from sine.agents.storm.article import Article, ArticleNode
 from sine.agents.storm.citation import CitationManager
 from sine.agents.storm.prompts import POLISH_PAGE, WRITE_LEAD_SECTION
-from sine.agents.storm.utils import (clean_up_outline,
-                                     limit_word_count_preserve_newline)
+from sine.agents.storm.utils import clean_up_outline
 from sine.common.logger import logger
+from sine.common.trace import traced_stage
+from sine.models.prompt_budget import PromptBudget
 
 
 class Writer(ABC):
-    def __init__(self, writer_llm) -> None:
+    """Base writer.
+
+    Args:
+        writer_llm: APIModel used to write.
+        on_delta: optional callback `on_delta(key, delta)`, when it is set the
+            completions are streamed and every delta is forwarded with the key
+            of the part being written, its outline path as a tuple of titles,
+            e.g. `(section_title, subsection_title)`, or `('outline',)`. Sections
+            are written in parallel, so it may be called from worker threads.
+    """
+
+    def __init__(self, writer_llm, on_delta=None) -> None:
         self.llm = writer_llm
+        self.on_delta = on_delta
+
+    def _gen(self, message_str, key=None):
+        logger.debug(message_str)
+        if self.on_delta is None:
+            response = self.llm.chat(message_str)
+        else:
+            deltas = []
+            for delta in self.llm.stream(message_str):
+                deltas.append(delta)
+                self.on_delta(key, delta)
+            response = ''.join(deltas).strip()
+        logger.debug(response)
+        return response
 
-    def _gen(self, message_str):
+    async def _agen(self, message_str, key=None):
         logger.debug(message_str)
-        response = self.llm.chat(message_str)
+        if self.on_delta is None:
+            response = await self.llm.achat(message_str)
+        else:
+            deltas = []
+            async for delta in self.llm.astream(message_str):
+                deltas.append(delta)
+                self.on_delta(key, delta)
+            response = ''.join(deltas).strip()
         logger.debug(response)
         return response
 
@@ -34,28 +69,54 @@ class OutlineWriter(Writer):
                  topic,
                  preference,
                  draft_outline_protocol,
-                 refine_outline_protocol) -> None:
-        super().__init__(writer_llm)
+                 refine_outline_protocol,
+                 on_delta=None,
+                 prompt_budget: PromptBudget = None) -> None:
+        super().__init__(writer_llm, on_delta)
         self.topic = topic
         self.preference = preference
         self.draft_outline_protocol = draft_outline_protocol
         self.refine_outline_protocol = refine_outline_protocol
+        self.prompt_budget = prompt_budget
 
+    @traced_stage('outline_draft')
     def write_draft_outline(self):
         message_str = self.draft_outline_protocol.format(topic=self.topic, preference=self.preference)
-        response = self._gen(message_str)
+        response = self._gen(message_str, ('draft_outline',))
 
         return clean_up_outline(response)
 
+    @traced_stage('outline_draft')
+    async def awrite_draft_outline(self):
+        message_str = self.draft_outline_protocol.format(topic=self.topic, preference=self.preference)
+        response = await self._agen(message_str, ('draft_outline',))
+
+        return clean_up_outline(response)
+
+    @traced_stage('outline_refine')
     def refine_outline(self, draft_outline, conversations):
-        message_str = self.refine_outline_protocol.format(
-                    preference=self.preference,
-                    topic=self.topic,
-                    conversation=''.join(conversations),
-                    draft_outline=draft_outline
-                )
+        return self._gen(self._refine_outline_message(draft_outline, conversations), ('outline',))
+
+    @traced_stage('outline_refine')
+    async def arefine_outline(self, draft_outline, conversations):
+        return await self._agen(self._refine_outline_message(draft_outline, conversations), ('outline',))
+
+    def _refine_outline_message(self, draft_outline, conversations):
+        def _format(conversation):
+            return self.refine_outline_protocol.format(
+                        preference=self.preference,
+                        topic=self.topic,
+                        conversation=conversation,
+                        draft_outline=draft_outline
+                    )
+
+        if self.prompt_budget is not None:
+            # conversations of all perspectives share the budget equally
+            conversations = self.prompt_budget.pack(conversations,
+                                                    self.prompt_budget.remaining(_format('')),
+                                                    priorities=[0] * len(conversations))
 
-        return self._gen(message_str)
+        return _format(''.join(conversations))
 
     def write(self, conversations):
         # TODO: Important! write a good outline is vital ! It is the skelton of the whole
@@ -80,6 +141,19 @@ class OutlineWriter(Writer):
 
         return article_outline
 
+    async def awrite(self, conversations, draft_outline=None):
+        """Asynchronous version of `write`, a draft outline written beforehand
+        (it only depends on the topic) could be passed in."""
+        if draft_outline is None:
+            draft_outline = await self.awrite_draft_outline()
+        logger.info(f"Draft outline (directly generated by llm):\n {draft_outline}")
+
+        outline_str = await self.arefine_outline(draft_outline, conversations)
+        outline_str = clean_up_outline(outline_str)
+        logger.info(f"Refined outline (improved by conversation):\n {outline_str}")
+
+        return Article.create_from_markdown(self.topic, outline_str)
+
 class ArticleWriter(Writer):
     '''ArticleWriter write section by section.'''
 
@@ -89,21 +163,48 @@ class ArticleWriter(Writer):
                  preference,
                  write_section_protocol = None,
                  write_subsection_protocol = None,
-                 write_style_protocol = None) -> None:
-        super().__init__(writer_llm)
+                 write_style_protocol = None,
+                 max_section_workers = 4,
+                 on_delta = None,
+                 prompt_budget: PromptBudget = None) -> None:
+        super().__init__(writer_llm, on_delta)
         self.topic = topic
         self.preference = preference
         self.write_section_protocol = write_section_protocol
         self.write_subsection_protocol = write_subsection_protocol
         self.write_style_protocol = write_style_protocol
-        self.citation_manager = CitationManager()
+        self.max_section_workers = max_section_workers
+        self.prompt_budget = prompt_budget
+        self.citation_manager = CitationManager(prompt_budget)
 
     @property
     def writer_system_prompt(self):
         assert self.write_style_protocol is not None, "write_style_protocol is not defined"
         return dict(role='system', content=self.write_style_protocol)
 
-    def _gen_subsection(self, title, info, prev_content):
+    def _subsection_info(self, title, retrievals, prev_content):
+        """Citation string of the retrievals which fits in what the prompt
+        budget leaves to the info."""
+        max_tokens = None
+        if self.prompt_budget is not None:
+            max_tokens = self.prompt_budget.remaining(self._subsection_message(title, '', prev_content))
+        return self.citation_manager.get_citation_string(retrievals, max_tokens)
+
+    def _section_info(self, title, retrievals):
+        max_tokens = None
+        if self.prompt_budget is not None:
+            max_tokens = self.prompt_budget.remaining(self._section_message(title, ''))
+        return self.citation_manager.get_citation_string(retrievals, max_tokens)
+
+    @traced_stage('subsection')
+    def _gen_subsection(self, title, info, prev_content, path=None):
+        return self._gen(self._subsection_message(title, info, prev_content), path or (title,))
+
+    @traced_stage('subsection')
+    async def _agen_subsection(self, title, info, prev_content, path=None):
+        return await self._agen(self._subsection_message(title, info, prev_content), path or (title,))
+
+    def _subsection_message(self, title, info, prev_content):
         assert self.write_subsection_protocol is not None, "write_subsection_protocol is not defined"
         message_str = self.write_subsection_protocol.format(
             info=info,
@@ -111,18 +212,23 @@ class ArticleWriter(Writer):
             section_title=title,
             prev_content=prev_content)
 
-        messages = [self.writer_system_prompt, dict(role='user', content=message_str)]
-        return self._gen(messages)
+        return [self.writer_system_prompt, dict(role='user', content=message_str)]
 
+    @traced_stage('section')
     def _gen_section(self, title, info):
+        return self._gen(self._section_message(title, info), (title,))
+
+    @traced_stage('section')
+    async def _agen_section(self, title, info):
+        return await self._agen(self._section_message(title, info), (title,))
+
+    def _section_message(self, title, info):
         assert self.write_section_protocol is not None, "write_section_protocol is not defined"
-        message_str = self.write_section_protocol.format(
+        return self.write_section_protocol.format(
             topic=self.topic,
             section_title=title,
             info=info)
 
-        return self._gen(message_str)
-
     def write(self,
               article_outline: Article,
               article_retriever,
@@ -141,53 +247,118 @@ class ArticleWriter(Writer):
         strictly the generated outline in previous steps. But you could customized to generate following
         subsection outlines.
         See the issue for detail reason: `https://github.com/stanford-oval/storm/issues/30`
+
+        Sections are independent and written by up to `max_section_workers` threads, subsections
+        of one section are written in order as each one continues the previous content.
         """
 
-        def _write_recursive(node, retriever, prev_content=None):
+        def _write_recursive(node, retriever, written_section, prev_content=None, path=()):
+            # titles from the section down to the node, subsection titles repeat across sections
+            path = path + (node.section_name,)
             if node.level == 2:
                 logger.info(f"Start: {'#' * node.level} {node.section_name}")
             if node.level > 2:
                 title = node.section_name
                 logger.info(f"Writing: {'#' * node.level} {title}")
                 retrievals = retriever.query(node.section_name)
-                retrievals_cid = self.citation_manager.get_citation_string(retrievals)
+                retrievals_cid = self._subsection_info(title, retrievals, prev_content)
 
-                content = self._gen_subsection(title, retrievals_cid, prev_content)
+                content = self._gen_subsection(title, retrievals_cid, prev_content, path)
                 # gen subsection often has title as the first line, remove it
                 content = _process_content(title, content)
                 # TODO: remove duplicated citation, as webpage chunks now may be from the same article
-                content = self.citation_manager.update_section_content_cite_id(content, retrievals)
-                node.content = content
-
-            # HACK: to avoid api model rate limit
-            time.sleep(15)
+                written_section.add_subsection(node, content, retrievals)
 
             # Recursively handle children if there are any
             for child_node in node.children:
-                child_content_node = _write_recursive(child_node, retriever, prev_content)
+                child_content_node = _write_recursive(child_node, retriever, written_section, prev_content, path)
                 prev_content = child_content_node.content
 
             return node
 
-        final_article = copy.deepcopy(article_outline)
-        final_article.remove_section_nodes()
-
-        for section_node in article_outline.get_sections():
+        def _write_section(section_node):
             if stick_article_outline:
-                section_content_node = _write_recursive(section_node, article_retriever)
-            else:
-                # by default generate only following the first level section title
+                written_section = WrittenSection(section_node)
+                _write_recursive(section_node, article_retriever, written_section)
+                return written_section
+
+            # by default generate only following the first level section title
+            logger.info(f"Writing: {'#' * section_node.level} {section_node.section_name}")
+            section_queries = section_node.get_children_names(include_self = True)
+            retrievals = article_retriever.query(section_queries, top_k_per_query=5)
+            retrievals_cid = self._section_info(section_node.section_name, retrievals)
+            content = self._gen_section(section_node.section_name, retrievals_cid)
+            return WrittenSection(content=content, retrievals=retrievals)
+
+        # run each section in a copy of the caller context, e.g. to keep its trace
+        sections = article_outline.get_sections()
+        contexts = [contextvars.copy_context() for _ in sections]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_section_workers)) as executor:
+            written_sections = list(executor.map(lambda ctx, node: ctx.run(_write_section, node), contexts, sections))
+
+        return self._assemble(article_outline, written_sections)
+
+    async def awrite(self,
+                     article_outline: Article,
+                     article_retriever,
+                     stick_article_outline: bool = False) -> Article:
+        """Asynchronous version of `write`."""
+
+        async def _write_recursive(node, retriever, written_section, prev_content=None, path=()):
+            path = path + (node.section_name,)
+            if node.level == 2:
+                logger.info(f"Start: {'#' * node.level} {node.section_name}")
+            if node.level > 2:
+                title = node.section_name
+                logger.info(f"Writing: {'#' * node.level} {title}")
+                retrievals = await asyncio.to_thread(retriever.query, node.section_name)
+                retrievals_cid = self._subsection_info(title, retrievals, prev_content)
+
+                content = await self._agen_subsection(title, retrievals_cid, prev_content, path)
+                content = _process_content(title, content)
+                written_section.add_subsection(node, content, retrievals)
+
+            for child_node in node.children:
+                child_content_node = await _write_recursive(child_node, retriever, written_section,
+                                                            prev_content, path)
+                prev_content = child_content_node.content
+
+            return node
+
+        semaphore = asyncio.Semaphore(max(1, self.max_section_workers))
+
+        async def _write_section(section_node):
+            async with semaphore:
+                if stick_article_outline:
+                    written_section = WrittenSection(section_node)
+                    await _write_recursive(section_node, article_retriever, written_section)
+                    return written_section
+
                 logger.info(f"Writing: {'#' * section_node.level} {section_node.section_name}")
                 section_queries = section_node.get_children_names(include_self = True)
-                retrievals = article_retriever.query(section_queries, top_k_per_query=5)
-                retrievals_cid = self.citation_manager.get_citation_string(retrievals)
-                content = self._generate_section(section_node.section_name, retrievals_cid)
-                content = self.citation_manager.update_section_content_cite_id(content, retrievals)
-                section_content_node = ArticleNode.create_from_markdown(content)
+                retrievals = await asyncio.to_thread(article_retriever.query, section_queries, top_k_per_query=5)
+                retrievals_cid = self._section_info(section_node.section_name, retrievals)
+                content = await self._agen_section(section_node.section_name, retrievals_cid)
+                return WrittenSection(content=content, retrievals=retrievals)
 
+        written_sections = await asyncio.gather(
+            *[_write_section(section_node) for section_node in article_outline.get_sections()])
+
+        return self._assemble(article_outline, written_sections)
+
+    def _assemble(self, article_outline, written_sections):
+        """Put written sections under the article title in outline order.
+
+        Section level cite ids are mapped to article level ones here, section by
+        section in outline order, so the references do not depend on which
+        section finished first.
+        """
+        final_article = copy.deepcopy(article_outline)
+        final_article.remove_section_nodes()
+
+        for written_section in written_sections:
+            section_content_node = written_section.to_article_node(self.citation_manager)
             final_article.article_title_node.add_child(section_content_node)
-            # HACK: to avoid api model rate limit
-            time.sleep(10)
 
         # add references
         reference_section_node = ArticleNode.create_from_markdown(self.citation_manager.get_article_reference_section())
@@ -195,6 +366,32 @@ class ArticleWriter(Writer):
 
         return final_article
 
+class WrittenSection:
+    """A written section whose content still has section level cite ids.
+
+    Either the section node whose subsections are written (stick to outline),
+    or the generated markdown content of the whole section.
+    """
+
+    def __init__(self, node: ArticleNode = None, content: str = None, retrievals=None) -> None:
+        self.node = node
+        self.content = content
+        self.retrievals = retrievals
+        self.subsections = []
+
+    def add_subsection(self, node: ArticleNode, content: str, retrievals):
+        node.content = content
+        self.subsections.append((node, retrievals))
+
+    def to_article_node(self, citation_manager: CitationManager) -> ArticleNode:
+        if self.node is None:
+            content = citation_manager.update_section_content_cite_id(self.content, self.retrievals)
+            return ArticleNode.create_from_markdown(content)
+
+        for node, retrievals in self.subsections:
+            node.content = citation_manager.update_section_content_cite_id(node.content, retrievals)
+        return self.node
+
 def _process_content(pattern, text):
     parts = text.split(f"{pattern}", 1)
     if len(parts) > 1:
@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from sine.common.logger import logger
+from sine.common.utils import make_dir_if_not_exist
+
+CACHE_DIR = ".sine/cache"
+
+
+class DiskCache:
+    """Persistent key value cache in a SQLite database.
+
+    Values are json serializable. Entries older than `ttl` seconds are expired
+    and the least recently used entries are evicted when there are more than
+    `max_entries`. The database could be shared by threads and processes.
+
+    Eviction scans the table, it runs every `evict_interval` writes, so the
+    cache could hold up to `evict_interval` - 1 entries more than
+    `max_entries` in between.
+
+    Args:
+        path (str): SQLite database file.
+        max_entries (int): max number of entries, None means no limit.
+        ttl (float): seconds an entry is valid, None means forever.
+        max_stale (float): seconds an expired entry is kept after its ttl, it
+            is still returned by `get_entry`, e.g. to be served while it is
+            refreshed.
+        evict_interval (int): writes between two evictions.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_entries: Optional[int] = 10000,
+                 ttl: Optional[float] = None,
+                 max_stale: float = 0.0,
+                 evict_interval: int = 100) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.evict_interval = max(1, evict_interval)
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._count_lock = threading.Lock()
+        if os.path.dirname(path):
+            make_dir_if_not_exist(os.path.dirname(path))
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                         "key TEXT PRIMARY KEY, value TEXT, "
+                         "created_at REAL, accessed_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections can not be shared by threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def count(self, name: str, n: int = 1):
+        """Add `n` to the counter attribute `name`, the caches are used by
+        several threads."""
+        with self._count_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.get_entry(key)
+        if entry is None or (self.ttl is not None and entry[1] > self.ttl):
+            self.count('misses')
+            return None
+
+        self.count('hits')
+        return entry[0]
+
+    def get_entry(self, key: str):
+        """Return (value, age in seconds) of the entry even if expired, or None."""
+        now = time.time()
+        try:
+            with self._conn() as conn:
+                row = conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read cache {self.path}: {e}")
+            return None
+
+        return json.loads(row[0]), now - row[1]
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        try:
+            with self._conn() as conn:
+                conn.execute("INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) "
+                             "VALUES (?, ?, ?, ?)", (key, json.dumps(value, ensure_ascii=False), now, now))
+                with self._count_lock:
+                    self._writes += 1
+                    evict = self._writes % self.evict_interval == 0
+                if evict:
+                    self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write cache {self.path}: {e}")
+
+    def _evict(self, conn, now):
+        if self.ttl is not None:
+            conn.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl - self.max_stale,))
+        if self.max_entries is not None:
+            num_entries = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if num_entries > self.max_entries:
+                conn.execute("DELETE FROM cache WHERE key IN "
+                             "(SELECT key FROM cache ORDER BY accessed_at ASC LIMIT ?)",
+                             (num_entries - self.max_entries,))
+
+    def delete(self, key: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, entries=len(self))
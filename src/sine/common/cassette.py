@@ -0,0 +1,153 @@
+"""Record the external responses of a run into a cassette and replay them.
+
+In record mode the llm completions, search results and fetched pages of the
+calls wrapped by `cassette_call` are saved, in replay mode the calls are
+answered from the cassette without any request, so that the CPU bound parts of
+a run can be profiled offline and without api keys.
+
+A response is keyed by its kind and request. Requests made several times are
+replayed in the order they were recorded, the last response is repeated when
+there are more calls than recorded ones.
+"""
+
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from sine.common.logger import logger
+from sine.common.utils import make_dir_if_not_exist
+
+CURRENT_CASSETTE = contextvars.ContextVar('sine_cassette', default=None)
+
+CASSETTE_MODES = ('record', 'replay')
+
+
+class CassetteMissError(LookupError):
+    """A replayed request is not in the cassette."""
+
+
+class Cassette:
+    """Responses of the external calls of a run.
+
+    The cassette is a gzip compressed json file.
+
+    Args:
+        path (str): cassette file, it is loaded in replay mode and written by
+            `save` in record mode.
+        mode (str): 'record' or 'replay'.
+    """
+
+    version = 1
+
+    def __init__(self, path: str, mode: str = 'record') -> None:
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode {mode}, expected one of {CASSETTE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.responses: Dict[str, Dict[str, List[Any]]] = defaultdict(dict)
+        self.misses = 0
+        self._cursors = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == 'replay':
+            self.load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    @staticmethod
+    def key(request) -> str:
+        request_str = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(request_str.encode('utf-8')).hexdigest()[:24]
+
+    def record(self, kind: str, request, response):
+        key = self.key(request)
+        with self._lock:
+            self.responses[kind].setdefault(key, []).append(response)
+
+    def replay(self, kind: str, request):
+        key = self.key(request)
+        with self._lock:
+            responses = self.responses.get(kind, {}).get(key)
+            if not responses:
+                self.misses += 1
+                raise CassetteMissError(f"No {kind} response of request {key} in cassette {self.path}")
+            cursor = self._cursors[(kind, key)]
+            self._cursors[(kind, key)] += 1
+
+        return responses[min(cursor, len(responses) - 1)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {kind: sum(len(r) for r in responses.values()) for kind, responses in self.responses.items()}
+        stats['misses'] = self.misses
+        return stats
+
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != self.version:
+            raise ValueError(f"Unsupported cassette version {data.get('version')} of {self.path}")
+        self.responses = defaultdict(dict, data['responses'])
+
+    def save(self):
+        if os.path.dirname(self.path):
+            make_dir_if_not_exist(os.path.dirname(self.path))
+        with self._lock:
+            data = dict(version=self.version, responses=dict(self.responses))
+            with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        logger.info(f"Saved cassette {self.path}: {self.stats()}")
+
+
+@contextmanager
+def use_cassette(cassette: Optional[Cassette]):
+    """Record or replay the wrapped calls made inside the block, including the
+    ones of the tasks and threads started from it. None does nothing."""
+    token = CURRENT_CASSETTE.set(cassette)
+    try:
+        yield cassette
+    finally:
+        CURRENT_CASSETTE.reset(token)
+
+def is_replaying() -> bool:
+    cassette = CURRENT_CASSETTE.get()
+    return cassette is not None and cassette.replaying
+
+def cassette_call(kind: str, request, call: Callable[[], Any]):
+    """Return `call()`, recorded or replayed by the current cassette if any.
+
+    `request` identifies the call, it must be json serializable and should
+    leave out secrets, e.g. api keys. The response must be json serializable.
+    """
+    cassette = CURRENT_CASSETTE.get()
+    if cassette is None:
+        return call()
+    if cassette.replaying:
+        return cassette.replay(kind, request)
+
+    response = call()
+    cassette.record(kind, request, response)
+    return response
+
+async def acassette_call(kind: str, request, acall: Callable[[], Any]):
+    """Asynchronous version of `cassette_call`, `acall()` returns an awaitable."""
+    cassette = CURRENT_CASSETTE.get()
+    if cassette is None:
+        return await acall()
+    if cassette.replaying:
+        return cassette.replay(kind, request)
+
+    response = await acall()
+    cassette.record(kind, request, response)
+    return response
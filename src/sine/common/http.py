@@ -0,0 +1,206 @@
+"""Shared keep-alive HTTP sessions of the actions.
+
+Search, scraping and Wikipedia requests go through one `requests.Session`
+and one `httpx.AsyncClient` per event loop, so the requests to a host reuse
+their connections instead of opening a TCP and TLS connection each.
+"""
+
+import asyncio
+import random
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sine.common.logger import logger
+from sine.common.utils import on_loop_close
+
+
+def _accept_encoding():
+    # brotli responses are only decoded if a brotli package is installed
+    for module in ('brotli', 'brotlicffi'):
+        try:
+            __import__(module)
+            return 'gzip, deflate, br'
+        except ImportError:
+            pass
+    return 'gzip, deflate'
+
+
+@dataclass
+class HTTPConfig:
+    """Connection pools, retries and timeouts of the shared sessions.
+
+    Args:
+        timeout: seconds to wait for the response, the callers could pass
+            their own `timeout`.
+        connect_timeout: seconds to open a connection.
+        pool_size: connections kept alive per host.
+        host_pool_sizes: `pool_size` of specific hosts, e.g. the scraper.
+        max_connections: connections of an asyncio client over all hosts.
+        keepalive_expiry: seconds an idle connection is kept.
+        max_retries: retries of connection errors and of `retry_status_codes`.
+        backoff: backoff factor of the retries, seconds.
+        retry_status_codes: response status codes which are retried.
+    """
+    timeout: float = 10.0
+    connect_timeout: float = 5.0
+    pool_size: int = 8
+    host_pool_sizes: Dict[str, int] = field(default_factory=lambda: {'r.jina.ai': 16})
+    max_connections: int = 100
+    keepalive_expiry: float = 30.0
+    max_retries: int = 2
+    backoff: float = 0.5
+    retry_status_codes: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+
+class HTTPSessions:
+    """Process wide sync session and asyncio clients, see `HTTPConfig`.
+
+    The asyncio clients are bound to the event loop they are used in, they
+    are kept per event loop and closed by `aclose` before the loop is closed.
+    Their requests to a host are limited to the pool size of the host.
+    """
+
+    def __init__(self, config: HTTPConfig = None) -> None:
+        self.config = config or HTTPConfig()
+        self.headers = {'Accept-Encoding': _accept_encoding()}
+        self._session = None
+        self._async_clients = weakref.WeakKeyDictionary() # loop -> (client, host semaphores)
+        self._lock = threading.Lock()
+
+    def configure(self, config: HTTPConfig):
+        """Use `config` for the sessions created from now on, the current
+        ones are closed."""
+        with self._lock:
+            self.config = config
+            session, self._session = self._session, None
+            async_clients, self._async_clients = self._async_clients, weakref.WeakKeyDictionary()
+        if session is not None:
+            session.close()
+        for loop, (client, _) in list(async_clients.items()):
+            # a client is closed in its own event loop, the clients of the
+            # closed loops were closed by `aclose` or by run_sync
+            if not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    async def aclose(self):
+        """Close the asyncio client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._async_clients.pop(loop, None)
+        if entry is not None:
+            await entry[0].aclose()
+            logger.debug("HTTP async client closed.")
+
+    def _timeout(self, timeout=None):
+        timeout = self.config.timeout if timeout is None else timeout
+        return min(self.config.connect_timeout, timeout), timeout
+
+    def _pool_size(self, host):
+        return self.config.host_pool_sizes.get(host, self.config.pool_size)
+
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                self._session = self._new_session()
+            return self._session
+
+    def _new_session(self) -> requests.Session:
+        cfg = self.config
+        retry = Retry(total=cfg.max_retries,
+                      backoff_factor=cfg.backoff,
+                      status_forcelist=cfg.retry_status_codes,
+                      allowed_methods=None, # the search posts are idempotent
+                      raise_on_status=False)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        # blocking pools, a host gets at most its pool size of connections
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=cfg.pool_size, max_retries=retry, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        for host, pool_size in cfg.host_pool_sizes.items():
+            host_adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+            session.mount(f'http://{host}/', host_adapter)
+            session.mount(f'https://{host}/', host_adapter)
+        logger.debug("HTTP session initialized.")
+        return session
+
+    def async_client(self) -> Tuple[httpx.AsyncClient, Dict[str, asyncio.Semaphore]]:
+        """Asyncio client of the running event loop and its host semaphores."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                self._async_clients[loop] = (self._new_async_client(), {})
+                logger.debug("HTTP async client initialized.")
+            return self._async_clients[loop]
+
+    def _new_async_client(self) -> httpx.AsyncClient:
+        cfg = self.config
+        limits = httpx.Limits(max_connections=cfg.max_connections,
+                              max_keepalive_connections=cfg.max_connections,
+                              keepalive_expiry=cfg.keepalive_expiry)
+        # the transport retries failed connections, statuses are retried by `arequest`
+        transport = httpx.AsyncHTTPTransport(limits=limits, retries=cfg.max_retries)
+        return httpx.AsyncClient(transport=transport, headers=self.headers, follow_redirects=True,
+                                 timeout=httpx.Timeout(cfg.timeout, connect=cfg.connect_timeout))
+
+    def request(self, method, url, timeout=None, **kwargs) -> requests.Response:
+        """`requests.Session.request` on the shared session."""
+        return self.session().request(method, url, timeout=self._timeout(timeout), **kwargs)
+
+    async def arequest(self, method, url, timeout=None, **kwargs) -> httpx.Response:
+        """Asynchronous version of `request`, it returns an `httpx.Response`."""
+        client, semaphores = self.async_client()
+        host = httpx.URL(url).host
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self._pool_size(host))
+        connect_timeout, timeout = self._timeout(timeout)
+
+        cfg = self.config
+        for attempt in range(cfg.max_retries + 1):
+            async with semaphores[host]:
+                response = await client.request(method, url,
+                                                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                                                **kwargs)
+            if response.status_code not in cfg.retry_status_codes or attempt == cfg.max_retries:
+                return response
+            delay = cfg.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+            logger.debug(f"{method} {url} returned {response.status_code}, retry in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def astream(self, method, url, timeout=None, **kwargs):
+        """Asynchronous streamed request, the body is read inside the block.
+
+        Unlike `arequest`, statuses are not retried.
+        """
+        client, semaphores = self.async_client()
+        host = httpx.URL(url).host
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self._pool_size(host))
+        connect_timeout, timeout = self._timeout(timeout)
+        async with semaphores[host]:
+            async with client.stream(method, url,
+                                     timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                                     **kwargs) as response:
+                yield response
+
+
+HTTP_SESSIONS = HTTPSessions()
+on_loop_close(HTTP_SESSIONS.aclose)
+
+def request(method, url, timeout=None, **kwargs) -> requests.Response:
+    return HTTP_SESSIONS.request(method, url, timeout=timeout, **kwargs)
+
+async def arequest(method, url, timeout=None, **kwargs) -> httpx.Response:
+    return await HTTP_SESSIONS.arequest(method, url, timeout=timeout, **kwargs)
+
+def astream(method, url, timeout=None, **kwargs):
+    return HTTP_SESSIONS.astream(method, url, timeout=timeout, **kwargs)
@@ -0,0 +1,111 @@
+"""Coalesce identical calls which are in flight at the same time."""
+
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict
+
+from sine.common.logger import logger
+
+
+def flight_key(*parts) -> str:
+    """Key of a call from its json serializable parts."""
+    parts_str = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(parts_str.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Calls with the same key made while one of them is in flight wait for it
+    and get its result (or error) instead of calling again.
+
+    Sync calls of different threads and asyncio calls of the same event loop
+    are coalesced, the two kinds are not coalesced together.
+
+    Args:
+        name (str): name of the group in the stats.
+        copy_result (bool): give a deep copy of the result to the calls which
+            waited, for results which are mutated by the callers.
+    """
+
+    def __init__(self, name: str, copy_result: bool = False) -> None:
+        self.name = name
+        self.copy_result = copy_result
+        self.calls = 0
+        self.saved = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks = weakref.WeakKeyDictionary() # event loop -> key -> task
+        self._lock = threading.Lock()
+
+    def _shared(self, result):
+        return copy.deepcopy(result) if self.copy_result else result
+
+    def do(self, key: str, call: Callable[[], Any]):
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.saved += 1
+
+        if not leader:
+            logger.debug(f"{self.name} call {key[:8]} is in flight, wait for it.")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._shared(flight.result)
+
+        try:
+            flight.result = call()
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def ado(self, key: str, acall: Callable[[], Awaitable[Any]]):
+        """Asynchronous version of `do`, `acall()` returns an awaitable."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.calls += 1
+            tasks = self._tasks.setdefault(loop, {})
+            task = tasks.get(key)
+            leader = task is None
+            if leader:
+                task = tasks[key] = asyncio.ensure_future(acall())
+                task.add_done_callback(lambda _: tasks.pop(key, None))
+            else:
+                self.saved += 1
+
+        if not leader:
+            logger.debug(f"{self.name} call {key[:8]} is in flight, wait for it.")
+        # a cancelled caller does not cancel the call the others wait for
+        result = await asyncio.shield(task)
+        return result if leader else self._shared(result)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(calls=self.calls, saved=self.saved)
+
+
+LLM_FLIGHTS = SingleFlight('llm')
+# tools return mutable ActionReturn
+TOOL_FLIGHTS = SingleFlight('tool', copy_result=True)
+
+def single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """Calls and saved calls of the process wide groups."""
+    return {flights.name: flights.stats() for flights in (LLM_FLIGHTS, TOOL_FLIGHTS)}
@@ -0,0 +1,129 @@
+"""Trace of the llm calls of a run, tagged with the stage which made them."""
+
+import asyncio
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+CURRENT_STAGE = contextvars.ContextVar('sine_stage', default=None)
+CURRENT_TRACE = contextvars.ContextVar('sine_trace', default=None)
+
+@contextmanager
+def stage(name: str):
+    """Tag the llm calls made inside the block with the stage `name`."""
+    token = CURRENT_STAGE.set(name)
+    try:
+        yield
+    finally:
+        CURRENT_STAGE.reset(token)
+
+def traced_stage(name: str):
+    """Decorator of a sync or async function whose llm calls are made in the
+    stage `name`."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+def record_llm_call(**fields):
+    """Add an llm call to the trace of the current run, if any."""
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.record(stage=CURRENT_STAGE.get(), **fields)
+
+
+class RunTrace:
+    """Records of the llm calls of one run.
+
+    A record has the stage, model, latency in seconds, prompt and completion
+    tokens, retries, cache status (hit, miss or off) and error if the call
+    failed.
+    """
+
+    def __init__(self, name: str = None) -> None:
+        self.name = name
+        self.started_at = time.time()
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, **fields):
+        fields.setdefault('time', round(time.time() - self.started_at, 3))
+        with self._lock:
+            self.records.append(fields)
+
+    def summary(self, by: str = 'stage') -> Dict[str, Dict]:
+        """Calls, seconds and tokens per stage (or per model with by='model')."""
+        summary = defaultdict(lambda: dict(calls=0, errors=0, cache_hits=0, retries=0,
+                                           seconds=0.0, prompt_tokens=0, completion_tokens=0))
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            row = summary[record.get(by) or 'untagged']
+            row['calls'] += 1
+            row['errors'] += int(record.get('error') is not None)
+            row['cache_hits'] += int(record.get('cache') == 'hit')
+            row['retries'] += record.get('retries') or 0
+            row['seconds'] += record.get('latency') or 0.0
+            row['prompt_tokens'] += record.get('prompt_tokens') or 0
+            row['completion_tokens'] += record.get('completion_tokens') or 0
+
+        for row in summary.values():
+            row['seconds'] = round(row['seconds'], 3)
+        return dict(summary)
+
+    def summary_table(self, by: str = 'stage') -> str:
+        columns = ['calls', 'errors', 'cache_hits', 'retries', 'seconds', 'prompt_tokens', 'completion_tokens']
+        summary = self.summary(by)
+        total = {column: sum(row[column] for row in summary.values()) for column in columns}
+        total['seconds'] = round(total['seconds'], 3)
+
+        rows = [[name] + [str(row[column]) for column in columns] for name, row in sorted(summary.items())]
+        rows.append(['total'] + [str(total[column]) for column in columns])
+        header = [by] + columns
+        widths = [max(len(line[i]) for line in [header] + rows) for i in range(len(header))]
+
+        def _format(line):
+            return '  '.join(cell.ljust(width) for cell, width in zip(line, widths))
+
+        return '\n'.join([_format(header), _format(['-' * width for width in widths])] + [_format(row) for row in rows])
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            records = list(self.records)
+        return dict(name=self.name,
+                    started_at=self.started_at,
+                    summary=self.summary(),
+                    summary_by_model=self.summary('model'),
+                    records=records)
+
+    def save(self, file_path: str):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+@contextmanager
+def run_trace(trace: Optional[RunTrace] = None):
+    """Collect the llm calls made inside the block, including the ones of the
+    tasks and threads started from it, into `trace`."""
+    trace = trace or RunTrace()
+    token = CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        CURRENT_TRACE.reset(token)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 from dataclasses import asdict
@@ -45,3 +46,37 @@ def save_json(file_path, data):
         json.dump(data, f)
 
     return True
+
+LOOP_CLOSE_HOOKS = []
+
+def on_loop_close(ahook):
+    """Register `ahook`, a coroutine function awaited before the event loop of
+    `run_sync` is closed, e.g. to close the clients bound to the loop."""
+    LOOP_CLOSE_HOOKS.append(ahook)
+    return ahook
+
+async def aclose_loop():
+    """Await the loop close hooks in the running event loop. `run_sync` does
+    it, code running its own event loop should await it last."""
+    await asyncio.gather(*[ahook() for ahook in LOOP_CLOSE_HOOKS], return_exceptions=True)
+
+async def _run_and_close_loop(coro):
+    try:
+        return await coro
+    finally:
+        await aclose_loop()
+
+def run_sync(coro):
+    """Run a coroutine to completion from sync code.
+
+    The coroutine runs in a new event loop, hence it can not be called when an
+    event loop is already running in the current thread, await the coroutine
+    instead. The loop close hooks run before the loop is closed.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_run_and_close_loop(coro))
+
+    coro.close()
+    raise RuntimeError("run_sync() can not be called from a running event loop.")
@@ -1,6 +1,27 @@
+import asyncio
+import copy
+import hashlib
+import json
 import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
 
+import httpx
+from openai.types import CompletionUsage
+
+from sine.common.cache import CACHE_DIR, DiskCache
+from sine.common.cassette import (CURRENT_CASSETTE, acassette_call,
+                                  cassette_call)
 from sine.common.logger import logger
+from sine.common.single_flight import LLM_FLIGHTS, flight_key
+from sine.common.trace import record_llm_call
+from sine.common.utils import on_loop_close
 
 AVAILABLE_API_MODELS = {
     'groq' : [
@@ -11,43 +32,740 @@ AVAILABLE_API_MODELS = {
     'deepseek' : ["deepseek-chat", "deepseek-coder"]
 }
 
-def get_api_model(model_name):
-    if 'glm' in model_name:
+# requests per minute and tokens per minute budgets of each provider, None
+# means no limit, see the rate limit pages of the providers (free tier)
+PROVIDER_RATE_LIMITS = {
+    'groq' : dict(rpm=30, tpm=6000),
+    'zhipuai' : dict(rpm=60, tpm=None),
+    'moonshot' : dict(rpm=3, tpm=32000),
+    'deepseek' : dict(rpm=None, tpm=None),
+}
+
+def get_provider(model_name):
+    for provider, model_names in AVAILABLE_API_MODELS.items():
+        if model_name in model_names:
+            return provider
+    raise ValueError(f"Model {model_name} not supported. Supported models: {AVAILABLE_API_MODELS.values()}")
+
+# base url (None is the sdk default) and api key env variable of each provider
+PROVIDER_ENDPOINTS = {
+    'groq' : dict(base_url=None, api_key_env="GROQ_API_KEY"),
+    'zhipuai' : dict(base_url=None, api_key_env="ZHIPU_API_KEY"),
+    'moonshot' : dict(base_url="https://api.moonshot.cn/v1", api_key_env="MOONSHOT_API_KEY"),
+    'deepseek' : dict(base_url="https://api.deepseek.com", api_key_env="DEEPSEEK_API_KEY"),
+}
+# zhipuai sdk signs requests with an "id.secret" key
+LOCAL_API_KEY = "local.stub"
+
+def _create_client(provider, base_url, api_key, http_client, is_async=False):
+    # retries of the sdks are disabled, APIModel retries with its own policy
+    if provider == 'zhipuai':
+        if is_async:
+            # zhipuai sdk only ships a sync client
+            return None
         from zhipuai import ZhipuAI
-        assert model_name in AVAILABLE_API_MODELS['zhipuai']
-        client = ZhipuAI(api_key=os.getenv("ZHIPU_API_KEY"))
-    elif 'moonshot' in model_name:
-        from openai import OpenAI
-        assert model_name in AVAILABLE_API_MODELS['moonshot']
-        client = OpenAI(api_key=os.getenv("MOONSHOT_API_KEY"),
-                        base_url="https://api.moonshot.cn/v1")
-    elif 'deepseek' in model_name:
-        from openai import OpenAI
-        assert model_name in AVAILABLE_API_MODELS['deepseek']
-        client = OpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"),
-                        base_url="https://api.deepseek.com")
-    elif model_name in AVAILABLE_API_MODELS['groq']:
-        from groq import Groq
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    else:
-        raise ValueError(f"Model {model_name} not supported. Supported models: {AVAILABLE_API_MODELS.values()}")
-    logger.debug(f"API model {model_name} client initialized.")
-    return client
+        return ZhipuAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    elif provider in ('moonshot', 'deepseek'):
+        from openai import AsyncOpenAI, OpenAI
+        client_cls = AsyncOpenAI if is_async else OpenAI
+        return client_cls(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    elif provider == 'groq':
+        from groq import AsyncGroq, Groq
+        client_cls = AsyncGroq if is_async else Groq
+        return client_cls(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    raise ValueError(f"Provider {provider} not supported.")
+
+
+class ClientRegistry:
+    """Process wide sdk clients keyed by provider, base url and api key.
+
+    All sync clients share one httpx connection pool with keep-alive, so the
+    models of a run, the runs of a batch and the reruns of the app reuse their
+    connections. Asyncio clients and their pool are bound to the event loop
+    they are used in, they are kept per event loop and closed by `aclose`
+    before the loop is closed.
+    """
+
+    def __init__(self, limits: httpx.Limits = None) -> None:
+        self.limits = limits or httpx.Limits(max_connections=100,
+                                             max_keepalive_connections=20,
+                                             keepalive_expiry=30)
+        self._http_client = None
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary() # loop -> (http client, clients)
+        self._lock = threading.Lock()
+
+    def _key(self, provider, base_url=None):
+        endpoint = PROVIDER_ENDPOINTS[provider]
+        if base_url is None:
+            return provider, endpoint['base_url'], os.getenv(endpoint['api_key_env'])
+        # a custom base url is usually a local server which does not check the key
+        return provider, base_url, os.getenv(endpoint['api_key_env']) or LOCAL_API_KEY
+
+    def get(self, provider, base_url=None):
+        key = self._key(provider, base_url)
+        with self._lock:
+            if key not in self._clients:
+                if self._http_client is None:
+                    self._http_client = httpx.Client(limits=self.limits)
+                self._clients[key] = _create_client(*key, http_client=self._http_client)
+                logger.debug(f"API client of {provider} initialized.")
+            return self._clients[key]
+
+    def get_async(self, provider, base_url=None):
+        """Asyncio client of the running event loop, None if the provider sdk
+        has no asyncio client."""
+        key = self._key(provider, base_url)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                self._async_clients[loop] = (httpx.AsyncClient(limits=self.limits), {})
+            http_client, clients = self._async_clients[loop]
+            if key not in clients:
+                clients[key] = _create_client(*key, http_client=http_client, is_async=True)
+                logger.debug(f"API async client of {provider} initialized.")
+            return clients[key]
+
+    async def aclose(self):
+        """Close the asyncio clients of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._async_clients.pop(loop, None)
+        if entry is not None:
+            await entry[0].aclose()
+            logger.debug("API async clients closed.")
+
+
+CLIENT_REGISTRY = ClientRegistry()
+on_loop_close(CLIENT_REGISTRY.aclose)
+
+def get_api_model(model_name, base_url=None):
+    return CLIENT_REGISTRY.get(get_provider(model_name), base_url)
+
+def get_async_api_model(model_name, base_url=None):
+    """Asyncio client of the model in the running event loop, None if the
+    provider sdk has no asyncio client."""
+    return CLIENT_REGISTRY.get_async(get_provider(model_name), base_url)
+
+class Priority(IntEnum):
+    CRITICAL = 0 # calls on the critical path of a run, e.g. article writing
+    NORMAL = 1
+
+
+class TokenBucket:
+    """Bucket of `capacity` which refills `capacity` per minute."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        elapsed = now - self._updated
+        self.level = min(self.capacity, self.level + elapsed * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds to wait until `amount` is available, call `refill` first."""
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+
+class ProviderRateLimiter:
+    """Requests and tokens budgets of one provider.
+
+    Normal priority calls leave `critical_reserve` of each bucket to critical
+    calls and yield to them while any critical call is waiting. A 429 response
+    blocks every call of the provider until its Retry-After passed.
+    """
+
+    def __init__(self, rpm=None, tpm=None, critical_reserve=0.2):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.critical_reserve = critical_reserve
+        self.blocked_until = 0.0
+        self.critical_waiting = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens, priority=Priority.NORMAL):
+        """Take budget for one call, return 0 if taken or seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if priority > Priority.CRITICAL and self.critical_waiting:
+                return 0.1
+
+            wait = 0.0
+            buckets = [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket]
+            for bucket, amount in buckets:
+                bucket.refill(now)
+                # a call larger than the whole bucket waits for a full bucket
+                amount = min(amount, bucket.capacity)
+                if priority > Priority.CRITICAL:
+                    amount = min(amount + self.critical_reserve * bucket.capacity, bucket.capacity)
+                wait = max(wait, bucket.wait_time(amount))
+            if wait > 0:
+                return wait
+
+            for bucket, amount in buckets:
+                bucket.level -= min(amount, bucket.capacity)
+            return 0.0
+
+    def record_usage(self, estimated_tokens, used_tokens):
+        """Correct the tokens budget with the actual usage of a call."""
+        if self.tokens is None or used_tokens is None:
+            return
+        with self._lock:
+            self.tokens.level -= used_tokens - min(estimated_tokens, self.tokens.capacity)
+
+    def block(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens, priority=Priority.NORMAL):
+        self._update_waiting(priority, 1)
+        try:
+            while (wait := self.reserve(tokens, priority)) > 0:
+                time.sleep(wait)
+        finally:
+            self._update_waiting(priority, -1)
+
+    async def aacquire(self, tokens, priority=Priority.NORMAL):
+        self._update_waiting(priority, 1)
+        try:
+            while (wait := self.reserve(tokens, priority)) > 0:
+                await asyncio.sleep(wait)
+        finally:
+            self._update_waiting(priority, -1)
+
+    def _update_waiting(self, priority, delta):
+        if priority == Priority.CRITICAL:
+            with self._lock:
+                self.critical_waiting += delta
+
+
+class RateLimiter:
+    """Process wide rate limiter shared by all APIModel of the same provider."""
+
+    def __init__(self, rate_limits=None):
+        self.rate_limits = rate_limits or PROVIDER_RATE_LIMITS
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider) -> ProviderRateLimiter:
+        with self._lock:
+            if provider not in self._providers:
+                self._providers[provider] = ProviderRateLimiter(**self.rate_limits.get(provider, {}))
+            return self._providers[provider]
+
+
+RATE_LIMITER = RateLimiter()
+
+# status codes of errors worth retrying, 429 is handled by the rate limiter
+TRANSIENT_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+
+def estimate_tokens(message, completion_tokens=512):
+    """Rough token count of a chat request, ~4 characters per token."""
+    prompt_chars = sum(len(m.get('content') or '') for m in message)
+    return prompt_chars // 4 + completion_tokens
+
+def get_retry_after(exc, default=5.0):
+    """Seconds to wait if `exc` is a 429 response of the provider, else None."""
+    if get_status_code(exc) != 429:
+        return None
+
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return default
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+def get_status_code(exc):
+    response = getattr(exc, 'response', None)
+    return getattr(exc, 'status_code', None) or getattr(response, 'status_code', None)
+
+def is_transient_error(exc):
+    """Whether `exc` is a timeout, a connection error or a server error which
+    could succeed if retried."""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    # connection and timeout errors of the openai and groq sdks
+    if any(cls.__name__ in ('APIConnectionError', 'APITimeoutError') for cls in type(exc).__mro__):
+        return True
+    return get_status_code(exc) in TRANSIENT_STATUS_CODES
+
+def as_usage(usage):
+    """`usage` as a `CompletionUsage`, the chunks of the pinned sdks have no
+    `usage` field so it comes as a pydantic extra, i.e. a plain dict."""
+    if isinstance(usage, dict):
+        return CompletionUsage.construct(**usage)
+    return usage
+
+def _get_chunk_usage(chunk):
+    """Usage of a stream chunk, groq reports it in the `x_groq` field of the last chunk."""
+    usage = getattr(chunk, 'usage', None)
+    if usage is None:
+        x_groq = getattr(chunk, 'x_groq', None)
+        usage = x_groq.get('usage') if isinstance(x_groq, dict) else getattr(x_groq, 'usage', None)
+    return as_usage(usage)
+
+
+class LatencyTracker:
+    """Latencies of the recent successful requests of a model."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, p):
+        """Latency of percentile `p` (0-1), None if there are too few samples."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+
+class LLMCache(DiskCache):
+    """On disk cache of chat completions.
+
+    Keyed by model name, normalized messages, sampling params and the base url
+    of a custom server, with the size and ttl based LRU eviction of DiskCache.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(CACHE_DIR, 'llm.sqlite'),
+                 max_entries: int = 50000,
+                 ttl: float = 30 * 24 * 3600) -> None:
+        super().__init__(path, max_entries=max_entries, ttl=ttl)
+
+    @staticmethod
+    def key(model_name, message, params, base_url=None) -> str:
+        normalized = [dict(role=m['role'], content=(m.get('content') or '').strip()) for m in message]
+        key = dict(model=model_name, messages=normalized, params=params)
+        if base_url is not None:
+            # e.g. the stub server, its completions are kept apart
+            key.update(base_url=base_url)
+        key_str = json.dumps(key, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
 
 class APIModel:
-    def __init__(self, model_name):
-        self.client = get_api_model(model_name)
+    """Chat completion api of `model_name`.
+
+    Args:
+        model_name (str): one of `AVAILABLE_API_MODELS`
+        priority (Priority): default priority of the calls in the shared rate
+            limiter, critical calls are served first.
+        rate_limiter (RateLimiter): defaults to the process wide `RATE_LIMITER`
+        max_rate_limit_retries (int): retries after a 429 response.
+        timeout (float): seconds of each request, pass `timeout` to `chat` to
+            override it for one call.
+        max_retries (int): retries after a timeout, connection or server error,
+            with jittered exponential backoff from `backoff` seconds up to
+            `max_backoff` seconds.
+        hedge_percentile (float): if set, e.g. 0.95, a duplicate request is sent
+            when a request is slower than this percentile of the recent
+            latencies and the first response wins. Streams are not hedged.
+        base_url (str): send the requests to another server which speaks the
+            provider protocol, e.g. `sine.models.stub_server`. It has its own
+            rate limits, none by default.
+        cache (LLMCache): cache of responses, None means no cache. Pass
+            `use_cache=False` to `chat` to bypass it for one call.
+
+    Sampling params (e.g. temperature) passed to `chat` as keyword arguments
+    are sent to the provider. Identical `chat` calls in flight at the same time
+    share one request. `stream` generates the completion delta by delta for
+    callers which show it while it is generated.
+    """
+
+    def __init__(self,
+                 model_name,
+                 priority=Priority.NORMAL,
+                 rate_limiter=RATE_LIMITER,
+                 max_rate_limit_retries=5,
+                 timeout=120.0,
+                 max_retries=3,
+                 backoff=1.0,
+                 max_backoff=30.0,
+                 hedge_percentile=None,
+                 base_url=None,
+                 cache: LLMCache = None):
         self._model_name = model_name
+        self.base_url = base_url
+        self.priority = priority
+        self.provider = get_provider(model_name)
+        self.limiter = rate_limiter.get(self.provider if base_url is None else base_url)
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+        self.cache = cache
+
+    @property
+    def client(self):
+        # created on first use, a replayed run needs no api key
+        return get_api_model(self._model_name, self.base_url)
 
-    def chat(self, message):
+    @property
+    def async_client(self):
+        # asyncio clients are bound to the event loop, get the one of the running loop
+        return get_async_api_model(self._model_name, self.base_url)
+
+    def with_priority(self, priority):
+        """Same model with another default priority, the clients are shared."""
+        if priority == self.priority:
+            return self
+        model = copy.copy(self)
+        model.priority = priority
+        return model
+
+    @staticmethod
+    def _format_message(message):
         if isinstance(message, str):
             message = [dict(role="user", content=message)]
         if isinstance(message, dict):
             message = [message]
 
+        return message
+
+    def chat(self, message, priority=None, use_cache=True, **kwargs):
+        message = self._format_message(message)
+        request = self._cassette_request(message, kwargs)
+        # identical calls in flight at the same time share one request, calls
+        # to another server or bypassing the cache are not identical
+        key = flight_key(self._model_name, self.base_url, use_cache, request)
+        return cassette_call('llm', request,
+                             lambda: LLM_FLIGHTS.do(key, lambda: self._chat(message, priority, use_cache, **kwargs)))
+
+    async def achat(self, message, priority=None, use_cache=True, **kwargs):
+        message = self._format_message(message)
+        request = self._cassette_request(message, kwargs)
+        key = flight_key(self._model_name, self.base_url, use_cache, request)
+        return await acassette_call('llm', request,
+                                    lambda: LLM_FLIGHTS.ado(key, lambda: self._achat(message, priority, use_cache, **kwargs)))
+
+    def stream(self, message, priority=None, use_cache=True, **kwargs):
+        """Generate the completion delta by delta as the provider streams it.
+
+        A cached or replayed completion is generated as one delta. The full
+        completion is cached once the stream is consumed to the end.
+        """
+        message = self._format_message(message)
+        request = self._cassette_request(message, kwargs)
+        cassette = CURRENT_CASSETTE.get()
+        if cassette is not None and cassette.replaying:
+            yield cassette.replay('llm', request)
+            return
+
+        deltas = []
+        for delta in self._stream(message, priority, use_cache, **kwargs):
+            deltas.append(delta)
+            yield delta
+        if cassette is not None:
+            cassette.record('llm', request, ''.join(deltas).strip())
+
+    async def astream(self, message, priority=None, use_cache=True, **kwargs):
+        """Asynchronous version of `stream`."""
+        message = self._format_message(message)
+        request = self._cassette_request(message, kwargs)
+        cassette = CURRENT_CASSETTE.get()
+        if cassette is not None and cassette.replaying:
+            yield cassette.replay('llm', request)
+            return
+
+        deltas = []
+        async for delta in self._astream(message, priority, use_cache, **kwargs):
+            deltas.append(delta)
+            yield delta
+        if cassette is not None:
+            cassette.record('llm', request, ''.join(deltas).strip())
+
+    @staticmethod
+    def _cassette_request(message, params):
+        # the model is left out, a tier replays whichever of its models recorded
+        params = {name: value for name, value in params.items() if name not in ('timeout', 'stream')}
+        return dict(messages=message, params=params)
+
+    def _chat(self, message, priority=None, use_cache=True, **kwargs):
+        priority = self.priority if priority is None else priority
+
+        cache_key = self._cache_key(message, kwargs) if use_cache else None
+        call = self._new_call(cache_key)
+        if cache_key is not None and (cached := self.cache.get(cache_key)) is not None:
+            self._record_call(call, cache='hit')
+            return cached
+
+        estimated_tokens = estimate_tokens(message)
+        try:
+            response = self._create(message, priority, estimated_tokens, call, **kwargs)
+        except Exception as exc:
+            self._record_call(call, error=exc)
+            raise
+        self._record_call(call, usage=getattr(response, 'usage', None))
+
+        return self._process_response(response, estimated_tokens, cache_key)
+
+    async def _achat(self, message, priority=None, use_cache=True, **kwargs):
+        priority = self.priority if priority is None else priority
+
+        if self.async_client is None:
+            # fall back to the sync client in a worker thread
+            return await asyncio.to_thread(self._chat, message, priority, use_cache, **kwargs)
+
+        cache_key = self._cache_key(message, kwargs) if use_cache else None
+        call = self._new_call(cache_key)
+        # sqlite is not read and written on the event loop
+        if cache_key is not None and (cached := await asyncio.to_thread(self.cache.get, cache_key)) is not None:
+            self._record_call(call, cache='hit')
+            return cached
+
+        estimated_tokens = estimate_tokens(message)
+        try:
+            response = await self._acreate(message, priority, estimated_tokens, call, **kwargs)
+        except Exception as exc:
+            self._record_call(call, error=exc)
+            raise
+        self._record_call(call, usage=getattr(response, 'usage', None))
+
+        content = self._process_response(response, estimated_tokens)
+        if cache_key is not None:
+            await asyncio.to_thread(self.cache.set, cache_key, content)
+        return content
+
+    def _stream(self, message, priority=None, use_cache=True, **kwargs):
+        priority = self.priority if priority is None else priority
+
+        cache_key = self._cache_key(message, kwargs) if use_cache else None
+        call = self._new_call(cache_key, stream=True)
+        if cache_key is not None and (cached := self.cache.get(cache_key)) is not None:
+            self._record_call(call, cache='hit')
+            yield cached
+            return
+
+        estimated_tokens = estimate_tokens(message)
+        deltas, usage = [], None
+        try:
+            response = self._create(message, priority, estimated_tokens, call, stream=True, **kwargs)
+            for chunk in response:
+                usage = _get_chunk_usage(chunk) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    deltas.append(delta)
+                    yield delta
+        except Exception as exc:
+            self._record_call(call, usage=usage, error=exc)
+            raise
+        self._record_call(call, usage=usage)
+
+        self._finish(''.join(deltas), usage, estimated_tokens, cache_key)
+
+    async def _astream(self, message, priority=None, use_cache=True, **kwargs):
+        priority = self.priority if priority is None else priority
+
+        if self.async_client is None:
+            # no asyncio client to stream with, the whole completion is one delta
+            yield await asyncio.to_thread(self._chat, message, priority, use_cache, **kwargs)
+            return
+
+        cache_key = self._cache_key(message, kwargs) if use_cache else None
+        call = self._new_call(cache_key, stream=True)
+        if cache_key is not None and (cached := await asyncio.to_thread(self.cache.get, cache_key)) is not None:
+            self._record_call(call, cache='hit')
+            yield cached
+            return
+
+        estimated_tokens = estimate_tokens(message)
+        deltas, usage = [], None
+        try:
+            response = await self._acreate(message, priority, estimated_tokens, call, stream=True, **kwargs)
+            async for chunk in response:
+                usage = _get_chunk_usage(chunk) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    deltas.append(delta)
+                    yield delta
+        except Exception as exc:
+            self._record_call(call, usage=usage, error=exc)
+            raise
+        self._record_call(call, usage=usage)
+
+        content = self._finish(''.join(deltas), usage, estimated_tokens)
+        if cache_key is not None:
+            await asyncio.to_thread(self.cache.set, cache_key, content)
+
+    def _new_call(self, cache_key, stream=False):
+        """Trace record of a call being made."""
+        return dict(start=time.monotonic(), retries=0, stream=stream,
+                    cache='off' if cache_key is None else 'miss')
+
+    def _record_call(self, call, usage=None, error=None, cache=None):
+        usage = as_usage(usage)
+        record_llm_call(model=self._model_name,
+                        latency=round(time.monotonic() - call['start'], 3),
+                        prompt_tokens=getattr(usage, 'prompt_tokens', None),
+                        completion_tokens=getattr(usage, 'completion_tokens', None),
+                        retries=call['retries'],
+                        cache=cache or call['cache'],
+                        stream=call['stream'],
+                        error=None if error is None else f"{type(error).__name__}: {error}")
+
+    def _create(self, message, priority, estimated_tokens, call, **kwargs):
+        hedge = not kwargs.get('stream') and self.hedge_percentile is not None
+        attempts = dict(rate_limit=0, transient=0) # retries of each kind
+        while True:
+            try:
+                if hedge:
+                    return self._hedged_request(message, priority, estimated_tokens, **kwargs)
+                return self._request(message, priority, estimated_tokens, **kwargs)
+            except Exception as exc:
+                delay = self._retry_delay(exc, attempts)
+                call['retries'] += 1
+                time.sleep(delay)
+
+    async def _acreate(self, message, priority, estimated_tokens, call, **kwargs):
+        hedge = not kwargs.get('stream') and self.hedge_percentile is not None
+        attempts = dict(rate_limit=0, transient=0) # retries of each kind
+        while True:
+            try:
+                if hedge:
+                    return await self._ahedged_request(message, priority, estimated_tokens, **kwargs)
+                return await self._arequest(message, priority, estimated_tokens, **kwargs)
+            except Exception as exc:
+                delay = self._retry_delay(exc, attempts)
+                call['retries'] += 1
+                await asyncio.sleep(delay)
+
+    def _request(self, message, priority, estimated_tokens, **kwargs):
+        self.limiter.acquire(estimated_tokens, priority)
+        start = time.monotonic()
         response = self.client.chat.completions.create(
             model=self._model_name,
             messages=message,
+            **{'timeout': self.timeout, **kwargs}
+        )
+        if not kwargs.get('stream'):
+            self.latencies.record(time.monotonic() - start)
+        return response
+
+    async def _arequest(self, message, priority, estimated_tokens, **kwargs):
+        await self.limiter.aacquire(estimated_tokens, priority)
+        start = time.monotonic()
+        response = await self.async_client.chat.completions.create(
+            model=self._model_name,
+            messages=message,
+            **{'timeout': self.timeout, **kwargs}
         )
+        if not kwargs.get('stream'):
+            self.latencies.record(time.monotonic() - start)
+        return response
+
+    def _hedged_request(self, message, priority, estimated_tokens, **kwargs):
+        """Send a duplicate request if the first one is slower than the
+        `hedge_percentile` latency, return the first successful response."""
+        hedge_after = self.latencies.percentile(self.hedge_percentile)
+        if hedge_after is None:
+            return self._request(message, priority, estimated_tokens, **kwargs)
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = [executor.submit(self._request, message, priority, estimated_tokens, **kwargs)]
+            if not wait(futures, timeout=hedge_after).done:
+                logger.info(f"{self._model_name} slower than {hedge_after:.1f}s, send a hedged request.")
+                futures.append(executor.submit(self._request, message, priority, estimated_tokens, **kwargs))
+            for future in as_completed(futures):
+                if future.exception() is None:
+                    return future.result()
+            # all failed, raise the error of the first request
+            return futures[0].result()
+        finally:
+            # the slower request is not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _ahedged_request(self, message, priority, estimated_tokens, **kwargs):
+        hedge_after = self.latencies.percentile(self.hedge_percentile)
+        if hedge_after is None:
+            return await self._arequest(message, priority, estimated_tokens, **kwargs)
+
+        tasks = [asyncio.create_task(self._arequest(message, priority, estimated_tokens, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                logger.info(f"{self._model_name} slower than {hedge_after:.1f}s, send a hedged request.")
+                tasks.append(asyncio.create_task(self._arequest(message, priority, estimated_tokens, **kwargs)))
+
+            first_error = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except Exception as exc:
+                    first_error = first_error or exc
+            raise first_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _cache_key(self, message, params):
+        if self.cache is None:
+            return None
+        params = {name: value for name, value in params.items() if name != 'timeout'}
+        return self.cache.key(self._model_name, message, params, self.base_url)
+
+    def _retry_delay(self, exc, attempts):
+        """Seconds to wait before retrying after `exc`, re-raise `exc` if it is
+        not retried.
+
+        A 429 blocks the provider in the rate limiter until its Retry-After
+        passed, other transient errors are retried after a jittered
+        exponential backoff. `attempts` counts the retries of both kinds
+        apart, each kind has its own budget and backoff.
+        """
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            if attempts['rate_limit'] >= self.max_rate_limit_retries:
+                raise exc
+            attempts['rate_limit'] += 1
+            logger.warning(f"{self._model_name} rate limited, retry after {retry_after:.1f}s.")
+            self.limiter.block(retry_after)
+            return 0.0
+
+        attempt = attempts['transient']
+        if not is_transient_error(exc) or attempt >= self.max_retries:
+            raise exc
+        attempts['transient'] += 1
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        logger.warning(f"{self._model_name} failed ({type(exc).__name__}: {exc}), retry in {delay:.1f}s.")
+        return delay
+
+    def _process_response(self, response, estimated_tokens, cache_key=None):
+        return self._finish(response.choices[0].message.content,
+                            getattr(response, 'usage', None),
+                            estimated_tokens,
+                            cache_key)
+
+    def _finish(self, content, usage, estimated_tokens, cache_key=None):
+        self.limiter.record_usage(estimated_tokens, getattr(as_usage(usage), 'total_tokens', None))
+
+        content = content.strip()
+        if cache_key is not None:
+            self.cache.set(cache_key, content)
 
-        return response.choices[0].message.content.strip()
+        return content
@@ -0,0 +1,189 @@
+"""Count prompt tokens of a model and pack prompt parts into a token budget."""
+
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import List, Sequence
+
+from sine.common.logger import logger
+from sine.models.api_model import get_provider
+from sine.models.router import MODEL_TIERS
+
+MODEL_CONTEXT_WINDOWS = {
+    "mixtral-8x7b-32768" : 32768,
+    "llama2-70b-4096" : 4096,
+    "llama3-70b-8192" : 8192,
+    "llama3-8b-8192" : 8192,
+    "glm-4" : 128000,
+    "moonshot-v1-32k" : 32768,
+    "moonshot-v1-8k" : 8192,
+    "deepseek-chat" : 32768,
+    "deepseek-coder" : 16384,
+}
+
+# rough ratios of the provider tokenizers used when no tokenizer is installed,
+# they err on the high side so that an estimated prompt never overflows
+LATIN_CHARS_PER_TOKEN = 3.5
+CJK_TOKENS_PER_CHAR = {
+    'groq' : 1.2, # llama tokenizers split most CJK characters
+    'zhipuai' : 0.8,
+    'moonshot' : 0.8,
+    'deepseek' : 0.8,
+}
+
+CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+def get_context_window(model_name):
+    """Context window of a model, or of the smallest model of a tier."""
+    if model_name in MODEL_TIERS:
+        return min(get_context_window(name) for name in MODEL_TIERS[model_name])
+    return MODEL_CONTEXT_WINDOWS.get(model_name, 8192)
+
+@lru_cache
+def _load_tiktoken_encoding(encoding_name='cl100k_base'):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        # tiktoken is optional and downloads the encoding on first use
+        logger.debug(f"tiktoken {encoding_name} unavailable, estimate tokens instead: {e}")
+        return None
+
+
+class TokenCounter:
+    """Token counter of a model.
+
+    It uses the cl100k tokenizer of tiktoken if it is installed, which is close
+    to the tokenizers of the supported models, else the calibrated estimator.
+    """
+
+    def __init__(self, model_name) -> None:
+        self.model_name = model_name
+        names = MODEL_TIERS.get(model_name, [model_name])
+        # a tier is counted as its least efficient tokenizer
+        self.cjk_tokens_per_char = max(CJK_TOKENS_PER_CHAR[get_provider(name)] for name in names)
+        self.encoding = _load_tiktoken_encoding()
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+
+        num_cjk = len(CJK_PATTERN.findall(text))
+        return int((len(text) - num_cjk) / LATIN_CHARS_PER_TOKEN + num_cjk * self.cjk_tokens_per_char) + 1
+
+    def count_message(self, message) -> int:
+        if isinstance(message, str):
+            return self.count(message)
+        if isinstance(message, dict):
+            message = [message]
+        # a few tokens of each message are taken by the chat template
+        return sum(self.count(m.get('content') or '') + 4 for m in message)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Truncate `text` to `max_tokens`, keep complete lines and cut the
+        last line at a word boundary."""
+        if max_tokens <= 0:
+            return ''
+        if self.count(text) <= max_tokens:
+            return text
+
+        kept, used = [], 0
+        for line in text.split('\n'):
+            line_tokens = self.count(line) + 1
+            if used + line_tokens <= max_tokens:
+                kept.append(line)
+                used += line_tokens
+                continue
+
+            # binary search the number of words of the line which fit
+            words = line.split()
+            lo, hi = 0, len(words)
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if self.count(' '.join(words[:mid])) <= max_tokens - used:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            if lo:
+                kept.append(' '.join(words[:lo]))
+            break
+
+        return '\n'.join(kept).strip()
+
+
+@lru_cache
+def get_token_counter(model_name) -> TokenCounter:
+    return TokenCounter(model_name)
+
+
+class PromptBudget:
+    """Token budget of the prompts of a model.
+
+    Args:
+        model_name (str): model name or tier.
+        max_tokens (int): max tokens of a prompt, defaults to the context
+            window of the model minus `completion_tokens`.
+        completion_tokens (int): tokens left to the completion.
+        min_part_tokens (int): parts which would be truncated to fewer tokens
+            are dropped instead.
+    """
+
+    def __init__(self,
+                 model_name,
+                 max_tokens: int = None,
+                 completion_tokens: int = 1024,
+                 min_part_tokens: int = 32) -> None:
+        self.counter = get_token_counter(model_name)
+        window = get_context_window(model_name) - completion_tokens
+        self.max_tokens = min(max_tokens, window) if max_tokens else window
+        self.min_part_tokens = min_part_tokens
+
+    def count(self, text) -> int:
+        return self.counter.count(text)
+
+    def remaining(self, message) -> int:
+        """Tokens left for the variable parts of a prompt whose fixed parts
+        are `message`."""
+        return max(0, self.max_tokens - self.counter.count_message(message))
+
+    def truncate(self, text: str, max_tokens: int = None) -> str:
+        return self.counter.truncate(text, self.max_tokens if max_tokens is None else max_tokens)
+
+    def pack(self, parts: Sequence[str], max_tokens: int = None, priorities: Sequence[int] = None) -> List[str]:
+        """Fit `parts` into `max_tokens`.
+
+        Parts are taken by priority, lower first, which defaults to their
+        order. When the parts of the same priority do not all fit, they share
+        the tokens left equally, and the larger ones are truncated.
+
+        Returns:
+            the packed parts in the given order, '' for the dropped ones.
+        """
+        left = self.max_tokens if max_tokens is None else max_tokens
+        priorities = range(len(parts)) if priorities is None else priorities
+        sizes = [self.count(part) for part in parts]
+        packed = [''] * len(parts)
+
+        groups = defaultdict(list)
+        for i, priority in enumerate(priorities):
+            groups[priority].append(i)
+
+        for priority in sorted(groups):
+            # smaller parts first, what they leave of their share goes to the larger ones
+            indices = sorted(groups[priority], key=lambda i: sizes[i])
+            for n, i in enumerate(indices):
+                share = left // (len(indices) - n)
+                if sizes[i] <= share:
+                    packed[i] = parts[i]
+                    left -= sizes[i]
+                elif share >= self.min_part_tokens:
+                    packed[i] = self.truncate(parts[i], share)
+                    left -= self.count(packed[i])
+
+        num_truncated = sum(packed[i] != parts[i] for i in range(len(parts)))
+        if num_truncated:
+            logger.debug(f"Prompt budget truncated or dropped {num_truncated}/{len(parts)} parts.")
+
+        return packed
@@ -0,0 +1,258 @@
+"""Route calls of a logical model tier to the healthiest provider."""
+
+import asyncio
+import copy
+import os
+import random
+import threading
+import time
+
+from sine.common.logger import logger
+from sine.models.api_model import (PROVIDER_ENDPOINTS, APIModel, Priority,
+                                   get_provider, get_retry_after,
+                                   get_status_code, is_transient_error)
+
+# equivalent models of different providers, in the order of preference
+MODEL_TIERS = {
+    'fast-small' : ["llama3-8b-8192", "deepseek-chat", "moonshot-v1-8k"],
+    'large' : ["llama3-70b-8192", "moonshot-v1-32k", "glm-4", "deepseek-chat"],
+}
+
+# 4xx responses about the key or the model of one provider, the others may
+# serve the call, any other 4xx is about the request and fails everywhere
+PROVIDER_ERROR_CODES = {401, 403, 404}
+
+
+class ModelHealth:
+    """Exponentially weighted latency and error rate of one model.
+
+    Models which have not been called yet start at `prior_latency`, a model
+    which failed is cooled down for `cooldown` seconds.
+    """
+
+    def __init__(self, alpha=0.3, prior_latency=5.0, cooldown=30.0):
+        self.alpha = alpha
+        self.latency = prior_latency
+        self.error_rate = 0.0
+        self.cooldown = cooldown
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, seconds):
+        with self._lock:
+            self.latency = (1 - self.alpha) * self.latency + self.alpha * seconds
+            self.error_rate = (1 - self.alpha) * self.error_rate
+
+    def record_failure(self):
+        with self._lock:
+            self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha
+            self.cooldown_until = time.monotonic() + self.cooldown
+
+    def score(self):
+        """Expected seconds of a successful call, lower is better."""
+        return self.latency / max(1e-3, 1 - self.error_rate)
+
+    def available(self, now):
+        return now >= self.cooldown_until
+
+
+class ModelRouter:
+    """ModelRouter has the chat api of APIModel, every call goes to the model
+    of the tier with the best recent latency and error rate and fails over to
+    the next one.
+
+    Models cooling down after a failure or blocked by a 429 are only tried
+    when all others failed. Models of providers without an api key are tried
+    last, calls replayed from a cassette need no key.
+
+    The models do not retry themselves, a call fails over on the first 429,
+    timeout or server error. When all models are rate limited the call waits
+    for the first one to be unblocked, up to `max_rate_limit_retries` times.
+    When a round over the models failed with any timeout or server error, the
+    call tries all of them again after an exponential backoff with jitter, up
+    to `max_retries` times. A call rejected as invalid (e.g. a 400) is raised
+    without fail over.
+
+    Args:
+        tier (str): one of `MODEL_TIERS`, or None if `model_names` is given.
+        model_names (list): models of the tier in the order of preference.
+        priority (Priority): default priority of the calls.
+        max_rate_limit_retries (int): rounds over the models when all are
+            rate limited.
+        max_retries (int): rounds over the models after a timeout or server
+            error, the models themselves do not retry.
+        backoff (float): base seconds of the backoff before a retry round.
+        max_backoff (float): cap of the backoff in seconds.
+        **model_kwargs: passed to every APIModel, e.g. cache or timeout.
+    """
+
+    def __init__(self, tier=None, model_names=None, priority=Priority.NORMAL,
+                 max_rate_limit_retries=5, max_retries=3, backoff=1.0, max_backoff=30.0,
+                 **model_kwargs):
+        self.tier = tier
+        self.priority = priority
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        model_names = model_names or MODEL_TIERS[tier]
+        # the router retries rounds over the models, the models fail over at once
+        model_kwargs.update(max_rate_limit_retries=0, max_retries=0)
+
+        self.models = {}
+        self.missing_key = set()
+        for model_name in model_names:
+            self.models[model_name] = APIModel(model_name, priority=priority, **model_kwargs)
+            has_key = os.getenv(PROVIDER_ENDPOINTS[get_provider(model_name)]['api_key_env'])
+            if not has_key and model_kwargs.get('base_url') is None:
+                logger.debug(f"{model_name} of tier {tier} has no api key, it is tried last.")
+                self.missing_key.add(model_name)
+
+        self.health = {model_name: ModelHealth() for model_name in self.models}
+
+    def with_priority(self, priority):
+        """Same router with another default priority, models and health are shared."""
+        if priority == self.priority:
+            return self
+        router = copy.copy(self)
+        router.priority = priority
+        return router
+
+    def rank(self):
+        """Model names, available ones first, each group by score, the ones
+        without an api key last."""
+        now = time.monotonic()
+
+        def _sort_key(model_name):
+            model, health = self.models[model_name], self.health[model_name]
+            blocked_until = max(health.cooldown_until, model.limiter.blocked_until)
+            blocked = blocked_until > now
+            # blocked models by the time they are available again
+            return model_name in self.missing_key, blocked, blocked_until if blocked else 0.0, health.score()
+
+        return sorted(self.models, key=_sort_key)
+
+    def _candidates(self, errors):
+        """Model names to try in turn with the seconds to wait before each,
+        another round of all models while every model of the last round was
+        rate limited or after a backoff if any failed with a transient error."""
+        attempts = dict(rate_limit=0, transient=0) # rounds of each kind
+        delay = 0.0
+        while True:
+            model_names = self.rank()
+            for model_name in model_names:
+                yield model_name, delay
+                delay = 0.0
+            round_errors = errors[-len(model_names):]
+            if all(get_retry_after(exc) is not None for exc in round_errors):
+                if attempts['rate_limit'] >= self.max_rate_limit_retries:
+                    return
+                attempts['rate_limit'] += 1
+                logger.warning(f"All models of tier {self.tier} are rate limited, wait for the first one.")
+                continue
+
+            attempt = attempts['transient']
+            if not any(is_transient_error(exc) for exc in round_errors) or attempt >= self.max_retries:
+                return
+            attempts['transient'] += 1
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            logger.warning(f"All models of tier {self.tier} failed, retry in {delay:.1f}s.")
+
+    def _on_failure(self, model_name, exc, errors):
+        """Record the failure of `model_name` to fail over, re-raise `exc` if
+        the request itself is invalid."""
+        status_code = get_status_code(exc)
+        if (status_code is not None and 400 <= status_code < 500
+                and status_code not in PROVIDER_ERROR_CODES
+                and get_retry_after(exc) is None and not is_transient_error(exc)):
+            raise exc
+
+        errors.append(exc)
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            # not a failure of the model, it is ranked by the end of the block
+            self.models[model_name].limiter.block(retry_after)
+            logger.warning(f"{model_name} of tier {self.tier} rate limited for {retry_after:.1f}s, fail over.")
+            return
+        self.health[model_name].record_failure()
+        logger.warning(f"{model_name} of tier {self.tier} failed ({type(exc).__name__}: {exc}), fail over.")
+
+    def chat(self, message, priority=None, **kwargs):
+        priority = self.priority if priority is None else priority
+        errors = []
+        for model_name, delay in self._candidates(errors):
+            time.sleep(delay)
+            start = time.monotonic()
+            try:
+                response = self.models[model_name].chat(message, priority, **kwargs)
+            except Exception as exc:
+                self._on_failure(model_name, exc, errors)
+                continue
+            self.health[model_name].record_success(time.monotonic() - start)
+            return response
+
+        raise errors[-1]
+
+    async def achat(self, message, priority=None, **kwargs):
+        priority = self.priority if priority is None else priority
+        errors = []
+        for model_name, delay in self._candidates(errors):
+            await asyncio.sleep(delay)
+            start = time.monotonic()
+            try:
+                response = await self.models[model_name].achat(message, priority, **kwargs)
+            except Exception as exc:
+                self._on_failure(model_name, exc, errors)
+                continue
+            self.health[model_name].record_success(time.monotonic() - start)
+            return response
+
+        raise errors[-1]
+
+    def stream(self, message, priority=None, **kwargs):
+        """Stream from the best model, fail over only before the first delta."""
+        priority = self.priority if priority is None else priority
+        errors = []
+        for model_name, delay in self._candidates(errors):
+            time.sleep(delay)
+            start, started = time.monotonic(), False
+            try:
+                for delta in self.models[model_name].stream(message, priority, **kwargs):
+                    if not started:
+                        started = True
+                        self.health[model_name].record_success(time.monotonic() - start)
+                    yield delta
+                return
+            except Exception as exc:
+                if started:
+                    raise
+                self._on_failure(model_name, exc, errors)
+
+        raise errors[-1]
+
+    async def astream(self, message, priority=None, **kwargs):
+        priority = self.priority if priority is None else priority
+        errors = []
+        for model_name, delay in self._candidates(errors):
+            await asyncio.sleep(delay)
+            start, started = time.monotonic(), False
+            try:
+                async for delta in self.models[model_name].astream(message, priority, **kwargs):
+                    if not started:
+                        started = True
+                        self.health[model_name].record_success(time.monotonic() - start)
+                    yield delta
+                return
+            except Exception as exc:
+                if started:
+                    raise
+                self._on_failure(model_name, exc, errors)
+
+        raise errors[-1]
+
+
+def get_llm(name, priority=Priority.NORMAL, **model_kwargs):
+    """ModelRouter if `name` is a tier of `MODEL_TIERS`, else APIModel."""
+    if name in MODEL_TIERS:
+        return ModelRouter(name, priority=priority, **model_kwargs)
+    return APIModel(name, priority=priority, **model_kwargs)
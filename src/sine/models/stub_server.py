@@ -0,0 +1,268 @@
+"""Local chat completions server for offline load tests of STORM.
+
+It speaks the chat completions protocol of the openai, groq and zhipuai sdks,
+streaming included, and answers with templated responses which the STORM
+parsers accept. Latency, token rate, server errors and 429 responses are
+configurable.
+
+Usage:
+    python -m sine.models.stub_server --port 8008 --latency lognormal:0.5,0.4 --rate-limit-rate 0.05
+
+and point the models at it, e.g. `STORMConfig(..., llm_base_url="http://127.0.0.1:8008")`.
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from sine.common.logger import logger
+
+# first matching pattern on the prompt wins, the named groups fill the response
+DEFAULT_RULES = [
+    (r"recommend some Wikipedia pages.*topic of interest is (?P<topic>.+?)\.\s*$",
+     "https://en.wikipedia.org/wiki/{topic_slug}\nhttps://en.wikipedia.org/wiki/History_of_{topic_slug}"),
+    (r"select a group of experts.*The topic is '(?P<topic>.*?)'",
+     "1. Theorist: the concepts and theory behind {topic}\n"
+     "2. Practitioner: how {topic} is used in practice\n"
+     "3. Historian: how {topic} developed over time"),
+    (r"using Google search.*question you are going to answer is : (?P<question>.+?)\s*$",
+     '- "{question_short} overview"\n- "{question_short} examples"\n- "{question_short} explained"'),
+    (r"(Write|Improve) an outline.*topic (you want to write: |is )'(?P<topic>.*?)'",
+     "# {topic}\n## Introduction\n### Background\n### Key concepts\n"
+     "## Applications\n### Examples\n### Best practices\n## Challenges\n### Open problems"),
+    (r"expert who can use information.*question you are discussing about: (?P<question>.+?)\n",
+     "Regarding {question_short}, the gathered information shows the main points [1]. "
+     "Several sources describe it in detail [2][3]."),
+    (r"Write a section.*the section you are going to write is \"(?P<section_title>.*?)\"",
+     "## {section_title}\n{section_title} is covered by the collected information [1]. "
+     "It has several important aspects [2][3]."),
+    (r"Write a subsection.*the subsection you are going to write is \"(?P<section_title>.*?)\"",
+     # no title in the content, the writer drops everything before it
+     "It builds on the previous content [1]. The sources give concrete details [2]."),
+    (r"chatting with an expert.*Topic you are going to write: (?P<topic>.+?)\n",
+     "What are the most important aspects of {topic} that readers should know?"),
+]
+
+
+def parse_distribution(spec: str):
+    """Sampler of seconds from `fixed:x`, `uniform:a,b`, `normal:mu,sigma` or
+    `lognormal:median,sigma`, negative samples are clipped to 0."""
+    name, _, args = spec.partition(':')
+    params = [float(arg) for arg in args.split(',') if arg]
+    if name == 'fixed':
+        return lambda rng: params[0]
+    elif name == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    elif name == 'normal':
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    elif name == 'lognormal':
+        mu = 0.0 if params[0] <= 0 else math.log(params[0])
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    raise ValueError(f"Unknown distribution {spec}")
+
+
+@dataclass
+class StubConfig:
+    """Behaviour of the stub server.
+
+    Args:
+        latency: distribution of the time to the first token, see
+            `parse_distribution`.
+        tokens_per_second: generation speed of the completion, None is instant.
+        error_rate: fraction of requests answered with a 500.
+        rate_limit_rate: fraction of requests answered with a 429.
+        retry_after: Retry-After seconds of the 429 responses.
+        rules: (pattern, response template) pairs tried before the defaults.
+        seed: seed of the random injections.
+    """
+    latency: str = "fixed:0.2"
+    tokens_per_second: Optional[float] = None
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    rules: List[Tuple[str, str]] = field(default_factory=list)
+    seed: Optional[int] = None
+
+
+def render_response(messages: List[Dict], rules: List[Tuple[str, str]]) -> str:
+    """Fill the template of the first rule matching the prompt."""
+    prompt = '\n'.join(m.get('content') or '' for m in messages)
+    for pattern, template in rules:
+        match = re.search(pattern, prompt, flags=re.DOTALL | re.MULTILINE)
+        if match is None:
+            continue
+        values = defaultdict(str, {k: v.strip() for k, v in match.groupdict().items() if v})
+        if 'topic' in values:
+            values['topic_slug'] = re.sub(r'\W+', '_', values['topic']).strip('_')
+        if 'question' in values:
+            values['question_short'] = ' '.join(values['question'].split()[:8])
+        return template.format_map(values)
+
+    return "OK."
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real apis
+
+    def log_message(self, format, *args):
+        logger.debug(f"stub server: {format % args}")
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, dict(error=dict(message=f"Unknown path {self.path}")))
+            return
+
+        cfg = server.config
+        with server.lock:
+            server.stats['requests'] += 1
+            draw = server.rng.random()
+            latency = server.sample_latency(server.rng)
+
+        time.sleep(latency)
+        if draw < cfg.rate_limit_rate:
+            server.count('rate_limited')
+            self._send_json(429, dict(error=dict(message="Rate limit reached (stub)", type="rate_limit")),
+                            headers={'Retry-After': str(cfg.retry_after)})
+            return
+        if draw < cfg.rate_limit_rate + cfg.error_rate:
+            server.count('errors')
+            self._send_json(500, dict(error=dict(message="Internal error (stub)", type="server_error")))
+            return
+
+        messages = request.get('messages', [])
+        content = render_response(messages, cfg.rules + DEFAULT_RULES)
+        usage = dict(prompt_tokens=sum(count_tokens(m.get('content') or '') for m in messages),
+                     completion_tokens=count_tokens(content))
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        response_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get('model', 'stub')
+
+        if request.get('stream'):
+            self._stream(response_id, model, content, usage)
+        else:
+            if cfg.tokens_per_second:
+                time.sleep(usage['completion_tokens'] / cfg.tokens_per_second)
+            self._send_json(200, dict(
+                id=response_id, object='chat.completion', created=int(time.time()), model=model,
+                choices=[dict(index=0, message=dict(role='assistant', content=content), finish_reason='stop')],
+                usage=usage))
+        server.count('completed')
+
+    def _stream(self, response_id, model, content, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def _chunk(delta, finish_reason=None, **extra):
+            data = dict(id=response_id, object='chat.completion.chunk', created=int(time.time()), model=model,
+                        choices=[dict(index=0, delta=delta, finish_reason=finish_reason)], **extra)
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        cfg = self.server.config
+        words = re.findall(r'\S+\s*', content)
+        for i, word in enumerate(words):
+            if cfg.tokens_per_second:
+                time.sleep(count_tokens(word) / cfg.tokens_per_second)
+            _chunk(dict(role='assistant', content=word) if i == 0 else dict(content=word))
+        # openai reports usage in the last chunk, groq in its x_groq field
+        _chunk({}, finish_reason='stop', usage=usage, x_groq=dict(id=response_id, usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig = None) -> None:
+        super().__init__(address, StubHandler)
+        self.config = config or StubConfig()
+        self.sample_latency = parse_distribution(self.config.latency)
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(config: StubConfig = None, host: str = '127.0.0.1', port: int = 0) -> StubServer:
+    """Serve in a daemon thread, port 0 picks a free port, see `base_url`."""
+    server = StubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Stub llm server listening on {server.base_url}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local chat completions server for offline load tests.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--latency', default='fixed:0.2', help="fixed:x, uniform:a,b, normal:mu,sigma or lognormal:median,sigma")
+    parser.add_argument('--tokens-per-second', type=float, default=None)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--rules', default=None, help="json file of [pattern, response template] pairs")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    rules = []
+    if args.rules:
+        with open(args.rules) as f:
+            rules = [tuple(rule) for rule in json.load(f)]
+
+    config = StubConfig(latency=args.latency,
+                        tokens_per_second=args.tokens_per_second,
+                        error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate,
+                        retry_after=args.retry_after,
+                        rules=rules,
+                        seed=args.seed)
+    server = StubServer((args.host, args.port), config)
+    logger.info(f"Stub llm server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Stub llm server stats: {dict(server.stats)}")
+
+
+if __name__ == '__main__':
+    main()
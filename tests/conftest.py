@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import sine.models.api_model as api_model
+
+
+def _status_error(status_code, headers=None):
+    request = httpx.Request('POST', 'https://api.example.com/chat/completions')
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"{status_code}", request=request, response=response)
+
+
+class FakeCompletions:
+    """Chat completions of the fake sdk clients of every model.
+
+    Each call pops the next outcome scripted for its model, `outcomes` is a
+    dict of model name to outcomes or a list of outcomes of any model. An
+    exception is raised, a text is answered, and `reply(model, delay)` is
+    answered when no outcome is left. `delays` are the seconds of the calls
+    in turn. A streamed answer comes word by word, its last chunk only has
+    `usage`.
+    """
+
+    def __init__(self, outcomes=None, delays=None, reply=None, usage=None):
+        self.outcomes = outcomes if isinstance(outcomes, dict) else {None: list(outcomes or [])}
+        self.delays = list(delays or [])
+        self.reply = reply or (lambda model, delay: model)
+        self.usage = usage
+        self.calls = [] # model of each call
+        self._lock = threading.Lock()
+
+    def _next(self, model):
+        with self._lock:
+            self.calls.append(model)
+            outcomes = self.outcomes.get(model) or self.outcomes.get(None) or []
+            delay = self.delays.pop(0) if self.delays else 0.0
+            outcome = outcomes.pop(0) if outcomes else self.reply(model, delay)
+        return outcome, delay
+
+    def _response(self, outcome, stream):
+        if isinstance(outcome, Exception):
+            raise outcome
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))],
+                                   usage=self.usage)
+        words = outcome.split(' ')
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))], usage=None)
+                  for word in [word + ' ' for word in words[:-1]] + words[-1:]]
+        return chunks + [SimpleNamespace(choices=[], usage=self.usage)]
+
+    def create(self, model, messages, stream=False, **kwargs):
+        outcome, delay = self._next(model)
+        time.sleep(delay)
+        response = self._response(outcome, stream)
+        return iter(response) if stream else response
+
+    async def acreate(self, model, messages, stream=False, **kwargs):
+        outcome, delay = self._next(model)
+        await asyncio.sleep(delay)
+        response = self._response(outcome, stream)
+        if not stream:
+            return response
+
+        async def gen():
+            for chunk in response:
+                yield chunk
+        return gen()
+
+
+@pytest.fixture
+def status_error():
+    """Factory of the http errors of the sdks, e.g. a 429 with Retry-After."""
+    return _status_error
+
+
+@pytest.fixture
+def fake_completions(monkeypatch):
+    """Factory of `FakeCompletions`, the last one made serves the sync and
+    asyncio clients of every model."""
+    def install(*args, **kwargs):
+        completions = FakeCompletions(*args, **kwargs)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=completions.acreate)))
+        monkeypatch.setattr(api_model, 'get_api_model', lambda *args: client)
+        monkeypatch.setattr(api_model, 'get_async_api_model', lambda *args: async_client)
+        return completions
+
+    return install
@@ -0,0 +1,126 @@
+import asyncio
+import re
+import threading
+import time
+
+from sine.agents.storm.article import Article
+from sine.agents.storm.retriever import SearchEngineResult
+from sine.agents.storm.writer import ArticleWriter
+
+OUTLINE = "# Rust\n## Ownership\n### Moves\n### Borrowing\n## Lifetimes\n### Elision\n## Traits\n"
+# the first sections are written the slowest
+DELAYS = {'Ownership': 0.3, 'Moves': 0.15, 'Borrowing': 0.15, 'Lifetimes': 0.2, 'Elision': 0.1, 'Traits': 0.0}
+
+
+class LLM:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def _reply(self, message):
+        text = message if isinstance(message, str) else message[-1]['content']
+        title = re.search(r'TITLE: (.*)', text).group(1)
+        return title, f"## {title}\n{title} text [2][1]."
+
+    def _enter(self):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+    def _exit(self):
+        with self._lock:
+            self.running -= 1
+
+    def chat(self, message):
+        title, reply = self._reply(message)
+        self._enter()
+        time.sleep(DELAYS[title])
+        self._exit()
+        return reply
+
+    async def achat(self, message):
+        title, reply = self._reply(message)
+        self._enter()
+        await asyncio.sleep(DELAYS[title])
+        self._exit()
+        return reply
+
+
+class Retriever:
+    def query(self, queries, top_k_per_query=5):
+        name = queries if isinstance(queries, str) else queries[0]
+        return [SearchEngineResult(name, f"https://example.com/{name}/{i}", [f"{name} {i}"]) for i in range(2)]
+
+
+def _writer(llm):
+    return ArticleWriter(llm, 'Rust', None,
+                         write_section_protocol="TITLE: {section_title}\n{info}",
+                         write_subsection_protocol="TITLE: {section_title}\n{info}\n{prev_content}",
+                         write_style_protocol="style",
+                         max_section_workers=3)
+
+
+def _references(article):
+    return re.findall(r'\[\d+\]\. \S+\. (\S+)\.', article.to_markdown())
+
+
+def _check(article, llm, stick_article_outline):
+    names = ['Ownership', 'Lifetimes', 'Traits']
+    assert [node.section_name for node in article.get_sections()][:3] == names
+    # references are numbered in outline order, not in the order the sections finished
+    if stick_article_outline:
+        names = ['Moves', 'Borrowing', 'Elision']
+    assert _references(article) == [f"https://example.com/{name}/{i}" for name in names for i in (0, 1)]
+    assert llm.max_running > 1
+
+
+def test_write_sections_in_parallel():
+    for stick_article_outline in (False, True):
+        llm = LLM()
+        outline = Article.create_from_markdown('Rust', OUTLINE)
+        start = time.perf_counter()
+        article = _writer(llm).write(outline, Retriever(), stick_article_outline=stick_article_outline)
+        assert time.perf_counter() - start < sum(DELAYS.values())
+        _check(article, llm, stick_article_outline)
+
+
+def test_awrite_sections_in_parallel():
+    for stick_article_outline in (False, True):
+        llm = LLM()
+        outline = Article.create_from_markdown('Rust', OUTLINE)
+        article = asyncio.run(_writer(llm).awrite(outline, Retriever(), stick_article_outline=stick_article_outline))
+        _check(article, llm, stick_article_outline)
+
+
+class StreamLLM(LLM):
+    """Streams each reply in words, sections interleave their deltas."""
+
+    def _deltas(self, message):
+        _, reply = self._reply(message)
+        return [word + ' ' for word in reply.split(' ')]
+
+    def stream(self, message):
+        for delta in self._deltas(message):
+            time.sleep(0.01)
+            yield delta
+
+    async def astream(self, message):
+        for delta in self._deltas(message):
+            await asyncio.sleep(0.01)
+            yield delta
+
+
+def test_deltas_keyed_by_outline_path():
+    # both sections have an Overview subsection, written at the same time
+    outline = "# Rust\n## Ownership\n### Overview\n## Traits\n### Overview\n"
+    for run in (lambda writer, outline: writer.write(outline, Retriever(), stick_article_outline=True),
+                lambda writer, outline: asyncio.run(writer.awrite(outline, Retriever(), stick_article_outline=True))):
+        received = {}
+        writer = _writer(StreamLLM())
+        writer.on_delta = lambda key, delta: received.setdefault(key, []).append(delta)
+        run(writer, Article.create_from_markdown('Rust', outline))
+        assert set(received) == {('Ownership', 'Overview'), ('Traits', 'Overview')}
+        # each subsection gets only its own deltas
+        for key in received:
+            assert ''.join(received[key]).strip() == "## Overview\nOverview text [2][1]."
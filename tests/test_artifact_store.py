@@ -0,0 +1,79 @@
+import asyncio
+
+from sine.agents.storm.article import Article
+from sine.agents.storm.artifact_store import ArtifactStore, content_hash
+from sine.agents.storm.storm_agent import STORM, STORMConfig, _empty_sections
+
+
+def test_key_and_hash():
+    store = ArtifactStore('unused')
+    assert store.key('outline', {'a': 1, 'b': 2}) == store.key('outline', {'b': 2, 'a': 1})
+    assert store.key('outline', {'a': 1}) != store.key('article', {'a': 1})
+    assert content_hash(['x']) != content_hash(['y'])
+
+
+def test_save_load(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    assert store.load('outline', 'k') is None
+    assert store.save('outline', 'k', {'x': 1}) == content_hash({'x': 1})
+    assert store.exists('outline', 'k')
+    assert store.load('outline', 'k') == {'x': 1}
+
+    (tmp_path / 'outline' / 'bad.json').write_text('{not json')
+    assert store.load('outline', 'bad') is None
+
+
+def _storm(tmp_path, **kwargs):
+    storm = STORM(STORMConfig(topic='Rust ownership', **kwargs))
+    storm.artifacts = ArtifactStore(str(tmp_path))
+    return storm
+
+
+def _run_stage(storm, stage, output, complete=None, **upstream_hashes):
+    """Run the stage, return how many times its output was computed."""
+    calls = []
+
+    async def run():
+        calls.append(stage)
+        return output
+
+    inputs = storm._stage_inputs(stage, **upstream_hashes)
+    data, data_hash = asyncio.run(storm._arun_stage(stage, inputs, run, complete))
+    assert data == output and data_hash == content_hash(output)
+    return len(calls)
+
+
+def test_stage_reuse(tmp_path):
+    assert _run_stage(_storm(tmp_path), 'draft_outline', '# Rust') == 1
+    storm = _storm(tmp_path)
+    assert _run_stage(storm, 'draft_outline', '# Rust') == 0
+    assert storm.stats['stages']['draft_outline']['reused']
+
+
+def test_stage_invalidation(tmp_path):
+    storm = _storm(tmp_path)
+    assert _run_stage(storm, 'outline', '# Rust', draft_outline='a', research='b') == 1
+    assert _run_stage(storm, 'outline', '# Rust', draft_outline='a', research='b') == 0
+    # an upstream artifact or a config field of the stage changed
+    assert _run_stage(storm, 'outline', '# Rust', draft_outline='a', research='c') == 1
+    assert _run_stage(_storm(tmp_path, outline_llm='glm-4'), 'outline', '# Rust', draft_outline='a', research='b') == 1
+    # the article does not depend on the conversation llm
+    assert _run_stage(storm, 'article', 'text', outline='a', writing_sources='b') == 1
+    assert _run_stage(_storm(tmp_path, conversation_llm='glm-4'), 'article', 'text', outline='a', writing_sources='b') == 0
+
+
+def test_incomplete_output_not_saved(tmp_path):
+    storm = _storm(tmp_path)
+    assert _run_stage(storm, 'draft_outline', '# Rust', complete=lambda data: False) == 1
+    assert _run_stage(storm, 'draft_outline', '# Rust') == 1
+    assert _run_stage(storm, 'draft_outline', '# Rust') == 0
+
+
+def test_no_reuse(tmp_path):
+    assert _run_stage(_storm(tmp_path), 'draft_outline', '# Rust') == 1
+    assert _run_stage(_storm(tmp_path, reuse_artifacts=False), 'draft_outline', '# Rust') == 1
+
+
+def test_empty_sections():
+    article = Article.create_from_markdown('t', "# T\n## A\ntext\n## B\n### B1\n## C\n### C1\ntext\n### C2\n")
+    assert _empty_sections(article.article_title_node) == ['B', 'C2']
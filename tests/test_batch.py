@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import sine.agents.storm.batch as batch
+from sine.agents.storm.storm_agent import STORMStatus
+
+
+def test_load_topics(tmp_path):
+    path = tmp_path / 'topics.txt'
+    path.write_text("# comment\nRust ownership\n\nAsync Python\tfor beginners\n")
+    assert batch.load_topics(str(path)) == [('Rust ownership', None), ('Async Python', 'for beginners')]
+
+
+class FakeSTORM:
+    running = 0
+    max_running = 0
+    inits = []
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.state = STORMStatus.READY
+        self.stats = {}
+        self.final_article = None
+        self.topic_str = cfg.topic.replace(' ', '_')
+
+    def init(self, llms=None, encoder=None, on_delta=None):
+        FakeSTORM.inits.append((llms, encoder))
+
+    async def arun_pipeline(self):
+        FakeSTORM.running += 1
+        FakeSTORM.max_running = max(FakeSTORM.max_running, FakeSTORM.running)
+        try:
+            await asyncio.sleep(0.05)
+            if self.cfg.topic == 'bad':
+                raise RuntimeError('boom')
+        finally:
+            FakeSTORM.running -= 1
+        self.final_article = f"article of {self.cfg.topic}"
+        self.stats = dict(max_perspectivist=self.cfg.max_perspectivist)
+        self.state = STORMStatus.STOP
+
+
+def test_batch_runner(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, 'STORM', FakeSTORM)
+    runner = batch.STORMBatchRunner(base_cfg=dict(max_perspectivist=2),
+                                    max_concurrent_topics=2,
+                                    output_dir=str(tmp_path))
+    runner.encoder = encoder = object()
+    topics = [('a', None), ('bad', None), ('c', 'x'), ('d', None)]
+    stats = runner.run(topics)
+
+    # stats in the order of the topics, a failed topic does not stop the others
+    assert [s['topic'] for s in stats] == ['a', 'bad', 'c', 'd']
+    assert [s['status'] for s in stats] == ['success', 'failed', 'success', 'success']
+    assert 'boom' in stats[1]['error']
+    assert stats[0]['pipeline'] == dict(max_perspectivist=2)
+    assert FakeSTORM.max_running == 2
+    # the runs share the models and the encoder
+    assert all(llms is runner.llms and enc is encoder for llms, enc in FakeSTORM.inits)
+
+    assert (tmp_path / 'a.md').read_text() == 'article of a'
+    assert not (tmp_path / 'bad.md').exists()
+    lines = (tmp_path / 'stats.jsonl').read_text().splitlines()
+    assert sorted(json.loads(line)['topic'] for line in lines) == ['a', 'bad', 'c', 'd']
+
+
+def test_bad_config_fails_topic_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, 'STORM', FakeSTORM)
+    runner = batch.STORMBatchRunner(base_cfg=dict(no_such_field=1), output_dir=str(tmp_path))
+    runner.encoder = object()
+    stats = runner.run([('a', None)])
+    assert stats[0]['status'] == 'failed' and stats[0]['pipeline'] == {}
+    assert (tmp_path / 'a.stats.json').exists()
@@ -0,0 +1,164 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sine.actions.google_search import GoogleSearch, SearchCache
+from sine.common.cache import DiskCache
+from sine.common.cassette import Cassette, use_cassette
+
+
+def test_get_set(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.get('a') is None
+    cache.set('a', {'x': [1, 2]})
+    assert cache.get('a') == {'x': [1, 2]}
+    assert cache.stats() == dict(hits=1, misses=1, entries=1)
+
+
+def test_ttl_and_max_stale(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'), ttl=0.2, max_stale=0.3, evict_interval=1)
+    cache.set('a', 1)
+    time.sleep(0.25)
+    # expired, but kept for max_stale
+    assert cache.get('a') is None
+    value, age = cache.get_entry('a')
+    assert value == 1 and age > 0.2
+
+    time.sleep(0.3)
+    cache.set('b', 2) # evicts the entries older than ttl + max_stale
+    assert cache.get_entry('a') is None
+    assert cache.get('b') == 2
+
+
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_entries=3, evict_interval=1)
+    for key in 'abc':
+        cache.set(key, key)
+        time.sleep(0.01)
+    cache.get('a') # a is used more recently than b
+    time.sleep(0.01)
+    cache.set('d', 'd')
+    assert len(cache) == 3
+    assert cache.get_entry('b') is None
+    assert cache.get('a') == 'a'
+
+
+def test_evict_interval(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_entries=5, evict_interval=10)
+    for i in range(9):
+        cache.set(str(i), i)
+    assert len(cache) == 9
+    cache.set('9', 9)
+    assert len(cache) == 5
+
+
+def test_counters_thread_safe(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'))
+    cache.set('a', 1)
+
+    def work():
+        for _ in range(200):
+            cache.get('a')
+            cache.get('b')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (800, 800)
+
+
+class Serper:
+    """Fake Serper responses, the n-th call returns snippet n."""
+
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self, url, headers, params):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        time.sleep(self.delay)
+        return 200, dict(organic=[dict(title='t', link='https://example.com', snippet=f"v{n}")])
+
+
+def _search(cache, serper):
+    search = GoogleSearch(api_key='x', cache=cache)
+    search._post = serper
+    return search
+
+
+def _snippet(search, query='rust'):
+    return search.search(query, k=1)[1]['organic'][0]['snippet']
+
+
+def test_search_cache_ttl(tmp_path):
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), ttl=0.2, max_stale=0.2)
+    key = cache.key('Rust  Ownership', 'search', 10)
+    assert key == cache.key('rust ownership', 'search', 10)
+    assert cache.lookup(key) == (None, False)
+    cache.set(key, {'a': 1})
+    assert cache.lookup(key) == ({'a': 1}, True)
+    time.sleep(0.25)
+    assert cache.lookup(key) == ({'a': 1}, False)
+    time.sleep(0.2)
+    # older than ttl + max_stale, not served anymore
+    assert cache.lookup(key) == (None, False)
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_stale_while_revalidate(tmp_path):
+    executor = ThreadPoolExecutor(max_workers=2)
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), ttl=0.1, executor=executor)
+    serper = Serper(delay=0.1)
+    search = _search(cache, serper)
+    assert _snippet(search) == 'v1'
+    time.sleep(0.15)
+
+    # the stale response is served at once, one refresh of the key runs
+    start = time.monotonic()
+    assert [_snippet(search) for _ in range(5)] == ['v1'] * 5
+    assert time.monotonic() - start < 0.1
+    executor.shutdown(wait=True)
+    assert serper.calls == 2
+    assert _snippet(search) == 'v2'
+
+
+def test_refresh_executor_is_bounded(tmp_path):
+    executor = ThreadPoolExecutor(max_workers=2)
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), ttl=0.0, executor=executor)
+    threads = set()
+
+    def refresh():
+        threads.add(threading.get_ident())
+        time.sleep(0.01)
+        return 500, 'error'
+
+    futures = [cache.refresh(str(i), refresh) for i in range(20)]
+    executor.shutdown(wait=True)
+    assert all(future is not None for future in futures)
+    assert len(threads) <= 2
+
+
+def test_no_refresh_in_replay(tmp_path):
+    executor = ThreadPoolExecutor(max_workers=2)
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), ttl=0.0, executor=executor)
+    cassette = Cassette(str(tmp_path / 'run.json.gz'), 'record')
+    cassette.save()
+    with use_cassette(Cassette(cassette.path, 'replay')):
+        assert cache.refresh('a', Serper()) is None
+    executor.shutdown(wait=True)
+
+
+def test_search_cache_size_bound(tmp_path):
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), max_entries=3)
+    cache.evict_interval = 1
+    for i in range(5):
+        cache.set(cache.key(f"q{i}", 'search', 10), {'i': i})
+        time.sleep(0.01)
+    assert len(cache) == 3
+    assert cache.lookup(cache.key('q0', 'search', 10)) == (None, False)
+    assert cache.lookup(cache.key('q4', 'search', 10))[0] == {'i': 4}
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from sine.common.cassette import (Cassette, CassetteMissError, acassette_call,
+                                  cassette_call, is_replaying, use_cassette)
+
+
+def test_record_replay(tmp_path):
+    path = str(tmp_path / 'run.cassette.json.gz')
+    responses = iter(['first', 'second'])
+    cassette = Cassette(path, 'record')
+    with use_cassette(cassette):
+        assert cassette_call('llm', {'q': 1}, lambda: next(responses)) == 'first'
+        assert cassette_call('llm', {'q': 1}, lambda: next(responses)) == 'second'
+        assert asyncio.run(acassette_call('search', {'q': 2}, lambda: asyncio.sleep(0, result=[1]))) == [1]
+    cassette.save()
+
+    cassette = Cassette(path, 'replay')
+    with use_cassette(cassette):
+        assert is_replaying()
+        call = lambda: pytest.fail('replayed calls are not made')
+        # in the recorded order, the last response is repeated
+        assert [cassette_call('llm', {'q': 1}, call) for _ in range(3)] == ['first', 'second', 'second']
+        assert cassette_call('search', {'q': 2}, call) == [1]
+        with pytest.raises(CassetteMissError):
+            cassette_call('llm', {'q': 3}, call)
+    assert not is_replaying()
+    assert cassette.stats() == dict(llm=2, search=1, misses=1)
+
+
+def test_no_cassette():
+    assert cassette_call('llm', {}, lambda: 'called') == 'called'
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / 'c.json.gz'), 'rewind')
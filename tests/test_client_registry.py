@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from sine.common.utils import run_sync
+from sine.models.api_model import (CLIENT_REGISTRY, ClientRegistry,
+                                   get_async_api_model)
+
+
+@pytest.fixture(autouse=True)
+def keys(monkeypatch):
+    for name in ('GROQ_API_KEY', 'DEEPSEEK_API_KEY', 'ZHIPU_API_KEY'):
+        monkeypatch.setenv(name, 'id.secret')
+
+
+def test_sync_clients_shared():
+    registry = ClientRegistry()
+    groq = registry.get('groq')
+    assert registry.get('groq') is groq
+    # one client per provider and base url, all on one connection pool
+    deepseek = registry.get('deepseek')
+    local = registry.get('deepseek', 'http://127.0.0.1:8000/v1')
+    assert len({id(groq), id(deepseek), id(local)}) == 3
+    assert groq._client is deepseek._client is local._client
+
+
+def test_api_key_change(monkeypatch):
+    registry = ClientRegistry()
+    groq = registry.get('groq')
+    monkeypatch.setenv('GROQ_API_KEY', 'other')
+    assert registry.get('groq') is not groq
+    assert registry.get('groq').api_key == 'other'
+
+
+def test_async_clients_per_loop():
+    registry = ClientRegistry()
+
+    async def clients():
+        groq = registry.get_async('groq')
+        assert registry.get_async('groq') is groq
+        assert registry.get_async('deepseek')._client is groq._client
+        # zhipuai has no asyncio client
+        assert registry.get_async('zhipuai') is None
+        await registry.aclose()
+        return groq
+
+    first = asyncio.run(clients())
+    second = asyncio.run(clients())
+    # a new loop gets new clients, the ones of the closed loop were closed
+    assert second is not first
+    assert first._client.is_closed and second._client.is_closed
+
+
+def test_closed_on_loop_shutdown():
+    async def client():
+        return get_async_api_model('llama3-8b-8192')
+
+    first = run_sync(client())
+    assert first._client.is_closed
+    assert run_sync(client()) is not first
+    assert len(CLIENT_REGISTRY._async_clients) == 0
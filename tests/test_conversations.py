@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+
+import sine.agents.storm.storm_agent as storm_agent
+from sine.agents.storm.retriever import SearchEngineResult
+from sine.agents.storm.storm_agent import STORM, STORMConfig
+
+PERSPECTIVISTS = ['novice', 'engineer', 'teacher', 'researcher', 'critic']
+
+
+class Conversation:
+    """Counts the conversations running at once, the first ones finish last."""
+    running = 0
+    max_running = 0
+    finished = []
+
+    def __init__(self, topic, max_turn):
+        self.search_results = []
+        self.failed_turns = 0
+        self.perspectivist = None
+
+    async def astart_conversation(self, perspectivist, expert):
+        cls = type(self)
+        cls.running += 1
+        cls.max_running = max(cls.max_running, cls.running)
+        self.perspectivist = perspectivist
+        await asyncio.sleep(0.02 * (len(PERSPECTIVISTS) - PERSPECTIVISTS.index(perspectivist)))
+        # every conversation finds the shared page and its own one
+        self.search_results = [SearchEngineResult('shared', 'https://example.com/shared', [perspectivist]),
+                               SearchEngineResult(perspectivist, f"https://example.com/{perspectivist}", [f"{perspectivist} notes"])]
+        cls.finished.append(perspectivist)
+        cls.running -= 1
+
+    def export(self):
+        return f"conversation of {self.perspectivist}"
+
+
+def test_conversations_bounded_and_ordered(monkeypatch):
+    monkeypatch.setattr(storm_agent, 'Conversation', Conversation)
+    monkeypatch.setattr(Conversation, 'finished', [])
+    storm = STORM(STORMConfig(topic='Rust', max_conversation_workers=2))
+    storm.stats = {}
+
+    async def roles():
+        return list(PERSPECTIVISTS)
+
+    monkeypatch.setattr(storm, '_ainit_conversation_roles', roles)
+    monkeypatch.setattr(storm, '_init_expert', lambda: SimpleNamespace(failed_queries=[]))
+
+    conversations, search_results = asyncio.run(storm.arun_conversations())
+    assert Conversation.max_running == 2
+    assert Conversation.finished != PERSPECTIVISTS
+    # merged in the perspectivists order, not in the finishing order
+    assert conversations == [f"conversation of {name}" for name in PERSPECTIVISTS]
+    assert [sr.url for sr in search_results] == \
+        ['https://example.com/shared'] + [f"https://example.com/{name}" for name in PERSPECTIVISTS]
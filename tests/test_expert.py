@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from sine.agents.storm.expert import Expert
+from sine.agents.storm.retriever import SearchEngineResult
+from sine.common.schema import ActionReturn, ActionStatusCode
+
+# the first queries finish last, 'broken' fails
+DELAYS = {'ownership': 0.2, 'borrowing': 0.1, 'broken': 0.05, 'lifetimes': 0.0}
+QUERIES = list(DELAYS)
+
+
+class SearchEngine:
+    def __init__(self):
+        self.finished = []
+
+    def _return(self, query):
+        self.finished.append(query)
+        if query == 'broken':
+            return ActionReturn(errmsg='500', state=ActionStatusCode.API_ERROR)
+        return ActionReturn(result=[SearchEngineResult(query, f"https://example.com/{query}", [query])])
+
+    def __call__(self, inputs):
+        time.sleep(DELAYS[inputs['query']])
+        return self._return(inputs['query'])
+
+    async def acall(self, inputs):
+        await asyncio.sleep(DELAYS[inputs['query']])
+        return self._return(inputs['query'])
+
+
+def _expert(engine, on_results=None):
+    return Expert(None, engine, None, None, on_results=on_results, max_search_workers=4)
+
+
+def _check(expert, engine, streamed):
+    # completed in reverse order, merged in the query order
+    assert engine.finished[0] == 'lifetimes' and engine.finished[-1] == 'ownership'
+    urls = [f"https://example.com/{q}" for q in QUERIES if q != 'broken']
+    assert [result.url for result in expert.collected_results] == urls
+    assert [result.url for result in streamed] == urls
+    # the failed query is reported, the turn goes on
+    assert expert.failed_queries == [dict(query='broken', error='500')]
+
+
+def test_search_merges_in_query_order():
+    engine, streamed = SearchEngine(), []
+    expert = _expert(engine, streamed.extend)
+    start = time.perf_counter()
+    expert.search(QUERIES)
+    assert time.perf_counter() - start < sum(DELAYS.values())
+    _check(expert, engine, streamed)
+
+
+def test_asearch_merges_in_query_order():
+    engine, streamed = SearchEngine(), []
+    expert = _expert(engine, streamed.extend)
+    asyncio.run(expert.asearch(QUERIES))
+    _check(expert, engine, streamed)
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+from sine.common.http import HTTP_SESSIONS, HTTPConfig, HTTPSessions
+from sine.common.utils import run_sync
+
+
+def _sessions(monkeypatch, sessions=None, handler=lambda request: httpx.Response(200, text='ok')):
+    """`sessions` whose asyncio clients are mocked, and the clients created."""
+    sessions = sessions or HTTPSessions()
+    created = []
+
+    def new_async_client():
+        created.append(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        return created[-1]
+
+    monkeypatch.setattr(sessions, '_new_async_client', new_async_client)
+    return sessions, created
+
+
+def test_session_reused(monkeypatch):
+    sessions = HTTPSessions()
+    session = sessions.session()
+    calls = []
+    monkeypatch.setattr(session, 'request', lambda method, url, **kwargs: calls.append((method, url)))
+    sessions.request('GET', 'https://example.com/a')
+    sessions.request('GET', 'https://example.com/b')
+    assert sessions.session() is session
+    assert calls == [('GET', 'https://example.com/a'), ('GET', 'https://example.com/b')]
+
+
+def test_async_client_per_loop(monkeypatch):
+    sessions, created = _sessions(monkeypatch)
+
+    async def requests():
+        responses = await asyncio.gather(*[sessions.arequest('GET', f"https://example.com/{i}") for i in range(5)])
+        assert [response.text for response in responses] == ['ok'] * 5
+        client = sessions.async_client()[0]
+        await sessions.aclose()
+        return client
+
+    first = asyncio.run(requests())
+    second = asyncio.run(requests())
+    # one client per loop, closed with it
+    assert created == [first, second]
+    assert first.is_closed and second.is_closed
+
+
+def test_closed_on_loop_shutdown(monkeypatch):
+    _, created = _sessions(monkeypatch, HTTP_SESSIONS)
+
+    async def client():
+        return HTTP_SESSIONS.async_client()[0]
+
+    first = run_sync(client())
+    assert first.is_closed
+    assert run_sync(client()) is not first
+
+
+def test_configure_closes_sessions(monkeypatch):
+    sessions, created = _sessions(monkeypatch)
+    session = sessions.session()
+
+    # an event loop running in another thread, e.g. the one of the app
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        async def client():
+            return sessions.async_client()[0]
+
+        client = asyncio.run_coroutine_threadsafe(client(), loop).result()
+        sessions.configure(HTTPConfig(pool_size=2))
+        deadline = time.monotonic() + 2
+        while not client.is_closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.is_closed
+        assert sessions.session() is not session
+        assert sessions.session().get_adapter('https://example.com').poolmanager.connection_pool_kw['maxsize'] == 2
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
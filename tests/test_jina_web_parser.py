@@ -0,0 +1,170 @@
+import asyncio
+
+import httpx
+import pytest
+
+from sine.actions.jina_web_parser import (CappedReader, JinaWebParser,
+                                          PageCache, _charset)
+from sine.common.http import HTTP_SESSIONS
+
+URL = 'https://example.com/page'
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    """Fake jina reader, `responses` are served in order, the last one is repeated."""
+    state = dict(responses=[], requests=[])
+
+    def handler(request):
+        state['requests'].append(request)
+        response = state['responses'][0] if len(state['responses']) == 1 else state['responses'].pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(HTTP_SESSIONS, '_new_async_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return state
+
+
+def _page(text, **headers):
+    return httpx.Response(200, text=f"Title: x\nMarkdown Content:\n{text}",
+                          headers={'Content-Type': 'text/plain', **headers})
+
+
+def _fetch(parser):
+    return asyncio.run(parser.arun(URL))
+
+
+def test_fresh_hit(tmp_path, reader):
+    reader['responses'] = [_page('first', ETag='"v1"')]
+    parser = JinaWebParser(cache=PageCache(str(tmp_path / 'pages.sqlite')))
+    assert _fetch(parser) == (200, 'first')
+    assert _fetch(parser) == (200, 'first')
+    assert len(reader['requests']) == 1
+
+
+def test_revalidation(tmp_path, reader):
+    # every page is stale at once and revalidated
+    cache = PageCache(str(tmp_path / 'pages.sqlite'), ttl=0)
+    parser = JinaWebParser(cache=cache)
+    reader['responses'] = [_page('first', ETag='"v1"', **{'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}),
+                           httpx.Response(304),
+                           httpx.Response(503),
+                           _page('second', ETag='"v2"'),
+                           httpx.ConnectError('reset')]
+    assert _fetch(parser) == (200, 'first')
+    assert _fetch(parser) == (200, 'first')
+    request = reader['requests'][1]
+    assert request.headers['If-None-Match'] == '"v1"'
+    assert request.headers['If-Modified-Since'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+    assert cache.stats()['not_modified'] == 1
+
+    # a failed revalidation returns the stale page, a changed page replaces it
+    assert _fetch(parser) == (200, 'first')
+    assert _fetch(parser) == (200, 'second')
+    assert _fetch(parser) == (200, 'second')
+    assert reader['requests'][-1].headers['If-None-Match'] == '"v2"'
+    assert cache.stats()['revalidations'] == 4
+
+
+@pytest.mark.parametrize('response, status_code', [
+    (httpx.Response(404, text='not found'), 404),
+    (httpx.Response(200, text='<h1>Access denied</h1>', headers={'Content-Type': 'text/html'}), -1),
+    (httpx.Response(200, content=b'%PDF', headers={'Content-Type': 'application/pdf'}), -1),
+])
+def test_negative_entries(tmp_path, reader, response, status_code):
+    reader['responses'] = [response]
+    cache = PageCache(str(tmp_path / 'pages.sqlite'))
+    parser = JinaWebParser(cache=cache)
+    assert _fetch(parser)[0] == status_code
+    assert _fetch(parser)[0] == status_code
+    assert len(reader['requests']) == 1
+    assert cache.stats()['negative_hits'] == 1
+
+
+def test_rejects_pdf_url(tmp_path, reader):
+    # the reader answers text/plain whatever the type of the target page
+    reader['responses'] = [httpx.Response(200, text='%PDF-1.7 binary', headers={'Content-Type': 'text/plain'})]
+    parser = JinaWebParser(cache=PageCache(str(tmp_path / 'pages.sqlite')))
+    status_code, _ = asyncio.run(parser.arun('https://example.com/paper.pdf?dl=1'))
+    assert status_code == -1
+    assert parser.run('https://example.com/paper.pdf')[0] == -1
+    assert reader['requests'] == []
+    assert parser.rejected[0] == dict(url='https://example.com/paper.pdf?dl=1', content_type='application/pdf')
+    # pages without a known extension are still read
+    assert _fetch(parser) == (200, '%PDF-1.7 binary')
+
+
+@pytest.mark.parametrize('response', [
+    httpx.Response(503, text='unavailable'),
+    httpx.Response(429, text='slow down'),
+    httpx.ConnectTimeout('slow'),
+])
+def test_transient_failures_not_cached(tmp_path, reader, response):
+    reader['responses'] = [response, _page('back')]
+    parser = JinaWebParser(cache=PageCache(str(tmp_path / 'pages.sqlite')))
+    assert _fetch(parser)[0] != 200
+    assert _fetch(parser) == (200, 'back')
+    assert len(reader['requests']) == 2
+
+
+def test_negative_entries_expire(tmp_path, reader):
+    reader['responses'] = [httpx.Response(404), _page('back')]
+    parser = JinaWebParser(cache=PageCache(str(tmp_path / 'pages.sqlite'), negative_ttl=0))
+    assert _fetch(parser)[0] == 404
+    assert _fetch(parser) == (200, 'back')
+
+
+def test_reads_whole_body():
+    reader = CappedReader(max_bytes=100)
+    assert reader.feed('héllo '.encode()) and reader.feed(b'world')
+    assert reader.text() == 'héllo world'
+    assert not reader.truncated and not reader.blocked
+
+
+def test_truncates_at_cap():
+    reader = CappedReader(max_bytes=10, block_check_bytes=4)
+    assert not reader.feed(b'x' * 8 + 'é'.encode() + b'tail')
+    assert reader.truncated and reader.num_bytes == 10
+    assert reader.text() == 'x' * 8 + 'é'
+
+
+def test_multibyte_char_split_over_chunks():
+    reader = CappedReader()
+    data = 'é'.encode()
+    reader.feed(data[:1])
+    reader.feed(data[1:])
+    assert reader.text() == 'é'
+
+
+def test_block_page_stops_early():
+    reader = CappedReader(max_bytes=None, block_check_bytes=32)
+    assert not reader.feed(b'<h1>Access Denied</h1> and much more')
+    assert reader.blocked
+    reader = CappedReader(block_check_bytes=32)
+    assert reader.feed(b'a normal page ' * 4)
+    assert not reader.blocked
+
+
+def test_charset():
+    assert _charset('text/html; charset=ISO-8859-1') == 'ISO-8859-1'
+    assert _charset('text/plain') == 'utf-8'
+    assert CappedReader('no-such-codec').feed(b'ok')
+
+
+def test_truncated_page_cache(tmp_path, reader):
+    reader['responses'] = [_page('x' * 100)]
+    cache = PageCache(str(tmp_path / 'pages.sqlite'))
+    parser = JinaWebParser(cache=cache, max_bytes=50)
+    status_code, content = _fetch(parser)
+    assert status_code == 200 and len(content) < 50
+    # a hit reports the truncation again
+    assert _fetch(parser) == (status_code, content)
+    assert parser.oversized == [dict(url=URL, bytes=50)] * 2
+    assert len(reader['requests']) == 1
+
+    # a larger cap reads the page again
+    parser = JinaWebParser(cache=cache, max_bytes=None)
+    assert _fetch(parser) == (200, 'x' * 100)
+    assert len(reader['requests']) == 2 and parser.oversized == []
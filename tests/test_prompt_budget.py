@@ -0,0 +1,28 @@
+from sine.models.prompt_budget import PromptBudget
+
+
+def test_pack_fits():
+    budget = PromptBudget('llama3-8b-8192', max_tokens=1000)
+    parts = ['short part', 'another short part']
+    assert budget.pack(parts) == parts
+
+
+def test_pack_truncates_by_priority():
+    budget = PromptBudget('llama3-8b-8192', max_tokens=200, min_part_tokens=10)
+    long = ' '.join(['word'] * 1000)
+    packed = budget.pack(['first part', long, long], priorities=[0, 1, 1])
+    assert packed[0] == 'first part'
+    # the parts of the same priority share the tokens left
+    assert 0 < len(packed[1]) < len(long) and 0 < len(packed[2]) < len(long)
+    assert all(90 <= budget.count(part) <= 100 for part in packed[1:])
+    assert sum(budget.count(part) for part in packed) <= 200
+
+
+def test_pack_drops_small_shares():
+    budget = PromptBudget('llama3-8b-8192', max_tokens=50, min_part_tokens=40)
+    long = ' '.join(['word'] * 1000)
+    # half of the budget is too small, the part is dropped and the other
+    # part gets the whole budget
+    packed = budget.pack([long, long], priorities=[0, 0])
+    assert packed[0] == ''
+    assert 40 <= budget.count(packed[1]) <= 50
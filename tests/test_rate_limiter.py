@@ -0,0 +1,81 @@
+import threading
+import time
+
+from sine.agents.storm.storm_agent import STORMConfig
+from sine.models.api_model import (Priority, ProviderRateLimiter, RateLimiter,
+                                   TokenBucket, estimate_tokens)
+
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(60) # one per second
+    bucket.level = 0
+    assert bucket.wait_time(3) == 3.0
+    bucket.refill(bucket._updated + 2)
+    assert bucket.level == 2 and bucket.wait_time(2) == 0.0
+    bucket.refill(bucket._updated + 3600)
+    assert bucket.level == 60
+
+
+def test_requests_budget():
+    limiter = ProviderRateLimiter(rpm=60, critical_reserve=0)
+    assert [limiter.reserve(1) for _ in range(60)] == [0.0] * 60
+    assert 0 < limiter.reserve(1) <= 1.0
+
+
+def test_large_call_waits_for_full_bucket():
+    limiter = ProviderRateLimiter(tpm=100, critical_reserve=0)
+    assert limiter.reserve(1000) == 0.0
+    assert limiter.reserve(1) > 0
+
+
+def test_critical_reserve():
+    limiter = ProviderRateLimiter(rpm=10, critical_reserve=0.2)
+    for _ in range(8):
+        assert limiter.reserve(1) == 0.0
+    # the last 20% of the bucket are left to critical calls
+    assert limiter.reserve(1) > 0
+    assert limiter.reserve(1, Priority.CRITICAL) == 0.0
+
+
+def test_normal_calls_yield_to_waiting_critical_calls():
+    limiter = ProviderRateLimiter(rpm=600, critical_reserve=0)
+    limiter.requests.level = 0
+    order = []
+
+    def call(priority):
+        limiter.acquire(1, priority)
+        order.append(priority)
+
+    critical = threading.Thread(target=call, args=(Priority.CRITICAL,))
+    critical.start()
+    time.sleep(0.02)
+    normal = threading.Thread(target=call, args=(Priority.NORMAL,))
+    normal.start()
+    critical.join()
+    normal.join()
+    assert order == [Priority.CRITICAL, Priority.NORMAL]
+
+
+def test_block_and_usage():
+    limiter = ProviderRateLimiter(tpm=1000, critical_reserve=0)
+    limiter.block(0.5)
+    assert 0.4 < limiter.reserve(1) <= 0.5
+
+    limiter = ProviderRateLimiter(tpm=1000, critical_reserve=0)
+    assert limiter.reserve(100) == 0.0
+    limiter.record_usage(estimated_tokens=100, used_tokens=300)
+    assert round(limiter.tokens.level) == 700
+
+
+def test_limiter_per_provider():
+    limiters = RateLimiter({'groq': dict(rpm=30, tpm=6000)})
+    assert limiters.get('groq') is limiters.get('groq')
+    assert limiters.get('groq').requests.capacity == 30
+    # providers without limits are not limited
+    assert limiters.get('deepseek').requests is None
+    assert estimate_tokens([dict(role='user', content='x' * 400)], completion_tokens=0) == 100
+
+
+def test_hack_sleep_is_ignored():
+    # old configs still load
+    assert STORMConfig(topic='Rust', hack_sleep=10).hack_sleep == 10
@@ -0,0 +1,21 @@
+from sine.agents.storm.result_store import SearchResultStore, normalize_url
+from sine.agents.storm.retriever import SearchEngineResult
+
+
+def test_normalize_url():
+    assert normalize_url('HTTPS://Example.com/a/#frag') == 'https://example.com/a'
+    assert normalize_url('https://example.com/a?q=1') == 'https://example.com/a?q=1'
+
+
+def test_dedupe_and_merge():
+    store = SearchResultStore()
+    first = SearchEngineResult('t', 'https://a.com/x', ['one'])
+    new = store.add([first,
+                     SearchEngineResult('t', 'https://A.com/x/', ['one', 'two']),
+                     SearchEngineResult('mirror', 'https://mirror.com/x', ['one'])])
+    assert len(new) == 1 and len(store) == 1
+    assert store.results()[0].snippets == ['one', 'two']
+    # the added results are not modified
+    assert first.snippets == ['one']
+    assert SearchEngineResult('t', 'https://a.com/x#y', []) in store
+    assert store.stats() == dict(added=3, unique=1, duplicates=2, merged_snippets=1)
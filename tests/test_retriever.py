@@ -0,0 +1,43 @@
+import numpy as np
+
+from sine.agents.storm.retriever import (BM25Index,
+                                         SentenceTransformerRetriever,
+                                         WebPageContent, tokenize)
+
+
+def test_tokenize():
+    assert tokenize('Rust ownership_rules 借用') == ['rust', 'ownership', 'rules', '借', '用']
+
+
+def test_bm25_ranking():
+    index = BM25Index()
+    index.add('a', 'rust ownership and borrowing')
+    index.add('b', 'python garbage collection')
+    index.add('c', 'ownership ownership in rust')
+    ranked = index.query('rust ownership')
+    assert [doc_id for doc_id, _ in ranked][:2] == ['c', 'a']
+    assert ranked[-1] == ('b', 0.0)
+    assert len(index.query('rust', top_k=1)) == 1
+
+
+def test_bm25_ties_keep_order():
+    index = BM25Index()
+    for doc_id in 'abc':
+        index.add(doc_id, 'same text')
+    assert [doc_id for doc_id, _ in index.query('text')] == ['a', 'b', 'c']
+    assert BM25Index().query('anything') == []
+
+
+class Encoder:
+    def encode(self, texts, show_progress_bar=False):
+        return np.array([[len(text), 1.0] for text in texts])
+
+
+def test_retriever_keep():
+    retriever = SentenceTransformerRetriever(encoder=Encoder())
+    chunks = [WebPageContent(str(i), 't', 'https://a.com', 'x' * (i + 1)) for i in range(3)]
+    retriever.add(chunks[:2])
+    retriever.add(chunks[2:])
+    retriever.keep([chunks[2], chunks[0]])
+    assert retriever.data_raw == [chunks[2], chunks[0]]
+    assert retriever.embeddings[:, 0].tolist() == [3, 1]
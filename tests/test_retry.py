@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from sine.models.api_model import (APIModel, RateLimiter, get_retry_after,
+                                   is_transient_error)
+
+
+def _ok(model, delay):
+    return f"ok after {delay}"
+
+
+def _model(**kwargs):
+    return APIModel('llama3-8b-8192', rate_limiter=RateLimiter({}), backoff=0.01, **kwargs)
+
+
+def test_error_kinds(status_error):
+    assert is_transient_error(status_error(503)) and is_transient_error(httpx.ConnectTimeout('slow'))
+    assert not is_transient_error(status_error(400))
+    assert get_retry_after(status_error(429, {'retry-after': '2'})) == 2.0
+    assert get_retry_after(status_error(429)) == 5.0
+    assert get_retry_after(status_error(503)) is None
+
+
+def test_retry_transient_errors(fake_completions, status_error):
+    completions = fake_completions([status_error(503), httpx.ConnectError('reset')], reply=_ok)
+    model = _model(max_retries=2)
+    assert model.chat('q1') == 'ok after 0.0'
+    assert len(completions.calls) == 3
+
+    completions = fake_completions([status_error(503)] * 3, reply=_ok)
+    model = _model(max_retries=2)
+    with pytest.raises(httpx.HTTPStatusError):
+        model.chat('q2')
+    assert len(completions.calls) == 3
+
+
+def test_no_retry_of_bad_requests(fake_completions, status_error):
+    completions = fake_completions([status_error(400)], reply=_ok)
+    model = _model()
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(model.achat('q'))
+    assert len(completions.calls) == 1
+
+
+def test_rate_limit_blocks_provider(fake_completions, status_error):
+    completions = fake_completions([status_error(429, {'retry-after': '0.2'})], reply=_ok)
+    model = _model(max_retries=0)
+    start = time.monotonic()
+    assert model.chat('q').startswith('ok')
+    # the retry waits in the rate limiter until the Retry-After passed
+    assert time.monotonic() - start >= 0.2
+    assert len(completions.calls) == 2
+
+
+def test_separate_retry_budgets(fake_completions, status_error):
+    rate_limited = status_error(429, {'retry-after': '0'})
+    completions = fake_completions([status_error(503), rate_limited, rate_limited, status_error(502)], reply=_ok)
+    model = _model(max_retries=2, max_rate_limit_retries=2)
+    assert asyncio.run(model.achat('q1')).startswith('ok')
+    assert len(completions.calls) == 5
+
+    completions = fake_completions([rate_limited] * 3, reply=_ok)
+    model = _model(max_retries=5, max_rate_limit_retries=2)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(model.achat('q2'))
+    assert len(completions.calls) == 3
+
+
+def _hedged_model():
+    model = _model(hedge_percentile=0.9)
+    for _ in range(model.latencies.min_samples):
+        model.latencies.record(0.05)
+    return model
+
+
+def test_hedged_request(fake_completions):
+    # the first request is stuck, the hedged one answers
+    completions = fake_completions(delays=[1.0, 0.0], reply=_ok)
+    model = _hedged_model()
+    start = time.monotonic()
+    assert model.chat('q') == 'ok after 0.0'
+    assert time.monotonic() - start < 0.5
+    assert len(completions.calls) == 2
+
+
+def test_ahedged_request(fake_completions):
+    fake_completions(delays=[1.0, 0.0], reply=_ok)
+    model = _hedged_model()
+    start = time.monotonic()
+    assert asyncio.run(model.achat('q')) == 'ok after 0.0'
+    assert time.monotonic() - start < 0.5
+
+    # no hedge when the request is as fast as usual
+    completions = fake_completions(delays=[0.0], reply=_ok)
+    model = _hedged_model()
+    asyncio.run(model.achat('q'))
+    assert len(completions.calls) == 1
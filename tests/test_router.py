@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from sine.models.api_model import RateLimiter
+from sine.models.router import ModelRouter, get_llm
+
+MODELS = ['llama3-8b-8192', 'deepseek-chat', 'moonshot-v1-8k']
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    for name in ('GROQ_API_KEY', 'DEEPSEEK_API_KEY', 'MOONSHOT_API_KEY'):
+        monkeypatch.setenv(name, 'x')
+
+
+def _router():
+    return ModelRouter(model_names=MODELS, rate_limiter=RateLimiter({}))
+
+
+def test_fail_over_on_server_error(fake_completions, status_error, keys):
+    completions = fake_completions({'llama3-8b-8192': [status_error(503)]})
+    router = _router()
+    assert router.chat('q') == 'deepseek-chat'
+    # the members do not retry themselves
+    assert completions.calls == ['llama3-8b-8192', 'deepseek-chat']
+    assert router.rank()[-1] == 'llama3-8b-8192'
+    assert router.health['llama3-8b-8192'].error_rate > 0
+
+
+def test_fail_over_on_rate_limit(fake_completions, status_error, keys):
+    completions = fake_completions({'llama3-8b-8192': [status_error(429, {'retry-after': '30'})]})
+    router = _router()
+    assert asyncio.run(router.achat('q')) == 'deepseek-chat'
+    assert completions.calls == ['llama3-8b-8192', 'deepseek-chat']
+    # blocked in the rate limiter, not a failure of the model
+    assert router.models['llama3-8b-8192'].limiter.blocked_until > time.monotonic() + 20
+    assert router.health['llama3-8b-8192'].error_rate == 0
+    assert router.rank()[-1] == 'llama3-8b-8192'
+
+
+def test_bad_request_is_raised(fake_completions, status_error, keys):
+    completions = fake_completions({'llama3-8b-8192': [status_error(400)]})
+    router = _router()
+    with pytest.raises(httpx.HTTPStatusError):
+        router.chat('q')
+    assert completions.calls == ['llama3-8b-8192']
+    assert router.health['llama3-8b-8192'].error_rate == 0
+
+
+def test_all_rate_limited(fake_completions, status_error, keys):
+    completions = fake_completions({name: [status_error(429, {'retry-after': str(0.1 * (i + 1))})]
+                               for i, name in enumerate(MODELS)})
+    router = _router()
+    start = time.monotonic()
+    # the model unblocked first is tried again
+    assert router.chat('q') == 'llama3-8b-8192'
+    assert time.monotonic() - start >= 0.1
+    assert completions.calls == MODELS + ['llama3-8b-8192']
+
+    completions = fake_completions({name: [status_error(429, {'retry-after': '0'})] * 2 for name in MODELS})
+    router = _router()
+    router.max_rate_limit_retries = 1
+    with pytest.raises(httpx.HTTPStatusError):
+        router.chat('q')
+    assert len(completions.calls) == 2 * len(MODELS)
+
+
+def test_retry_rounds_on_server_errors(fake_completions, status_error, keys):
+    completions = fake_completions({name: [status_error(503)] for name in MODELS})
+    router = _router()
+    router.backoff = 0.0
+    # every model failed, the whole tier is tried again
+    assert asyncio.run(router.achat('q')) in MODELS
+    assert len(completions.calls) == len(MODELS) + 1
+
+    completions = fake_completions({name: [status_error(503)] for name in MODELS})
+    router = _router()
+    router.max_retries = 0
+    with pytest.raises(httpx.HTTPStatusError):
+        router.chat('q')
+    assert len(completions.calls) == len(MODELS)
+
+
+def test_rank_by_latency(keys):
+    router = _router()
+    router.health['moonshot-v1-8k'].record_success(0.1)
+    assert router.rank()[0] == 'moonshot-v1-8k'
+    router.health['moonshot-v1-8k'].record_failure()
+    assert router.rank()[-1] == 'moonshot-v1-8k'
+
+
+def test_missing_key_last(monkeypatch, keys):
+    monkeypatch.delenv('GROQ_API_KEY')
+    router = _router()
+    assert router.rank()[-1] == 'llama3-8b-8192'
+    assert isinstance(get_llm('fast-small'), ModelRouter)
+    assert not isinstance(get_llm('glm-4'), ModelRouter)
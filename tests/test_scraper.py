@@ -0,0 +1,78 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from sine.agents.storm.retriever import SearchEngineResult
+from sine.agents.storm.scraper import WebScraper
+
+
+class Parser:
+    """Fake JinaWebParser which tracks the requests running per domain."""
+
+    def __init__(self, delays=None, default_delay=0.05):
+        self.delays = delays or {}
+        self.default_delay = default_delay
+        self.running = defaultdict(int)
+        self.max_running = defaultdict(int)
+        self.max_total = 0
+        self.starts = defaultdict(list)
+        self.calls = []
+
+    async def arun(self, url):
+        domain = WebScraper.domain(url)
+        self.calls.append(url)
+        self.starts[domain].append(time.monotonic())
+        self.running[domain] += 1
+        self.max_running[domain] = max(self.max_running[domain], self.running[domain])
+        self.max_total = max(self.max_total, sum(self.running.values()))
+        try:
+            await asyncio.sleep(self.delays.get(url, self.default_delay))
+        finally:
+            self.running[domain] -= 1
+        if 'fail' in url:
+            return 500, ''
+        return 200, f"content of {url}"
+
+
+def _results(urls):
+    return [SearchEngineResult('t', url, ['snippet']) for url in urls]
+
+
+def test_per_domain_and_global_limits():
+    parser = Parser()
+    scraper = WebScraper(parser, max_workers=3, max_per_domain=2)
+    urls = [f"https://a.com/{i}" for i in range(4)] + [f"https://b.com/{i}" for i in range(4)]
+    webpages = asyncio.run(scraper.ascrape(_results(urls)))
+    assert [webpage.url for webpage in webpages] == urls
+    assert parser.max_running['a.com'] == 2 and parser.max_running['b.com'] <= 2
+    assert parser.max_total == 3
+
+
+def test_domain_delay():
+    parser = Parser(default_delay=0.0)
+    scraper = WebScraper(parser, max_workers=4, max_per_domain=4, domain_delay=0.1)
+    asyncio.run(scraper.ascrape(_results([f"https://a.com/{i}" for i in range(3)] + ["https://b.com/0"])))
+    starts = parser.starts['a.com']
+    assert all(later - earlier >= 0.09 for earlier, later in zip(starts, starts[1:]))
+    # the other domain does not wait for it
+    assert parser.starts['b.com'][0] - starts[0] < 0.05
+
+
+def test_duplicates_scraped_once():
+    parser = Parser()
+    scraper = WebScraper(parser)
+    urls = ["https://a.com/x", "https://A.com/x/", "https://a.com/x#part", "https://a.com/fail"]
+    webpages = asyncio.run(scraper.ascrape(_results(urls)))
+    assert len(parser.calls) == 2
+    assert webpages[0] is webpages[1] is webpages[2] and webpages[3] is None
+    assert scraper.stats()['ok'] == 1 and scraper.stats()['failed'] == 1
+
+
+def test_deadline():
+    parser = Parser(delays={"https://slow.com/0": 5.0}, default_delay=0.01)
+    scraper = WebScraper(parser, deadline=0.2)
+    start = time.monotonic()
+    webpages = asyncio.run(scraper.ascrape(_results(["https://a.com/0", "https://slow.com/0"])))
+    assert time.monotonic() - start < 1.0
+    assert webpages[0] is not None and webpages[1] is None
+    assert [timing['status'] for timing in scraper.timings] == ['ok', 'cancelled']
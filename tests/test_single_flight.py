@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from sine.common.single_flight import SingleFlight, flight_key
+
+
+def test_flight_key():
+    assert flight_key('a', {'x': 1, 'y': 2}) == flight_key('a', {'y': 2, 'x': 1})
+    assert flight_key('a', 1) != flight_key('a', 2)
+
+
+def test_do_coalesces_threads():
+    flights = SingleFlight('test')
+    calls = []
+
+    def call():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('k', call))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert flights.stats() == dict(calls=5, saved=4)
+
+
+def test_ado_coalesces_and_copies():
+    flights = SingleFlight('test', copy_result=True)
+    calls = []
+
+    async def acall():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {'items': [1]}
+
+    async def main():
+        return await asyncio.gather(*[flights.ado('k', acall) for _ in range(3)], flights.ado('other', acall))
+
+    results = asyncio.run(main())
+    assert len(calls) == 2
+    assert results[0] == results[1] == {'items': [1]}
+    assert results[0] is not results[1]
+
+
+def test_ado_shares_errors():
+    flights = SingleFlight('test')
+
+    async def acall():
+        await asyncio.sleep(0.05)
+        raise ValueError('boom')
+
+    async def main():
+        return await asyncio.gather(*[flights.ado('k', acall) for _ in range(2)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    # the failed flight is not kept
+    with pytest.raises(ValueError):
+        asyncio.run(flights.ado('k', acall))
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+from sine.agents.storm.retriever import SearchEngineResult, WebPageContent
+from sine.agents.storm.source_stream import WritingSourceStream
+
+
+class Retriever:
+    def __init__(self):
+        self.chunks = {}
+
+    def reset(self):
+        self.chunks = {}
+
+    def add(self, chunks):
+        self.chunks.update((chunk.uuid, chunk) for chunk in chunks)
+
+    def keep(self, chunks):
+        uuids = {chunk.uuid for chunk in chunks}
+        self.chunks = {uuid: chunk for uuid, chunk in self.chunks.items() if uuid in uuids}
+
+
+class Scraper:
+    deadline = 5.0
+
+    def __init__(self):
+        self.scraped = []
+        self.threads = set()
+
+    async def ascrape_one(self, sr):
+        self.threads.add(threading.get_ident())
+        self.scraped.append(sr.url)
+        await asyncio.sleep(0)
+        return WebPageContent(sr.url, sr.title, sr.url, f"content of {sr.url}")
+
+    def cancel(self):
+        pass
+
+
+def _results(i):
+    return [SearchEngineResult(f"r{i}", f"https://example.com/{i}", ['snippet'])]
+
+
+def test_put_from_threads():
+    scraper = Scraper()
+    retriever = Retriever()
+
+    async def run():
+        stream = WritingSourceStream(retriever, scraper, num_scrapers=2)
+        stream.start()
+        # the sync expert search calls put from its thread pool
+        threads = [threading.Thread(target=stream.put, args=(_results(i % 10),)) for i in range(40)]
+        for thread in threads:
+            thread.start()
+        await asyncio.to_thread(lambda: [thread.join() for thread in threads])
+        return await stream.aclose([sr for i in range(10) for sr in _results(i)])
+
+    chunks = asyncio.run(run())
+    # every url is scraped once, by the event loop
+    assert sorted(scraper.scraped) == sorted(f"https://example.com/{i}" for i in range(10))
+    assert len(scraper.threads) == 1
+    assert [chunk.url for chunk in chunks] == [f"https://example.com/{i}" for i in range(10)]
+    assert len(retriever.chunks) == 10
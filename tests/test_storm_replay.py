@@ -0,0 +1,78 @@
+"""Record a STORM run against the stub llm server and mocked search and
+scraping, then replay it offline without api keys."""
+
+import hashlib
+
+import httpx
+import numpy as np
+import pytest
+
+import sine.agents.storm.storm_agent as storm_agent
+from sine.common.http import HTTP_SESSIONS
+from sine.models.stub_server import StubConfig, start_stub_server
+
+
+class Encoder:
+    def encode(self, texts, show_progress_bar=False):
+        one = lambda text: np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint8).astype(float)
+        return np.stack([one(text) for text in texts]) if isinstance(texts, list) else one(texts)
+
+
+@pytest.fixture
+def web(monkeypatch):
+    state = dict(replaying=False, requests=0)
+
+    def handler(request):
+        assert not state['replaying'], f"request {request.url} in replay"
+        state['requests'] += 1
+        url = str(request.url)
+        if 'serper' in url:
+            query = request.url.params['q']
+            return httpx.Response(200, json={'organic': [
+                {'title': f'{query} {i}', 'link': f'https://example.com/{len(query) % 5}/{i}',
+                 'snippet': f'{query} snippet {i}'} for i in range(3)]})
+        if 'jina' in url:
+            return httpx.Response(200, text=f"Title: x\nMarkdown Content:\n# Page\n{url} content " * 30)
+        return httpx.Response(200, text="<html><h1 id='firstHeading'>Rust</h1><div id='toc'></div></html>")
+
+    monkeypatch.setattr(HTTP_SESSIONS, '_new_async_client',
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=True))
+    return state
+
+
+def _run(cassette_path, mode, base_url=None):
+    cfg = storm_agent.STORMConfig(topic='Rust ownership',
+                                  max_perspectivist=2,
+                                  max_conversation_turn=2,
+                                  conversation_llm='fast-small',
+                                  writing_sources='search_webpage',
+                                  llm_base_url=base_url,
+                                  cassette_path=cassette_path,
+                                  cassette_mode=mode)
+    storm = storm_agent.STORM(cfg)
+    storm.init(encoder=Encoder())
+    storm.run_pipeline()
+    return storm
+
+
+def test_record_and_replay(tmp_path, monkeypatch, web):
+    monkeypatch.chdir(tmp_path)
+    cassette_path = str(tmp_path / 'run.cassette.json.gz')
+
+    monkeypatch.setenv('GROQ_API_KEY', 'x')
+    monkeypatch.setenv('SERPER_API_KEY', 'x')
+    server = start_stub_server(StubConfig(latency='fixed:0.01'))
+    try:
+        recorded = _run(cassette_path, 'record', server.base_url)
+    finally:
+        server.shutdown()
+    assert web['requests'] > 0
+    assert recorded.stats['cassette']['misses'] == 0
+
+    for name in ('GROQ_API_KEY', 'SERPER_API_KEY', 'DEEPSEEK_API_KEY', 'MOONSHOT_API_KEY'):
+        monkeypatch.delenv(name, raising=False)
+    web['replaying'] = True
+    replayed = _run(cassette_path, 'replay')
+
+    assert replayed.final_article == recorded.final_article
+    assert replayed.stats['cassette'] == recorded.stats['cassette']
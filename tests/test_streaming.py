@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from sine.agents.storm.writer import Writer
+from sine.common.trace import run_trace
+from sine.models.api_model import APIModel, LLMCache, RateLimiter
+
+COMPLETION = "Rust has no garbage collector."
+USAGE = dict(prompt_tokens=3, completion_tokens=5, total_tokens=8)
+
+
+@pytest.fixture
+def completions(fake_completions):
+    return fake_completions(reply=lambda model, delay: COMPLETION, usage=SimpleNamespace(**USAGE))
+
+
+def _model(tmp_path):
+    return APIModel('llama3-8b-8192', rate_limiter=RateLimiter({}), cache=LLMCache(str(tmp_path / 'llm.sqlite')))
+
+
+def test_stream(tmp_path, completions):
+    model = _model(tmp_path)
+    deltas = list(model.stream('question'))
+    assert len(deltas) == len(COMPLETION.split(' '))
+    assert ''.join(deltas) == COMPLETION
+    # the streamed completion is cached, the cached one is a single delta
+    assert model.chat('question') == COMPLETION
+    assert list(model.stream('question')) == [COMPLETION]
+    assert len(completions.calls) == 1
+
+
+def test_astream(tmp_path, completions):
+    model = _model(tmp_path)
+
+    async def consume():
+        return [delta async for delta in model.astream('question')]
+
+    deltas = asyncio.run(consume())
+    assert len(deltas) > 1 and ''.join(deltas) == COMPLETION
+    assert asyncio.run(consume()) == [COMPLETION]
+    assert len(completions.calls) == 1
+
+
+def test_streamed_dict_usage(tmp_path, completions):
+    # the sdks expose the usage of the last chunk as a plain dict
+    completions.usage = dict(USAGE)
+    model = _model(tmp_path)
+
+    async def consume():
+        return [delta async for delta in model.astream('question', use_cache=False)]
+
+    with run_trace() as trace:
+        list(model.stream('question', use_cache=False))
+        asyncio.run(consume())
+    assert len(trace.records) == 2
+    for record in trace.records:
+        assert record['stream']
+        assert (record['prompt_tokens'], record['completion_tokens']) == (3, 5)
+
+
+def test_streamed_usage_corrects_tokens_budget(tmp_path, completions, monkeypatch):
+    completions.usage = dict(USAGE)
+    model = _model(tmp_path)
+    used = []
+    monkeypatch.setattr(model.limiter, 'record_usage', lambda estimated, tokens: used.append(tokens))
+    list(model.stream('question', use_cache=False))
+    assert used == [USAGE['total_tokens']]
+
+
+def test_abandoned_stream_is_not_cached(tmp_path, completions):
+    model = _model(tmp_path)
+    stream = model.stream('question')
+    next(stream)
+    stream.close()
+    assert list(model.stream('question')) != [COMPLETION]
+
+
+class StreamWriter(Writer):
+    def write(self):
+        return self._gen('question', ('Intro',))
+
+
+def test_writer_forwards_deltas(tmp_path, completions):
+    received = []
+    writer = StreamWriter(_model(tmp_path), on_delta=lambda key, delta: received.append((key, delta)))
+    assert writer.write() == COMPLETION
+    assert len(received) > 1
+    assert {key for key, _ in received} == {('Intro',)}
+    assert ''.join(delta for _, delta in received) == COMPLETION
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+import pytest
+
+from sine.common.trace import RunTrace, run_trace, stage
+from sine.models.api_model import APIModel, LLMCache, RateLimiter
+
+# the sdks expose the usage of the last stream chunk as a plain dict
+USAGE = dict(prompt_tokens=3, completion_tokens=5, total_tokens=8)
+
+
+@pytest.fixture
+def model(fake_completions, tmp_path):
+    fake_completions(reply=lambda model, delay: 'Rust', usage=dict(USAGE))
+    return APIModel('llama3-8b-8192', rate_limiter=RateLimiter({}), cache=LLMCache(str(tmp_path / 'llm.sqlite')))
+
+
+def test_streamed_tokens_per_stage(tmp_path, model):
+    async def consume():
+        return [delta async for delta in model.astream('question', use_cache=False)]
+
+    with run_trace(RunTrace('rust')) as trace:
+        with stage('outline_draft'):
+            list(model.stream('question', use_cache=False))
+        with stage('subsection'):
+            asyncio.run(consume())
+            asyncio.run(consume())
+
+    summary = trace.summary()
+    assert summary['outline_draft']['prompt_tokens'] == 3
+    assert summary['outline_draft']['completion_tokens'] == 5
+    assert summary['subsection']['calls'] == 2
+    assert summary['subsection']['prompt_tokens'] == 6
+    assert summary['subsection']['completion_tokens'] == 10
+
+    trace.save(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as f:
+        saved = json.load(f)
+    assert all(record['stream'] and record['prompt_tokens'] > 0 and record['completion_tokens'] > 0
+               for record in saved['records'])
+    assert saved['summary_by_model']['llama3-8b-8192']['completion_tokens'] == 15